@@ -0,0 +1,283 @@
+# Асинхронный движок опроса устройств на asyncio + asyncssh.
+# Повторяет сигнатуры и формат результата send_command_parallel и
+# send_commands_parallel из send_commands, но все SSH-сессии обслуживаются
+# одним event loop. Количество одновременных сессий ограничено семафором.
+import asyncio
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from datetime import datetime
+
+import raw_archive
+import textfsm_registry
+from concurrency import LIMITER
+from pacing import command_delay
+from timings import TIMINGS
+
+try:
+    import asyncssh
+except ImportError:
+    asyncssh = None
+
+start_msg = '===> {} Отправка: {}'
+received_msg = '<=== {} Получение: {}'
+
+# Отключение постраничного вывода по платформам
+PAGING_COMMANDS = {
+    'cisco_ios': 'terminal length 0',
+    'cisco_s300': 'terminal datadump',
+    'ruckus_fastiron': 'skip-page-display',
+    'brocade_fastiron': 'skip-page-display',
+}
+PROMPT_RE = re.compile(r'^[\w.\-@()/:]+[#>]\s*$')
+LOGIN_RE = re.compile(r'(User Name|Username|Password):\s*$', re.I)
+READ_TIMEOUT = float(os.environ.get("NET_ASYNC_READ_TIMEOUT", 60))
+CONNECT_TIMEOUT = float(os.environ.get("NET_ASYNC_CONNECT_TIMEOUT", 20))
+
+
+class AsyncSession:
+    """Интерактивная SSH-сессия с сетевым устройством.
+
+    Args:
+        device (dict): Параметры устройства в формате NetMiko
+    """
+
+    def __init__(self, device):
+        self.device = device
+        self.address = device.get('ip') or device.get('host')
+        self.host = device.get('host', self.address)
+        self.labels = {'ip': self.address,
+                       'device_type': device.get('device_type')}
+        self.prompt = None
+        self._conn = None
+        self._process = None
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    async def connect(self):
+        # asyncssh устанавливает TCP и SSH одним вызовом
+        with TIMINGS.phase(self.host, 'ssh_login', **self.labels):
+            self._conn = await asyncio.wait_for(
+                asyncssh.connect(
+                    self.address, port=self.device.get('port', 22),
+                    username=self.device['username'],
+                    password=self.device['password'],
+                    known_hosts=None),
+                CONNECT_TIMEOUT)
+        with TIMINGS.phase(self.host, 'prompt', **self.labels):
+            self._process = await self._conn.create_process(
+                term_type='vt100', term_size=(511, 1000))
+            output = await self._read_until_prompt(login=True)
+            self.prompt = output.rstrip().splitlines()[-1].strip()
+            paging = PAGING_COMMANDS.get(self.device.get('device_type'))
+            if paging:
+                await self._execute(paging)
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+
+    async def _read_until_prompt(self, login=False):
+        """Чтение канала до приглашения командной строки.
+
+        SG300 после SSH-аутентификации повторно спрашивает логин и пароль,
+        при login=True ответы на эти запросы отправляются автоматически.
+        """
+        buffer = ''
+        while True:
+            chunk = await asyncio.wait_for(
+                self._process.stdout.read(65536), READ_TIMEOUT)
+            if not chunk:
+                raise ConnectionError(f"Канал {self.address} закрыт")
+            buffer += chunk.replace('\r\n', '\n').replace('\r', '')
+            last_line = buffer.rsplit('\n', 1)[-1]
+            if login:
+                match = LOGIN_RE.search(last_line)
+                if match:
+                    field = match.group(1).lower()
+                    answer = (self.device['password'] if field == 'password'
+                              else self.device['username'])
+                    self._process.stdin.write(answer + '\n')
+                    buffer = ''
+                    continue
+            if self.prompt is not None:
+                if last_line.strip() == self.prompt:
+                    return buffer
+            elif PROMPT_RE.match(last_line.strip()):
+                return buffer
+
+    async def _execute(self, command):
+        """Отправка команды и получение вывода без эха и приглашения."""
+        self._process.stdin.write(command + '\n')
+        output = await self._read_until_prompt()
+        lines = output.split('\n')
+        if lines and command in lines[0]:
+            lines = lines[1:]
+        return '\n'.join(lines[:-1]).strip('\n')
+
+    async def send_command(self, command, use_textfsm=False):
+        """Команда с замером времени выполнения и разбора TextFSM."""
+        labels = dict(self.labels, command=command)
+        with TIMINGS.phase(self.host, 'command', **labels):
+            output = await self._execute(command)
+        raw_archive.store(self.device, command, output)
+        if use_textfsm:
+            with TIMINGS.phase(self.host, 'parse', **labels):
+                output = await textfsm_registry.parse_async(
+                    output, self.device['device_type'], command)
+        return output
+
+
+async def send_show_command(device, command, textfsm=True):
+    """Асинхронный аналог send_commands.send_show_command"""
+    ip = device['ip']
+    host = device['host']
+    logging.info(start_msg.format(datetime.now().time(), ip))
+    async with LIMITER.async_slot(ip) as slot:
+        started = time.monotonic()
+        async with AsyncSession(device) as ssh:
+            slot.latency = time.monotonic() - started
+            output = await ssh.send_command(command, use_textfsm=textfsm)
+    logging.info(received_msg.format(datetime.now().time(), ip))
+    return {host: output}
+
+
+async def send_commands(device, commands):
+    """Асинхронный аналог send_commands.send_commands"""
+    ip = device['ip']
+    host = device['host']
+    result = {host: {}}
+    logging.info(start_msg.format(datetime.now().time(), ip))
+    delay = command_delay(device['device_type'])
+    async with LIMITER.async_slot(ip) as slot:
+        started = time.monotonic()
+        async with AsyncSession(device) as ssh:
+            slot.latency = time.monotonic() - started
+            for index, (command, textfsm) in enumerate(commands):
+                if index and delay:
+                    await asyncio.sleep(delay)
+                result[host][command] = await ssh.send_command(
+                    command, use_textfsm=textfsm)
+    logging.info(received_msg.format(datetime.now().time(), ip))
+    return result
+
+
+async def _produce(func, devices, args, limit, results):
+    semaphore = asyncio.BoundedSemaphore(limit)
+
+    async def bounded(device):
+        async with semaphore:
+            return await func(device, *args)
+
+    tasks = [asyncio.ensure_future(bounded(device)) for device in devices]
+    try:
+        for task in asyncio.as_completed(tasks):
+            results.put((True, await task))
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def _iter(func, devices, args, limit):
+    """Event loop работает в отдельном потоке, результаты по одному
+    передаются через очередь вызывающему коду."""
+    if asyncssh is None:
+        raise RuntimeError(
+            "Для NET_BACKEND=asyncio требуется пакет asyncssh")
+    if "NET_TEXTFSM" not in os.environ:
+        os.environ["NET_TEXTFSM"] = "/usr/local/scripts/templates"
+    results = queue.Queue()
+    done = object()
+
+    def runner():
+        try:
+            asyncio.run(_produce(
+                func, devices, args, max(limit or LIMITER.maximum, 1),
+                results))
+        except BaseException as error:
+            results.put((False, error))
+        finally:
+            results.put(done)
+
+    thread = threading.Thread(target=runner, name='async_engine', daemon=True)
+    thread.start()
+    while True:
+        item = results.get()
+        if item is done:
+            break
+        ok, value = item
+        if not ok:
+            raise value
+        yield value
+    thread.join()
+
+
+def iter_command_parallel(devices, command, limit=None, textfsm=True):
+    """Генератор: одна команда show на устройства через один event loop
+
+    Args:
+        devices (list): Список словарей содержащие информацию для подключения
+        command (str): команда отправляемая на устройства
+        limit (int, optional): Потолок одновременных сессий. Внутри него
+        число сессий регулирует concurrency.LIMITER.
+        textfsm (bool, optional): Использовать TextFSM. Defaults to True.
+
+    Yields:
+        dict: hostname: вывод с устройства
+    """
+    return _iter(send_show_command, devices, (command, textfsm), limit)
+
+
+def iter_commands_parallel(devices, commands, limit=None):
+    """Генератор: несколько команд show на устройства через один event loop
+
+    Args:
+        devices (list): Список словарей содержащие информацию для подключения
+        commands (list): список кортежей (команда, использовать TextFSM)
+        limit (int, optional): Потолок одновременных сессий. Внутри него
+        число сессий регулирует concurrency.LIMITER.
+
+    Yields:
+        dict: hostname: словарь команда - вывод
+    """
+    return _iter(send_commands, devices, (commands,), limit)
+
+
+def send_command_parallel(devices, command, limit=None, textfsm=True):
+    """Отправка одной команды show на устройства через один event loop
+
+    Args:
+        devices (list): Список словарей содержащие информацию для подключения
+        command (str): команда отправляемая на устройства
+        limit (int, optional): Потолок одновременных сессий. Внутри него
+        число сессий регулирует concurrency.LIMITER.
+        textfsm (bool, optional): Использовать TextFSM. Defaults to True.
+
+    Returns:
+        [list]: список словарей ключ - hostname. Значение вывод с устройства
+    """
+    return list(iter_command_parallel(devices, command, limit, textfsm))
+
+
+def send_commands_parallel(devices, commands, limit=None):
+    """Отправка нескольких команд show на устройства через один event loop
+
+    Args:
+        devices (list): Список словарей содержащие информацию для подключения
+        commands (list): список кортежей (команда, использовать TextFSM)
+        limit (int, optional): Потолок одновременных сессий. Внутри него
+        число сессий регулирует concurrency.LIMITER.
+
+    Returns:
+        [list]: список словарей ключ - hostname. Значение словарь
+        команда: вывод
+    """
+    return list(iter_commands_parallel(devices, commands, limit))
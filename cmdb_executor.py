@@ -0,0 +1,162 @@
+import json
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# Запросов к Insight в секунду и одновременных запросов. Потоков не больше
+# пула подключений requests (10), чтобы keep-alive сессия CmdbMirror не
+# открывала лишних соединений.
+RATE = float(os.environ.get("NET_CMDB_RATE", 10))
+WORKERS = int(os.environ.get("NET_CMDB_WORKERS", 8))
+# Повторы при 429, 5xx и ошибках соединения, пауза растёт вдвое
+RETRIES = int(os.environ.get("NET_CMDB_RETRIES", 5))
+BACKOFF = float(os.environ.get("NET_CMDB_BACKOFF", 1))
+REPORT_DIR = os.environ.get(
+    "NET_CMDB_REPORT_DIR", "/usr/local/scripts/output")
+
+
+class TokenBucket:
+    """Ограничение частоты запросов: rate в секунду, пачкой не больше
+    burst."""
+
+    def __init__(self, rate=RATE, burst=None):
+        self.rate = rate
+        self.burst = burst or max(1, int(rate))
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Ожидание свободного токена."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def _response(error):
+    return getattr(error, 'response', None)
+
+
+def retryable(error):
+    """Стоит ли повторять запрос: 429, 5xx или ответа нет вовсе
+    (ошибка соединения, таймаут)."""
+    response = _response(error)
+    if response is None:
+        return isinstance(error, (OSError, ConnectionError, TimeoutError))
+    return response.status_code == 429 or response.status_code >= 500
+
+
+def _delay(error, attempt, backoff):
+    """Пауза перед повтором: Retry-After ответа или экспонента со
+    случайной составляющей (full jitter)."""
+    response = _response(error)
+    retry_after = (response.headers.get('Retry-After')
+                   if response is not None else None)
+    if retry_after and retry_after.isdigit():
+        return float(retry_after)
+    return random.uniform(0, backoff * 2 ** attempt)
+
+
+class CmdbExecutor:
+    """Параллельная запись в Insight с ограничением частоты и повторами.
+
+    Args:
+        rate (float, optional): запросов в секунду
+        workers (int, optional): одновременных запросов
+        retries (int, optional): повторов одного запроса
+        backoff (float, optional): базовая пауза перед повтором, сек
+    """
+
+    def __init__(self, rate=RATE, workers=WORKERS, retries=RETRIES,
+                 backoff=BACKOFF):
+        self.bucket = TokenBucket(rate)
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+
+    def _call(self, name, function, args):
+        for attempt in range(self.retries + 1):
+            self.bucket.acquire()
+            try:
+                return function(*args)
+            except Exception as error:
+                if attempt == self.retries or not retryable(error):
+                    raise
+                delay = _delay(error, attempt, self.backoff)
+                logging.warning(f"{name}: {error}, повтор через {delay:.1f} с")
+                time.sleep(delay)
+
+    def run(self, calls):
+        """Выполнение запросов.
+
+        Args:
+            calls (iterable): кортежи (ключ, имя для лога, функция,
+            аргументы), например (key, obj.name, obj.update_object, (value,))
+
+        Returns:
+            dict: ключ: {'name', 'error', 'status', 'body'} для запросов,
+            которые не удалось выполнить
+        """
+        failed = {}
+        started = time.perf_counter()
+        with ThreadPoolExecutor(self.workers,
+                                thread_name_prefix='Cmdb') as executor:
+            futures = {
+                executor.submit(self._call, name, function, args): (key, name)
+                for key, name, function, args in calls}
+            for future in as_completed(futures):
+                key, name = futures[future]
+                error = future.exception()
+                if error is None:
+                    continue
+                response = _response(error)
+                failed[key] = {
+                    'name': name,
+                    'error': str(error),
+                    'status': getattr(response, 'status_code', None),
+                    'body': getattr(response, 'text', None),
+                }
+                logging.error(f"{name}: ошибка обновления CMDB: {error}")
+        logging.info(
+            f"CMDB: запросов {len(futures)}, ошибок {len(failed)} за "
+            f"{time.perf_counter() - started:.1f} с")
+        return failed
+
+
+def write_report(failed, script, directory=REPORT_DIR):
+    """Отчёт о необновлённых объектах в <directory>/<script>_failed.json.
+    Отчёт прошлого запуска перезаписывается, в том числе пустым.
+
+    Returns:
+        str: путь к отчёту
+    """
+    path = os.path.join(directory, f"{script}_failed.json")
+    with open(path, 'w') as f:
+        json.dump(failed, f, ensure_ascii=False, indent=2, default=str)
+    if failed:
+        logging.error(f"Не обновлено в CMDB: {len(failed)}, отчёт - {path}")
+    return path
+
+
+def read_report(script, directory=REPORT_DIR):
+    """Отчёт прошлого запуска write_report, пустой если отчёта нет.
+
+    Returns:
+        dict: ключ: {'name', 'error', 'status', 'body'}
+    """
+    path = os.path.join(directory, f"{script}_failed.json")
+    if not os.path.isfile(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
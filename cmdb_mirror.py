@@ -0,0 +1,366 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+
+import requests
+
+# Каталог локальной копии CMDB
+MIRROR_DIR = os.environ.get(
+    "NET_CMDB_MIRROR", "/usr/local/scripts/output/cmdb_mirror")
+# Полная загрузка раз в столько часов: удалённые в CMDB объекты
+# инкрементальное обновление не видит
+FULL_REFRESH_HOURS = float(os.environ.get("NET_CMDB_FULL_REFRESH", 24))
+# Запас на расхождение часов и долгую загрузку, минут
+SKEW_MINUTES = 10
+PAGE_SIZE = 500
+API = "/rest/insight/1.0"
+# Типы атрибутов Insight (defaultType)
+INTEGER = 1
+BOOLEAN = 2
+
+
+def _plain(value):
+    """Значение из objectAttributeValues: ссылка - имя объекта (objectKey
+    остаётся в values_json и MirrorAttribute.keys), пользователь - логин,
+    остальное - value."""
+    if 'referencedObject' in value:
+        return value['referencedObject'].get('label')
+    if 'user' in value:
+        return value['user'].get('name')
+    return value.get('value', value.get('displayValue'))
+
+
+def _convert(value, definition):
+    default_type = (definition.get('defaultType') or {}).get('id')
+    if default_type == BOOLEAN and isinstance(value, str):
+        return value.lower() == 'true'
+    if default_type == INTEGER and isinstance(value, str) and value.isdigit():
+        return int(value)
+    return value
+
+
+def _reference(definition):
+    """Тип объектов, на который ссылается атрибут: dict с id, name и
+    objectSchemaId или None для прочих атрибутов."""
+    reference = definition.get('referenceObjectType')
+    if not reference and definition.get('referenceObjectTypeId'):
+        reference = {'id': definition['referenceObjectTypeId']}
+    return reference or None
+
+
+class MirrorAttribute:
+    """Атрибут объекта из локальной копии: id атрибута типа, имя,
+    value (список для атрибутов с несколькими значениями), исходные
+    значения values_json и, у ссылочных атрибутов, objectKey объектов
+    в keys."""
+
+    def __init__(self, definition, values_json):
+        self.id = definition['id']
+        self.name = definition['name']
+        self.values_json = values_json
+        self.keys = [i['referencedObject'].get('objectKey')
+                     for i in values_json if 'referencedObject' in i]
+        values = [_convert(_plain(i), definition) for i in values_json]
+        if definition.get('maximumCardinality', 1) != 1:
+            self.value = values
+        else:
+            self.value = values[0] if values else None
+
+
+class MirrorObject:
+    """Объект CMDB из локальной копии с интерфейсом объекта jirainsight:
+    id, name, attributes, object_json, update_object, get_jira_issues."""
+
+    def __init__(self, mirror, object_type, object_json):
+        self._mirror = mirror
+        self.object_type = object_type
+        self.object_json = object_json
+        self.id = object_json['id']
+        self.name = object_json['label']
+        self.key = object_json.get('objectKey')
+        self.JIRA_issues = {'jiraIssues': []}
+        values = {i['objectTypeAttributeId']: i['objectAttributeValues']
+                  for i in object_json.get('attributes', ())}
+        self.attributes = {
+            definition['name']: MirrorAttribute(
+                definition, values.get(definition['id'], []))
+            for definition in object_type.definitions}
+
+    def update_object(self, attributes):
+        """Запись атрибутов в CMDB и в копию в памяти. Значение ссылочного
+        атрибута - objectKey или имя объекта, имя заменяется на objectKey
+        по копии типа, на который ссылается атрибут.
+
+        Args:
+            attributes (dict): id атрибута: значение или список значений
+
+        Returns:
+            dict: объект из ответа Insight
+
+        Raises:
+            KeyError: объекта с таким именем нет в копии
+        """
+        payload = {'objectTypeId': self.object_type.id, 'attributes': [
+            {'objectTypeAttributeId': attribute_id,
+             'objectAttributeValues': [
+                 {'value': self.object_type.value(attribute_id, i)}
+                 for i in (value if isinstance(value, list) else [value])
+                 if i is not None]}
+            for attribute_id, value in attributes.items()]}
+        result = self._mirror.request('PUT', f"object/{self.id}", payload)
+        self.object_type.store(result)
+        return result
+
+    def get_jira_issues(self):
+        """Связанные задачи JIRA, сохраняются в JIRA_issues."""
+        self.JIRA_issues = self._mirror.request(
+            'GET', f"object/{self.id}/jiraissues")
+        return self.JIRA_issues
+
+
+class MirrorObjectType:
+    """Тип объектов из локальной копии. objects - id: MirrorObject, как у
+    jirainsight schema.get_object_type. references - имя ссылочного
+    атрибута: MirrorObjectType, на который он ссылается (заполняет
+    CmdbMirror.get_object_type)."""
+
+    def __init__(self, mirror, state):
+        self._mirror = mirror
+        self.state = state
+        self.id = state['type_id']
+        self.name = state['type_name']
+        self.definitions = state['attributes']
+        self.objects = {}
+        self.references = {}
+        self._keys = None
+        self._lock = threading.Lock()
+        for object_json in state['objects'].values():
+            self._add(object_json)
+
+    def _add(self, object_json):
+        self.objects[object_json['id']] = MirrorObject(
+            self._mirror, self, object_json)
+        self._keys = None
+
+    def _index(self):
+        keys = self._keys
+        if keys is None:
+            keys = self._keys = {i.name: i.key for i in self.objects.values()}
+        return keys
+
+    def key(self, name):
+        """objectKey объекта по имени или None."""
+        return self._index().get(name)
+
+    def value(self, attribute_id, value):
+        """Значение атрибута для записи в Insight: bool - строкой, имя
+        объекта у ссылочного атрибута - его objectKey."""
+        if isinstance(value, bool):
+            return str(value).lower()
+        for definition in self.definitions:
+            if definition['id'] != attribute_id:
+                continue
+            reference = self.references.get(definition['name'])
+            if reference is None:
+                break
+            if value in reference._index().values():
+                return value
+            key = reference.key(value)
+            if key is None:
+                raise KeyError(
+                    f"{definition['name']}: нет объекта {value} "
+                    f"в {reference.name}")
+            return key
+        return value
+
+    def store(self, object_json):
+        """Обновление объекта в памяти после записи в CMDB. Файл копии
+        не перезаписывается: изменённый объект придёт со следующим
+        обновлением по Updated."""
+        if 'attributes' not in object_json:
+            return
+        with self._lock:
+            self.state['objects'][str(object_json['id'])] = object_json
+            self._add(object_json)
+
+
+class CmdbMirror:
+    """Локальная копия типов объектов Insight.
+
+    Первый запуск загружает тип целиком через IQL, следующие - только
+    объекты, изменённые после прошлой загрузки (Updated >= время - запас).
+    Раз в FULL_REFRESH_HOURS тип загружается целиком, чтобы убрать
+    удалённые объекты. Копия хранится в MIRROR_DIR, по файлу на тип.
+    Вместе с типом обновляются типы, на которые ссылаются его атрибуты:
+    по ним имена в ссылочных атрибутах заменяются на objectKey.
+
+    Args:
+        url (str): адрес JIRA
+        login (str): логин
+        password (str): пароль
+        schema_name (str): имя схемы объектов
+        path (str, optional): каталог копии
+    """
+
+    def __init__(self, url, login, password, schema_name, path=MIRROR_DIR):
+        self.url = url.rstrip('/')
+        self.schema_name = schema_name
+        self.path = path
+        self.session = requests.Session()
+        self.session.auth = (login, password)
+        self._schema_id = None
+        self._types = {}
+
+    def request(self, method, endpoint, payload=None, params=None):
+        """Запрос к REST API Insight через общую keep-alive сессию.
+        Ошибки HTTP - requests.HTTPError с response."""
+        response = self.session.request(
+            method, f"{self.url}{API}/{endpoint}", json=payload,
+            params=params, timeout=60)
+        response.raise_for_status()
+        return response.json()
+
+    @property
+    def schema_id(self):
+        if self._schema_id is None:
+            for schema in self.request(
+                    'GET', 'objectschema/list')['objectschemas']:
+                if schema['name'] == self.schema_name:
+                    self._schema_id = schema['id']
+                    break
+            else:
+                raise KeyError(f"Нет схемы {self.schema_name}")
+        return self._schema_id
+
+    def _file(self, type_name):
+        name = re.sub(r'[^\w.-]+', '_', f"{self.schema_name}_{type_name}")
+        return os.path.join(self.path, f"{name}.json")
+
+    def load(self, type_name):
+        """Состояние типа из копии или None."""
+        path = self._file(type_name)
+        if not os.path.isfile(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def save(self, state):
+        """Сохранение состояния типа (атомарно)."""
+        os.makedirs(self.path, exist_ok=True)
+        path = self._file(state['type_name'])
+        tmp = f"{path}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump(state, f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+    def _type_id(self, type_name):
+        for object_type in self.request(
+                'GET', f"objectschema/{self.schema_id}/objecttypes/flat"):
+            if object_type['name'] == type_name:
+                return object_type['id']
+        raise KeyError(f"Нет типа {type_name} в схеме {self.schema_name}")
+
+    def _iql(self, iql, schema_id):
+        """Все объекты по IQL постранично."""
+        page = 1
+        while True:
+            result = self.request('GET', 'iql/objects', params={
+                'objectSchemaId': schema_id, 'iql': iql, 'page': page,
+                'resultPerPage': PAGE_SIZE, 'includeAttributes': 'true'})
+            yield from result['objectEntries']
+            if page >= result.get('pageSize', 1):
+                return
+            page += 1
+
+    def refresh(self, type_name, full=False, type_id=None, schema_id=None):
+        """Обновление копии типа: целиком при первом запуске, full или
+        истёкшем FULL_REFRESH_HOURS, иначе только изменённые объекты.
+
+        Args:
+            type_name (str): имя типа
+            full (bool, optional): загрузить целиком
+            type_id (int, optional): id типа, если известен
+            schema_id (int, optional): схема типа, по умолчанию schema_name
+
+        Returns:
+            dict: состояние типа
+        """
+        started = time.perf_counter()
+        state = self.load(type_name)
+        now = datetime.now()
+        if state is not None and not full:
+            full = now - datetime.fromisoformat(state['full_sync']) > \
+                timedelta(hours=FULL_REFRESH_HOURS)
+        full = state is None or full
+        if full:
+            state = {
+                'type_name': type_name,
+                'type_id': type_id or self._type_id(type_name),
+                'schema_id': schema_id or self.schema_id,
+                'objects': {},
+                'full_sync': now.isoformat(),
+            }
+            state['attributes'] = self.request(
+                'GET', f"objecttype/{state['type_id']}/attributes")
+        iql = f"objectTypeId = {state['type_id']}"
+        if not full:
+            since = datetime.fromisoformat(state['synced']) - timedelta(
+                minutes=SKEW_MINUTES)
+            iql += f' AND Updated >= "{since:%Y-%m-%d %H:%M}"'
+        fetched = 0
+        for object_json in self._iql(
+                iql, state.get('schema_id') or self.schema_id):
+            state['objects'][str(object_json['id'])] = object_json
+            fetched += 1
+        state['synced'] = now.isoformat()
+        self.save(state)
+        logging.info(
+            f"CMDB {type_name}: загружено {fetched} "
+            f"{'объектов' if full else 'изменённых объектов'}, "
+            f"в копии {len(state['objects'])}, "
+            f"{time.perf_counter() - started:.1f} с")
+        return state
+
+    def get_object_type(self, type_name, refresh=True, references=True,
+                        type_id=None, schema_id=None):
+        """Тип объектов из копии, по умолчанию после обновления. За время
+        жизни CmdbMirror каждый тип загружается один раз.
+
+        Args:
+            type_name (str): имя типа
+            refresh (bool, optional): обновить копию перед чтением
+            references (bool, optional): загрузить и типы, на которые
+            ссылаются атрибуты (MirrorObjectType.references)
+            type_id (int, optional): id типа, если известен
+            schema_id (int, optional): схема типа
+
+        Returns:
+            MirrorObjectType
+        """
+        object_type = self._types.get(type_name)
+        if object_type is None:
+            state = self.refresh(type_name, type_id=type_id,
+                                 schema_id=schema_id) \
+                if refresh else self.load(type_name)
+            if state is None:
+                raise KeyError(f"Нет копии типа {type_name}")
+            object_type = self._types[type_name] = MirrorObjectType(
+                self, state)
+        if references and not object_type.references:
+            for definition in object_type.definitions:
+                reference = _reference(definition)
+                if reference is None:
+                    continue
+                if not reference.get('name'):
+                    reference = self.request(
+                        'GET', f"objecttype/{reference['id']}")
+                object_type.references[definition['name']] = \
+                    self.get_object_type(
+                        reference['name'], refresh, references=False,
+                        type_id=reference['id'],
+                        schema_id=reference.get('objectSchemaId'))
+        return object_type
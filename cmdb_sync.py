@@ -0,0 +1,213 @@
+import logging
+from collections import namedtuple
+
+from cmdb_executor import CmdbExecutor
+
+# Атрибуты, по которым устройство ищется в CMDB, в порядке приоритета.
+# Name - имя объекта, остальные - значения атрибутов.
+MATCH_KEYS = ('Name', 'Serial Number')
+
+# Изменение объекта CMDB: ключ в object_type.objects, имя, атрибуты для
+# update_object (id атрибута: значение) и разница имя: (было, стало)
+Update = namedtuple('Update', 'key name attributes diff')
+
+
+def object_key(schema_object):
+    """objectKey объекта CMDB (XX-123), которым задаётся ссылка на него."""
+    return schema_object.object_json.get('objectKey')
+
+
+def reference_keys(attribute):
+    """objectKey объектов, на которые ссылается атрибут, по values_json."""
+    return [i['referencedObject'].get('objectKey')
+            for i in attribute.values_json or () if 'referencedObject' in i]
+
+
+def normalize(value):
+    """Значение атрибута для сравнения: пустые строки и списки - None,
+    списки - кортежи строк, прочее кроме bool - строка без пробелов по
+    краям."""
+    if isinstance(value, (list, tuple)):
+        value = tuple(sorted(str(i).strip() for i in value if i is not None))
+        return value or None
+    if value is None or isinstance(value, bool):
+        return value
+    value = str(value).strip()
+    return value or None
+
+
+class CmdbIndex:
+    """Индекс объектов типа CMDB по имени и ключевым атрибутам.
+
+    Строится за один проход по object_type.objects, поиск устройства -
+    обращение к словарю вместо перебора всех объектов.
+
+    Args:
+        object_type: тип объектов CmdbMirror.get_object_type или
+        jirainsight schema.get_object_type
+        keys (tuple, optional): атрибуты для поиска, см. MATCH_KEYS
+    """
+
+    def __init__(self, object_type, keys=MATCH_KEYS):
+        self.object_type = object_type
+        self.keys = keys
+        self._index = {key: {} for key in keys}
+        for object_id, schema_object in object_type.objects.items():
+            for key in keys:
+                value = normalize(self._value(schema_object, key))
+                if value is None:
+                    continue
+                found = self._index[key].setdefault(value, object_id)
+                if found != object_id:
+                    logging.warning(
+                        f"CMDB: {key} = {value} у нескольких объектов "
+                        f"({found}, {object_id})")
+
+    @staticmethod
+    def _value(schema_object, name):
+        if name == 'Name':
+            return schema_object.name
+        attribute = schema_object.attributes.get(name)
+        return attribute.value if attribute is not None else None
+
+    def key(self, name):
+        """objectKey объекта по имени или None."""
+        object_id = self._index['Name'].get(normalize(name)) \
+            if 'Name' in self._index else None
+        if object_id is None:
+            return None
+        return object_key(self.object_type.objects[object_id])
+
+    def find(self, fields):
+        """Ключ объекта CMDB для устройства или None.
+
+        Args:
+            fields (dict): собранные атрибуты устройства
+        """
+        for key in self.keys:
+            value = normalize(fields.get(key))
+            if value is not None and value in self._index[key]:
+                return self._index[key][value]
+        return None
+
+    def diff(self, object_id, fields, references=None):
+        """Атрибуты, значение которых в CMDB отличается от собранного.
+        Атрибуты, которых нет у типа объекта, пропускаются.
+
+        Ссылочные атрибуты сравниваются и записываются по objectKey:
+        собранное имя ищется в индексе типа, на который ссылается
+        атрибут. Если объекта с таким именем нет, атрибут не меняется.
+
+        Args:
+            object_id: ключ объекта в object_type.objects
+            fields (dict): собранные атрибуты устройства
+            references (dict, optional): имя ссылочного атрибута: CmdbIndex
+            типа, на который он ссылается
+
+        Returns:
+            Update: изменение объекта, attributes пуст - изменений нет
+        """
+        schema_object = self.object_type.objects[object_id]
+        attributes, changes = {}, {}
+        for name, value in fields.items():
+            attribute = schema_object.attributes.get(name)
+            if attribute is None:
+                continue
+            old = attribute.value
+            if name in (references or {}):
+                new = _resolve(references[name], value)
+                if new is None:
+                    logging.warning(
+                        f"{schema_object.name}: {name} = {value} нет в CMDB")
+                    continue
+                if normalize(reference_keys(attribute)) != normalize(new):
+                    # Пустой список очищает ссылку
+                    attributes[attribute.id] = \
+                        new if isinstance(value, (list, tuple)) or not new \
+                        else new[0]
+                    changes[name] = (old, value)
+            elif normalize(old) != normalize(value):
+                attributes[attribute.id] = value
+                changes[name] = (old, value)
+        return Update(object_id, schema_object.name, attributes, changes)
+
+
+def _resolve(index, value):
+    """Имена объектов в список objectKey, None если какого-то нет.
+    Пустое значение - пустой список (ссылка очищается)."""
+    names = value if isinstance(value, (list, tuple)) else [value]
+    keys = []
+    for name in names:
+        if normalize(name) is None:
+            continue
+        key = index.key(name)
+        if key is None:
+            return None
+        keys.append(key)
+    return keys
+
+
+def plan(object_type, devices, keys=MATCH_KEYS, references=None):
+    """Изменения CMDB по собранной инвентаризации.
+
+    Args:
+        object_type: тип объектов CMDB
+        devices (dict): hostname: атрибуты устройства
+        keys (tuple, optional): атрибуты для поиска объекта
+        references (dict, optional): имя ссылочного атрибута: тип
+        объектов, на который он ссылается (например 'Parent unit':
+        object_type). Значения таких атрибутов - имена объектов.
+
+    Returns:
+        tuple: (список Update с изменениями, устройства без объекта в CMDB)
+    """
+    index = CmdbIndex(object_type, keys)
+    references = {
+        name: index if reference is object_type and 'Name' in keys
+        else CmdbIndex(reference, ('Name',))
+        for name, reference in (references or {}).items()}
+    updates, missing = [], []
+    for host, fields in devices.items():
+        object_id = index.find(fields)
+        if object_id is None:
+            missing.append(host)
+            continue
+        update = index.diff(object_id, fields, references)
+        if update.attributes:
+            updates.append(update)
+    logging.info(
+        f"CMDB: изменений {len(updates)}, без изменений "
+        f"{len(devices) - len(updates) - len(missing)}, "
+        f"не найдено {len(missing)}")
+    if missing:
+        logging.warning(f"Нет в CMDB: {missing[:20]}")
+    return updates, missing
+
+
+def apply(object_type, updates, executor=None):
+    """Отправка изменённых атрибутов, по запросу на объект, через
+    CmdbExecutor.
+
+    Returns:
+        dict: ключ: описание ошибки для объектов, которые не удалось
+        обновить
+    """
+    for update in updates:
+        for name, (old, new) in update.diff.items():
+            logging.info(f"{update.name}: {name} {old} -> {new}")
+    executor = executor or CmdbExecutor()
+    return executor.run(
+        (update.key, update.name,
+         object_type.objects[update.key].update_object, (update.attributes,))
+        for update in updates)
+
+
+def sync(object_type, devices, keys=MATCH_KEYS, references=None):
+    """plan и apply: в CMDB уходят только изменившиеся атрибуты.
+
+    Returns:
+        dict: ключ: описание ошибки для объектов, которые не удалось
+        обновить
+    """
+    updates, _ = plan(object_type, devices, keys, references)
+    return apply(object_type, updates)
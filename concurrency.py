@@ -0,0 +1,218 @@
+import asyncio
+import ipaddress
+import logging
+import os
+import socket
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+from netmiko.ssh_exception import (NetMikoAuthenticationException,
+                                   NetmikoTimeoutException)
+
+try:
+    from asyncssh import PermissionDenied
+except ImportError:
+    PermissionDenied = NetMikoAuthenticationException
+
+# Границы адаптивного лимита одновременных SSH-сессий
+MIN_SESSIONS = int(os.environ.get("NET_MIN_SESSIONS", 4))
+MAX_SESSIONS = int(os.environ.get("NET_MAX_SESSIONS", 200))
+START_SESSIONS = int(os.environ.get("NET_START_SESSIONS", 20))
+# Время подключения, выше которого считаем, что сеть/TACACS перегружены
+TARGET_LATENCY = float(os.environ.get("NET_TARGET_LATENCY", 5))
+# Потолки по подсетям, формат: 10.26.0.0/24=10,10.27.0.0/16=50
+SUBNET_LIMITS = os.environ.get("NET_SUBNET_LIMITS", "")
+
+OK = 'ok'
+TIMEOUT = 'timeout'
+AUTH = 'auth'
+ERROR = 'error'
+# Следующий этап (запись в СУБД) не успевает за сбором
+BACKPRESSURE = 'backpressure'
+
+
+def classify(error):
+    """Тип ошибки для регулятора: timeout, auth или error."""
+    if isinstance(error, (NetmikoTimeoutException, socket.timeout,
+                          asyncio.TimeoutError, TimeoutError)):
+        return TIMEOUT
+    if isinstance(error, (NetMikoAuthenticationException, PermissionDenied)):
+        return AUTH
+    return ERROR
+
+
+def parse_subnet_limits(value):
+    """Разбор строки потолков по подсетям.
+
+    Args:
+        value (str): строка вида '10.26.0.0/24=10,10.27.0.0/16=50'
+
+    Returns:
+        dict: ip_network: лимит
+    """
+    result = {}
+    for item in value.split(','):
+        if '=' not in item:
+            continue
+        subnet, limit = item.split('=', 1)
+        result[ipaddress.ip_network(subnet.strip())] = int(limit)
+    return result
+
+
+class AdaptiveLimiter:
+    """Адаптивный лимит одновременных SSH-сессий (AIMD).
+
+    Каждое быстрое успешное подключение увеличивает лимит на 1/limit
+    (в сумме +1 за "окно" из limit подключений). Таймаут, отказ
+    аутентификации или подключение дольше target_latency уменьшают лимит
+    в decrease раз, но не чаще раза за target_latency секунд, чтобы пачка
+    одновременных таймаутов не обрушила лимит до минимума.
+
+    Args:
+        initial (int): стартовый лимит
+        minimum (int): нижняя граница
+        maximum (int): верхняя граница
+        target_latency (float): допустимое время подключения, сек
+        decrease (float): множитель уменьшения
+        subnet_limits (dict): ip_network: потолок сессий в подсети
+    """
+
+    def __init__(self, initial=START_SESSIONS, minimum=MIN_SESSIONS,
+                 maximum=MAX_SESSIONS, target_latency=TARGET_LATENCY,
+                 decrease=0.5, subnet_limits=None):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency = target_latency
+        self.decrease = decrease
+        self.subnet_limits = subnet_limits or {}
+        self._limit = float(max(minimum, min(initial, maximum)))
+        self._in_flight = 0
+        self._subnet_in_flight = {}
+        self._last_decrease = 0
+        self._lock = threading.Condition()
+
+    @property
+    def limit(self):
+        return int(self._limit)
+
+    def _subnet(self, address):
+        try:
+            ip = ipaddress.ip_address(address)
+        except ValueError:
+            return None
+        for subnet in self.subnet_limits:
+            if ip in subnet:
+                return subnet
+        return None
+
+    def _can_start(self, subnet):
+        if self._in_flight >= self.limit:
+            return False
+        if subnet is not None:
+            busy = self._subnet_in_flight.get(subnet, 0)
+            return busy < self.subnet_limits[subnet]
+        return True
+
+    def _start(self, subnet):
+        self._in_flight += 1
+        if subnet is not None:
+            self._subnet_in_flight[subnet] = (
+                self._subnet_in_flight.get(subnet, 0) + 1)
+
+    def try_acquire(self, address):
+        """Занять слот без ожидания. Возвращает True, если слот получен."""
+        subnet = self._subnet(address)
+        with self._lock:
+            if not self._can_start(subnet):
+                return False
+            self._start(subnet)
+            return True
+
+    def acquire(self, address):
+        """Занять слот, при необходимости дождавшись освобождения."""
+        subnet = self._subnet(address)
+        with self._lock:
+            while not self._can_start(subnet):
+                self._lock.wait()
+            self._start(subnet)
+
+    def release(self, address, latency=None, outcome=OK):
+        """Освободить слот и учесть результат подключения.
+
+        Args:
+            address (str): адрес устройства
+            latency (float, optional): время подключения, сек
+            outcome (str, optional): ok, timeout, auth или error
+        """
+        subnet = self._subnet(address)
+        with self._lock:
+            self._in_flight -= 1
+            if subnet is not None:
+                self._subnet_in_flight[subnet] -= 1
+            self._record(latency, outcome)
+            self._lock.notify_all()
+
+    def _record(self, latency, outcome):
+        overloaded = outcome in (TIMEOUT, AUTH, BACKPRESSURE) or (
+            latency is not None and latency > self.target_latency)
+        now = time.monotonic()
+        if overloaded:
+            if now - self._last_decrease < self.target_latency:
+                return
+            self._last_decrease = now
+            previous = self.limit
+            self._limit = max(self.minimum, self._limit * self.decrease)
+            logging.info(
+                f"Лимит сессий {previous} -> {self.limit} ({outcome}, "
+                f"подключение {latency or 0:.1f} с)")
+        elif outcome == OK and latency is not None:
+            self._limit = min(self.maximum, self._limit + 1 / self._limit)
+
+    def backpressure(self):
+        """Сигнал от следующего этапа конвейера, что он не успевает.
+        Лимит уменьшается так же, как при таймауте."""
+        with self._lock:
+            self._record(None, BACKPRESSURE)
+
+    @contextmanager
+    def slot(self, address):
+        """Слот на время подключения и работы с устройством.
+
+        Время подключения задаётся вызывающим кодом в slot.latency,
+        исключения классифицируются и учитываются регулятором.
+        """
+        self.acquire(address)
+        report = _SlotReport()
+        try:
+            yield report
+        except Exception as error:
+            self.release(address, report.latency, classify(error))
+            raise
+        else:
+            self.release(address, report.latency, OK)
+
+    @asynccontextmanager
+    async def async_slot(self, address, poll=0.05):
+        """Асинхронный вариант slot для async_engine."""
+        while not self.try_acquire(address):
+            await asyncio.sleep(poll)
+        report = _SlotReport()
+        try:
+            yield report
+        except Exception as error:
+            self.release(address, report.latency, classify(error))
+            raise
+        else:
+            self.release(address, report.latency, OK)
+
+
+class _SlotReport:
+    """Сведения о подключении, которые заполняет владелец слота."""
+
+    def __init__(self):
+        self.latency = None
+
+
+# Регулятор на весь процесс
+LIMITER = AdaptiveLimiter(subnet_limits=parse_subnet_limits(SUBNET_LIMITS))
@@ -3,16 +3,26 @@
 import json
 import logging
 import os
+import re
 import time
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 
-import nmap3
-from netmiko import ConnectHandler
 from netmiko.ssh_exception import (NetMikoAuthenticationException,
                                    NetmikoTimeoutException)
+from concurrency import LIMITER
+from fingerprint_cache import (CACHE_FILE, FingerprintCache, cache_path,
+                               get_host_key)
+from net_sweep import sweep_network
+from ssh_pool import POOL
+from timings import TIMINGS
 from xfunctions import normalize_name, write_result_to_json
 
+try:
+    import nmap3
+except ImportError:
+    nmap3 = None
+
 logging.getLogger("paramiko").setLevel(logging.WARNING)
 logging.basicConfig(
     format='%(threadName)s %(name)s %(levelname)s: %(message)s',
@@ -20,52 +30,170 @@ logging.basicConfig(
 
 start_msg = '===> {} Соединение: {}'
 received_msg = '<=== {} Получен: {}'
-DEVICE_PLATFROMS = 'devices_platforms.json'
+# Способ сканирования сети: asyncio (net_sweep, только хосты с SSH) или nmap
+SCAN_BACKEND = os.environ.get("NET_SCAN_BACKEND", "asyncio")
+DEVICE_PLATFROMS = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'devices_platforms.json')
+# Платформа, если в выводе show version не найдено ни одной подстроки
+DEFAULT_PLATFORM = 'cisco_s300'
+# Драйверы NetMiko, которые перебираются при определении платформы,
+# и команда для каждого (по умолчанию команда из аргумента send_show)
+PROBE_TYPES = ['cisco_ios', 'cisco_s300']
+PROBE_COMMANDS = {'cisco_s300': 'show system'}
+# Подсказки по SSH-баннеру сервера (до аутентификации): подстрока - драйвер
+BANNER_HINTS = {
+    'Cisco': 'cisco_ios',
+    'RomSShell': 'ruckus_fastiron',
+}
+# Проверять имя неизменившихся устройств логином при каждом
+# update_device_list. По умолчанию нет: смена имени обнаруживается, когда
+# истекает TTL записи кэша (NET_FINGERPRINT_TTL) и устройство
+# проверяется заново
+PROBE_NAMES = os.environ.get("NET_PROBE_NAMES", "").lower() in (
+    "1", "true", "yes")
+# Вывод, означающий что драйвер или команда не подходят устройству
+INVALID_OUTPUT = re.compile(r'^\s*% ?(Invalid|Unrecognized|Unknown)', re.M)
+
+
+def load_platforms(path=DEVICE_PLATFROMS):
+    """Загрузка соответствий 'подстрока show version': device_type.
+    Порядок ключей в файле задаёт порядок проверки.
+
+    Args:
+        path (str, optional): путь к JSON-файлу соответствий
+
+    Returns:
+        dict: подстрока: device_type
+    """
+    with open(path) as f:
+        return json.load(f)
 
 
-def send_show(device, command):
+def detect_device_type(output, platforms):
+    """Определение device_type по выводу show version
+
+    Args:
+        output (str): вывод show version (или show system)
+        platforms (dict): подстрока: device_type
+
+    Returns:
+        str: device_type для NetMiko
+    """
+    for marker, device_type in platforms.items():
+        if marker in output:
+            return device_type
+    return DEFAULT_PLATFORM
+
+
+def banner_hint(banner):
+    """Драйвер NetMiko по SSH-баннеру сервера или None"""
+    if banner:
+        for marker, device_type in BANNER_HINTS.items():
+            if marker in banner:
+                return device_type
+    return None
+
+
+def _probe(device, device_type, command):
+    """Одна попытка: подключение драйвером device_type и команда.
+
+    Returns:
+        tuple: (device_type, prompt, output)
+    """
+    ip = device['host']
+    probe = dict(device, device_type=device_type)
+    command = PROBE_COMMANDS.get(device_type, command)
+    with LIMITER.slot(ip) as slot:
+        started = time.monotonic()
+        with POOL.session(probe) as ssh:
+            slot.latency = time.monotonic() - started
+            output = ssh.send_command(command)
+            # Исключение внутри session: сессия неподходящего драйвера
+            # закрывается, а не возвращается в пул
+            if not output or INVALID_OUTPUT.search(output):
+                raise ValueError(
+                    f"{ip}: {device_type} - нет корректного вывода")
+            prompt = ssh.find_prompt()
+    return device_type, prompt, output
+
+
+def _try_in_order(device, device_types, command):
+    """Попытки драйверами по очереди в порядке PROBE_TYPES, берётся
+    первая успешная. Порядок постоянный, поэтому устройство, которому
+    подходят оба драйвера, всегда определяется одинаково."""
+    error = None
+    for device_type in device_types:
+        try:
+            return _probe(device, device_type, command)
+        except (NetmikoTimeoutException, NetMikoAuthenticationException):
+            raise
+        except Exception as e:
+            error = e
+    raise error
+
+
+def send_show(device, command, device_type=None, banner=None):
     """Отправка show, используя NetMiko. Для создания словарей.
 
+    Сначала пробуется драйвер из device_type (известный из кэша) или
+    подсказанный SSH-баннером. Если он не подошёл или подсказки нет,
+    драйверы из PROBE_TYPES пробуются по очереди.
+    Таймаут и отказ аутентификации прекращают перебор: другой драйвер их
+    не исправит, а лишний логин нагружает AAA.
+
     Args:
         device (dict): Словарь с параметрами устройства
         command (str): Команда для выполнения по SSH.
         Например, 'show version'
+        device_type (str, optional): известный драйвер устройства
+        banner (str, optional): SSH-баннер сервера
 
     Returns:
         [dict]: Вывод команды с IP. device: output
     """
-    output = ""
     ip = device['host']
     logging.info(start_msg.format(datetime.now().time(), ip))
+    preferred = device_type or banner_hint(banner)
+    others = [i for i in PROBE_TYPES if i != preferred]
     try:
-        prompt = ip
-        with ConnectHandler(**device) as ssh:
-            output = ssh.send_command(command)
-            prompt = ssh.find_prompt()
-            logging.info(received_msg.format(datetime.now().time(), ip))
+        if preferred:
+            try:
+                found = _probe(device, preferred, command)
+            except (NetmikoTimeoutException, NetMikoAuthenticationException):
+                raise
+            except Exception:
+                logging.info(f"{ip}: драйвер {preferred} не подошёл")
+                found = _try_in_order(device, others, command)
+        else:
+            found = _try_in_order(device, others, command)
     except (NetmikoTimeoutException, NetMikoAuthenticationException):
         logging.warning(ip)
-    except OSError:
-        logging.warning(f"Ошибка OSError у {ip}. Меняем device_type")
-        device["device_type"] = "cisco_s300"
-        with ConnectHandler(**device) as ssh:
-            output = ssh.send_command("show system")
-            prompt = ssh.find_prompt()
-            logging.info(received_msg.format(datetime.now().time(), ip))
+        return {ip: ""}
+    except Exception as error:
+        logging.warning(f"Исключён {ip}. Не получен вывод: {error}")
+        return {ip: ""}
 
-    if output:
-        return {ip: [prompt, output]}
-    return {ip: ""}
-    logging.error(f"Исключён {ip} из результата функции. Не получен вывод.")
+    found_type, prompt, output = found
+    device["device_type"] = found_type
+    logging.info(received_msg.format(datetime.now().time(), ip))
+    return {ip: [prompt, output]}
 
 
-def generate_list_connet(iplist, login, password, limit=80):
+def generate_list_connet(iplist, login, password, limit=None, refresh=(),
+                         cache_file=CACHE_FILE):
     """Создаёт список словарей для передачи на подключение Netmiko
 
     Args:
         iplist (list): список IP-адресов коммутаторов
         login (str): Логин для подключения по SSH к коммутаторам
         password (str): Пароль для подключения по SSH к коммутаторам
+        limit (int, optional): Количество потоков. По умолчанию верхняя
+        граница адаптивного лимита. Число одновременных SSH-сессий
+        регулирует concurrency.LIMITER.
+        refresh (iterable, optional): IP-адреса, которые опрашиваются
+        логином независимо от кэша отпечатков.
+        cache_file (str, optional): файл кэша отпечатков, свой для
+        каждого списка устройств (fingerprint_cache.cache_path).
 
     Returns:
         [dict]: словарь с персонализированными настройками для подключения
@@ -77,23 +205,48 @@ def generate_list_connet(iplist, login, password, limit=80):
     logging.info("Генерация словарей для SSH-подключений")
     logging.info("*"*60)
     result = []
-    devices = [
-        {
+    platforms = load_platforms()
+    cache = FingerprintCache(cache_file)
+    if limit is None:
+        limit = LIMITER.maximum
+
+    # Отпечатки SSH-ключей снимаются без логина. Устройства с известным
+    # ключом и не истёкшим TTL берутся из кэша без опроса show version
+    with ThreadPoolExecutor(max_workers=max(limit, 1)) as executor:
+        host_keys = dict(zip(iplist, executor.map(get_host_key, iplist)))
+    devices = []
+    hints = {}
+    for ip in iplist:
+        host_key, banner = host_keys[ip]
+        entry = None if ip in refresh else cache.lookup(ip, host_key)
+        if entry:
+            result.append({
+                "host": entry['host'],
+                "device_type": entry['device_type'],
+                "ip": ip,
+                "username": login,
+                "password": password,
+            })
+            continue
+        devices.append({
             "device_type": "cisco_ios",
             "host": ip,
             "username": login,
             "password": password,
-        }
-        for ip in iplist
-    ]
-    if os.path.isfile(DEVICE_PLATFROMS):
-        with open(DEVICE_PLATFROMS) as f:
-            devices_platforms = json.load(f)
-
-    # Сбор информации с устройств в потоках. Кол-во по умолчанию 80
-    with ThreadPoolExecutor(max_workers=limit) as executor:
+        })
+        # Драйвер, подключившийся в прошлый раз, пробуется первым
+        known = cache.get(ip) or {}
+        hints[ip] = (known.get('driver') or known.get('device_type'), banner)
+    logging.info(
+        f"Из кэша взято {len(result)} устройств, на опрос {len(devices)}")
+
+    # Сбор информации с устройств в потоках. Кол-во одновременных
+    # подключений подбирает concurrency.LIMITER
+    by_ip = {device['host']: device for device in devices}
+    with ThreadPoolExecutor(max_workers=max(limit, 1)) as executor:
         result_all = [
-            executor.submit(send_show, device, "show version")
+            executor.submit(
+                send_show, device, "show version", *hints[device['host']])
             for device in devices]
     # По мере получения результата обработка данных
 
@@ -103,30 +256,22 @@ def generate_list_connet(iplist, login, password, limit=80):
     # Исключение устройств без вывода
             working = {key: value for key, value in data.items() if value}
             for ip, output in working.items():
-                dict = {}
-                dict['host'] = normalize_name(output[0])
-    # Определяем тип устройства
-                # output[1] = output[1].split()
-                # for word in output[1]:
-                #     if word in devices_platforms:
-                #         device_type = devices_platforms[word]
-                #     else:
-                #         device_type = "cisco_s300"
-                if "Ruckus" in output[1]:
-                    device_type = "ruckus_fastiron"
-                elif "Brocade" in output[1]:
-                    device_type = "brocade_fastiron"
-                elif "Cisco IOS Software" in output[1]:
-                    device_type = "cisco_ios"
-                elif "Aruba" in output[1]:
-                    device_type = "cisco_ios"
-                else:
-                    device_type = "cisco_s300"
-                dict["device_type"] = device_type
-                dict["ip"] = ip
-                dict["username"] = login
-                dict["password"] = password
-                result.append(dict)
+                connection = {}
+                connection['host'] = normalize_name(output[0])
+    # Определяем тип устройства по файлу соответствий DEVICE_PLATFROMS
+                device_type = detect_device_type(output[1], platforms)
+                connection["device_type"] = device_type
+                connection["ip"] = ip
+                connection["username"] = login
+                connection["password"] = password
+                result.append(connection)
+                host_key, banner = host_keys[ip]
+                # В кэш - и платформа для сбора, и драйвер, которым
+                # send_show реально подключился
+                cache.record(
+                    ip, connection['host'], device_type, host_key, banner,
+                    driver=by_ip[ip]['device_type'])
+    cache.save()
 
     runtime = float("%0.2f" % (time.time() - startTime))
     logging.info("*"*60)
@@ -138,7 +283,7 @@ def generate_list_connet(iplist, login, password, limit=80):
 
 
 def build_device_list(ip_net, login: str, password: str, filedump=None):
-    """Основная функция. Сканирует nmap диапазон сети.
+    """Основная функция. Сканирует диапазон сети (scan_network).
     Передаёт живые хосты функции generate_list_connet,
     которая формирует словарь подюключений и возвращает в эту функцию.
 
@@ -152,20 +297,189 @@ def build_device_list(ip_net, login: str, password: str, filedump=None):
     Returns:
         [dict]: Словарь с настройками для подключения NetMiko
     """
-    subnet = scan_network(ip_net)
+    with TIMINGS.phase(None, 'scan'):
+        subnet = scan_network(ip_net)
     if subnet is None:
         return "Нет адресов для сканирования"
-    switches = generate_list_connet(subnet, login, password, len(subnet))
+    with TIMINGS.phase(None, 'discovery'):
+        switches = generate_list_connet(
+            subnet, login, password, cache_file=cache_path(filedump))
     if filedump:
         write_result_to_json(switches, filedump)
     logging.info(f"Завершено. Устройств для работы {len(switches)}")
     return switches
 
 
-def scan_network(ip_net: str):
-    nmap = nmap3.NmapScanTechniques()
-    nmap_scan = nmap.nmap_ping_scan(ip_net)
-    network = [ip for ip in nmap_scan if '.' in ip]
+def probe_name(device):
+    """Имя устройства по приглашению командной строки.
+
+    Args:
+        device (dict): параметры подключения NetMiko
+
+    Returns:
+        str: нормализованное имя или None, если логин не удался
+    """
+    ip = device.get('ip') or device['host']
+    try:
+        with LIMITER.slot(ip) as slot:
+            started = time.monotonic()
+            with POOL.session(device) as ssh:
+                slot.latency = time.monotonic() - started
+                return normalize_name(ssh.find_prompt())
+    except Exception as error:
+        logging.warning(f"{ip}: не удалось проверить имя: {error}")
+        return None
+
+
+def _age_out(cache, previous, ips, max_missed):
+    """Учёт пропуска устройств из прошлого списка.
+
+    Returns:
+        tuple: (устройства, пропущенные меньше max_missed раз подряд,
+        число исключённых)
+    """
+    kept = []
+    removed = 0
+    for ip in ips:
+        if cache.missed(ip) < max_missed:
+            kept.append(previous[ip])
+        else:
+            removed += 1
+            logging.info(
+                f"{previous[ip]['host']} ({ip}) не найден {max_missed} "
+                f"запусков подряд. Исключён из списка")
+    return kept, removed
+
+
+def update_device_list(ip_net, login: str, password: str, filedump,
+                       max_missed=3, probe_names=PROBE_NAMES):
+    """Инкрементальное обновление списка устройств из filedump.
+
+    Текущее сканирование сравнивается с прошлым списком: платформа и имя
+    определяются заново только для новых IP и IP, у которых сменился
+    SSH-ключ или истёк TTL записи кэша. Логина на остальные устройства
+    нет, поэтому смена имени без смены ключа видна не позже чем через TTL.
+    При probe_names имя неизменившихся устройств проверяется по
+    приглашению устройства при каждом запуске (лишний логин на каждое).
+    Устройства, не найденные при сканировании или не ответившие на логин
+    max_missed запусков подряд, удаляются. Результат записывается в
+    filedump.
+    Если filedump нет, выполняется полное build_device_list.
+
+    Args:
+        ip_net (str): IP диапазон в формате 10.0.0.0/24
+        login (str): логин для подключения на коммутаторы
+        password (str): пароль для подключения на коммутаторы
+        filedump (str): JSON файл со списком устройств
+        max_missed (int, optional): через сколько сканирований без ответа
+        устройство исключается из списка. Defaults to 3.
+        probe_names (bool, optional): проверять имя логином, см.
+        PROBE_NAMES
+
+    Returns:
+        [dict]: Словарь с настройками для подключения NetMiko
+    """
+    if not os.path.isfile(filedump):
+        return build_device_list(ip_net, login, password, filedump)
+    with open(filedump) as f:
+        previous = {device['ip']: device for device in json.load(f)}
+
+    subnet = set(scan_network(ip_net) or [])
+    path = cache_path(filedump)
+    cache = FingerprintCache(path)
+    new_ips = [ip for ip in subnet if ip not in previous]
+    known_ips = [ip for ip in previous if ip in subnet]
+    with ThreadPoolExecutor(max_workers=LIMITER.maximum) as executor:
+        host_keys = dict(
+            zip(known_ips, executor.map(get_host_key, known_ips)))
+
+    changed = []
+    unchanged = []
+    for ip in known_ips:
+        # lookup вернёт None, если ключ сменился или истёк TTL
+        host_key, _ = host_keys[ip]
+        if cache.lookup(ip, host_key) is None:
+            changed.append(ip)
+        else:
+            unchanged.append(ip)
+    # Имя проверяется на самом устройстве только по запросу: это логин
+    # на каждое устройство. Иначе имя берётся из прошлого списка.
+    if probe_names:
+        with ThreadPoolExecutor(max_workers=LIMITER.maximum) as executor:
+            names = dict(zip(unchanged, executor.map(
+                lambda ip: probe_name(
+                    dict(previous[ip], username=login, password=password)),
+                unchanged)))
+    else:
+        names = {ip: previous[ip]['host'] for ip in unchanged}
+
+    switches = []
+    unreachable = []
+    for ip in unchanged:
+        if names[ip] is None:
+            unreachable.append(ip)
+        elif names[ip] != previous[ip]['host']:
+            logging.info(
+                f"{ip}: имя {previous[ip]['host']} -> {names[ip]}")
+            changed.append(ip)
+        else:
+            cache.seen(ip)
+            switches.append(previous[ip])
+    # Не найденные при сканировании и не ответившие на логин исключаются
+    # после max_missed запусков подряд
+    same = len(switches)
+    kept, removed = _age_out(
+        cache, previous, unreachable + [ip for ip in previous
+                                        if ip not in subnet], max_missed)
+    switches += kept
+    cache.save()
+
+    logging.info(
+        f"Новых IP {len(new_ips)}, изменившихся {len(changed)}, "
+        f"без изменений {same}, исключено {removed}")
+    if new_ips or changed:
+        found = generate_list_connet(
+            new_ips + changed, login, password, refresh=changed,
+            cache_file=path)
+        switches += found
+        # Изменившиеся, но не ответившие на логин - тоже через max_missed
+        failed = set(changed) - set(device['ip'] for device in found)
+        if failed:
+            cache = FingerprintCache(path)
+            switches += _age_out(cache, previous, failed, max_missed)[0]
+            cache.save()
+    write_result_to_json(switches, filedump)
+    logging.info(f"Завершено. Устройств для работы {len(switches)}")
+    return switches
+
+
+def scan_network(ip_net: str, backend=None):
+    """Поиск доступных хостов в диапазоне.
+
+    Args:
+        ip_net (str): IP диапазон в формате 10.0.0.0/24
+        backend (str, optional): asyncio - собственный сканер TCP/22 и ICMP,
+        возвращает только хосты с открытым SSH; nmap - ping scan nmap.
+        По умолчанию SCAN_BACKEND.
+
+    Returns:
+        list: IP-адреса доступных хостов или None
+    """
+    backend = backend or SCAN_BACKEND
+    if backend == "nmap":
+        if nmap3 is None:
+            raise RuntimeError("Для NET_SCAN_BACKEND=nmap требуется nmap3")
+        nmap = nmap3.NmapScanTechniques()
+        nmap_scan = nmap.nmap_ping_scan(ip_net)
+        network = [ip for ip in nmap_scan if '.' in ip]
+    else:
+        hosts = sweep_network(ip_net)
+        network = sorted(hosts, key=lambda ip: hosts[ip]['ssh_rtt'])
+        if hosts:
+            slowest = network[-1]
+            logging.info(
+                f"SSH RTT: мин {hosts[network[0]]['ssh_rtt']} мс, "
+                f"макс {hosts[slowest]['ssh_rtt']} мс ({slowest})")
     logging.info("*"*80)
     logging.info(f"Доступно IP - {len(network)}. В сети {ip_net}")
     logging.info("*"*80)
@@ -5,9 +5,18 @@ import logging
 import os
 from configparser import ConfigParser
 
+import mac_history
 import psycopg2
-from get_netdevices import build_device_list
-from send_commands import send_command_parallel
+from discover_netmiko import build_device_list, update_device_list
+from lldp import EdgeIndex
+from mac_locator import notify_reload
+from mac_stream import stream_mac_table
+from mac_table import access_rows
+from pg_bulk import (BATCH_SIZE, load_mac_addresses, load_switches,
+                     merge_mac_addresses, merge_switches)
+from pg_writer import WRITERS, PipelinedWriter
+from send_commands import iter_command_parallel, iter_parallel
+from timings import TIMINGS
 
 # Настройки логирования
 logging.basicConfig(
@@ -22,11 +31,26 @@ config.read(CONFIGFILE)
 netLogin = config.get('net', 'netLogin', fallback='not exists')
 netPassword = config.get('net', 'netPassword', fallback='not exists')
 network = config.get('net', 'network', fallback='not exists')
+# Инкрементальное обновление списка устройств вместо доверия старому дампу
+incremental = config.getboolean('net', 'incremental', fallback=False)
+maxMissed = config.getint('net', 'max_missed', fallback=3)
+# Потоковый разбор таблиц MAC без TextFSM (для больших таблиц)
+macStream = config.getboolean('net', 'mac_stream', fallback=False)
 threads = int(config.get('net', 'threads', fallback='not exists'))
 dbUser = config.get('db', 'user', fallback='not exists')
 dbPassword = config.get('db', 'password', fallback='not exists')
 dbName = config.get('db', 'db_name', fallback='not exists')
 dbHost = config.get('db', 'host', fallback='not exists')
+# Строк в одной порции COPY
+dbBatch = config.getint('db', 'batch_size', fallback=BATCH_SIZE)
+# Хранение MAC: snapshot - полный снимок каждый запуск в mac_addresses,
+# history - последнее местоположение (mac_locations) и переезды (mac_moves)
+macStorage = config.get('db', 'mac_storage', fallback='snapshot')
+macPartitioned = config.getboolean('db', 'mac_partitioned', fallback=False)
+macTouchInterval = config.get(
+    'db', 'mac_touch_interval', fallback=mac_history.TOUCH_INTERVAL)
+# Потоков записи в СУБД параллельно со сбором, 0 - запись после сбора
+dbWriters = config.getint('db', 'writers', fallback=WRITERS)
 # Сбор переменных в одну
 database = {
     "dbname": dbName,
@@ -44,18 +68,19 @@ netinfo = {
 
 
 def get_mac_info(devices):
-    """Получение по SSH в мультипотоке вывод mac-address table
+    """Получение по SSH в мультипотоке вывод mac-address table.
+    Генератор: вывод устройства отдаётся сразу после получения,
+    обработка идёт параллельно со сбором.
 
     Args:
         devices (list): список словарей устройств  для подключений
 
-    Returns:
-        list: Возвращает список с данными по команде show. 
+    Yields:
+        dict: hostname: данные по команде show.
     """
     logging.info("*"*60)
     logging.info("Получение mac-address table")
     logging.info("*"*60)
-    result = []
     device_types = set([i['device_type'] for i in devices])
     for type in device_types:
         list_type = [i for i in devices if i["device_type"] == type]
@@ -66,20 +91,74 @@ def get_mac_info(devices):
         else:
             command = "show mac-address"
         logging.info(f"Опрос {type}, командой {command}")
-        result += send_command_parallel(list_type, command)
+        yield from iter_command_parallel(list_type, command)
         logging.info(f"Опрос {type} завершён")
     logging.info("*"*60)
     logging.info("Сбор информации о mac адресах завершён")
     logging.info("*"*60)
-    return result
 
 
-def parse_mac_info(raw_data):
+def get_uplinks(devices):
+    """Межкоммутаторные порты по рёбрам LLDP последнего запуска
+    update_cmdb_switches. Если рёбер нет - пустой словарь.
+
+    Returns:
+        dict: hostname: множество портов с соседом-коммутатором
+    """
+    switches = set(i['host'] for i in devices)
+    return EdgeIndex.load().neighbor_ports(switches)
+
+
+def get_mac_stream(devices, uplinks=None):
+    """Потоковый сбор mac-address table без TextFSM: вывод разбирается
+    построчно по мере чтения из канала, наружу отдаются только записи
+    access-портов. Память не зависит от размера таблиц.
+
+    Args:
+        devices (list): список словарей устройств  для подключений
+        uplinks (dict, optional): hostname: порты с соседом-коммутатором
+
+    Yields:
+        tuple: (hostname, MAC, порт, VLAN) для передачи в СУБД
+    """
+    for records in iter_mac_batches(devices, uplinks):
+        yield from records
+
+
+def iter_mac_batches(devices, uplinks=None):
+    """Записи access-портов по коммутаторам в порядке завершения опроса:
+    потоковым разбором при mac_stream или через get_mac_info и mac_table.
+
+    Yields:
+        list: кортежи (hostname, MAC, порт, VLAN) одного коммутатора
+    """
+    uplinks = uplinks or {}
+    if not macStream:
+        for record in get_mac_info(devices):
+            yield access_rows([record], uplinks)
+        return
+
+    def poll(device):
+        return stream_mac_table(device, uplinks.get(device['host'], ()))
+
+    logging.info("*"*60)
+    logging.info("Потоковое получение mac-address table")
+    logging.info("*"*60)
+    yield from iter_parallel(poll, devices)
+    logging.info("*"*60)
+    logging.info("Сбор информации о mac адресах завершён")
+    logging.info("*"*60)
+
+
+def parse_mac_info(raw_data, uplinks=None):
     """Обработка вывода show mac address. Исключение транковых портов.
-    Для 
 
     Args:
-        raw_data (list): вывод функции по сбору данных по SSH
+        raw_data (iterable): вывод функции по сбору данных по SSH.
+        Может быть генератором get_mac_info, тогда каждый коммутатор
+        обрабатывается по мере получения и сырой вывод не копится.
+        uplinks (dict, optional): hostname: порты с соседом-коммутатором
+        по LLDP, исключаются независимо от числа MAC.
 
     Returns:
         list: Список кортежей для передачи в БД.
@@ -87,24 +166,9 @@ def parse_mac_info(raw_data):
     logging.info("*"*60)
     logging.info("Обработка данных для передачи в СУБД")
     logging.info("*"*60)
-    lists = []
-    for raw in raw_data:
-        for host, output in raw.items():
-            try:
-                raw_ports = [i['port'] for i in output]
-                all_ports = set([i['port'] for i in output])
-            # Получаям порты, где не более 2ух мак-адресов
-                access_ports = [
-                    u_port for u_port in all_ports if raw_ports.count(u_port) < 2]
-                macs = [(host, i['destination_address'], i['port'], i['vlan'])
-                        for i in output if i['port'] in access_ports]
-                lists.append(macs)
-
-            except:
-                print('Проблема с обработкой')
-    # Объединяем списки и сортируем
-    result = list(set().union(*lists))
-    result.sort()
+    # Исключение портов, где больше одного MAC, удаление дублей и
+    # сортировка - в столбцовом движке mac_table
+    result = access_rows(raw_data, uplinks)
     logging.info("*"*60)
     logging.info("Обработка завершена")
     logging.info("*"*60)
@@ -112,40 +176,60 @@ def parse_mac_info(raw_data):
 
 
 def insert_switches(db, data):
-    sql = """INSERT INTO switches VALUES(%s, %s, %s)
-            ON CONFLICT ON CONSTRAINT pk_switch_switch_hostname DO NOTHING;"""
-    connection = None
+    """Внесение коммутаторов в switches через COPY и слияние одним
+    запросом в одной транзакции. Существующие записи не меняются."""
     try:
-        connection = psycopg2.connect(**db)
-        cursor = connection.cursor()
-        cursor.executemany(sql, data)
-        connection.commit()
-        logging.info("Record inserted successfully")
+        load_switches(db, data, dbBatch)
     except (Exception, psycopg2.Error) as error:
-        logging.error("Error while connecting to PostgreSQL", error)
-    finally:
-        if connection:
-            cursor.close()
-            connection.close()
-            logging.info("PostgreSQL connection is closed")
+        logging.error(f"Error while loading switches to PostgreSQL: {error}")
 
 
 def insert_mac_info(db, data):
-    sql = "INSERT INTO mac_addresses(switch_hostname, mac_address, switch_port, switch_vlan) VALUES(%s, %s, %s, %s)"
-    connection = None
+    """Внесение записей через COPY одной транзакцией: в mac_addresses
+    или, при mac_storage = history, в mac_locations/mac_moves.
+    data может быть генератором: строки уходят порциями dbBatch."""
     try:
-        connection = psycopg2.connect(**db)
-        cursor = connection.cursor()
-        cursor.executemany(sql, data)
-        connection.commit()
-        logging.info("Record inserted successfully")
+        if macStorage == 'history':
+            mac_history.store(db, data, dbBatch, macPartitioned,
+                              macTouchInterval)
+        else:
+            load_mac_addresses(db, data, dbBatch)
     except (Exception, psycopg2.Error) as error:
-        logging.error("Error while connecting to PostgreSQL", error)
-    finally:
-        if connection:
-            cursor.close()
-            connection.close()
-            logging.info("PostgreSQL connection is closed")
+        logging.error(
+            f"Error while loading mac_addresses to PostgreSQL: {error}")
+
+
+def write_pipelined(db, switches, devices, uplinks=None):
+    """Запись в СУБД параллельно со сбором: записи каждого коммутатора
+    передаются в PipelinedWriter сразу после опроса. Если запись не
+    успевает, сбор ждёт и уменьшает число SSH-сессий. При mac_storage =
+    history поток записи один. Если часть строк не записана - исключение.
+
+    Args:
+        db (dict): параметры psycopg2.connect
+        switches (list): кортежи (hostname, ip, vendor) для switches
+        devices (list): список словарей устройств  для подключений
+        uplinks (dict, optional): hostname: порты с соседом-коммутатором
+    """
+    writers = dbWriters
+    if macStorage == 'history':
+        # Параллельные merge одних MAC дают ложные перемещения в mac_moves
+        # и взаимные блокировки: история пишется одним потоком
+        writers = 1
+
+        def load(cursor, rows):
+            return mac_history.merge(cursor, rows, dbBatch, macTouchInterval)
+    else:
+        def load(cursor, rows):
+            return merge_mac_addresses(cursor, rows, dbBatch)
+    with PipelinedWriter(db, load, writers, flush_rows=dbBatch) as writer:
+        with TIMINGS.phase(None, 'db_switches'):
+            writer.execute(merge_switches, switches)
+        if macStorage == 'history':
+            writer.execute(mac_history.ensure_schema, macPartitioned)
+        with TIMINGS.phase(None, 'collect_db_mac_addresses'):
+            for rows in iter_mac_batches(devices, uplinks):
+                writer.put(rows)
 
 
 if __name__ == "__main__":
@@ -153,7 +237,10 @@ if __name__ == "__main__":
     logging.info("Script Begin")
     logging.info("*"*60)
     filedump = "/usr/local/scripts/output/x_switches.json"
-    if os.path.isfile(filedump):
+    if incremental:
+        x_switches = update_device_list(
+            network, netLogin, netPassword, filedump, maxMissed)
+    elif os.path.isfile(filedump):
         with open(filedump) as f:
             x_switches = json.load(f)
     else:
@@ -165,15 +252,36 @@ if __name__ == "__main__":
     list2db = [(i['host'], i['ip'], i['device_type'].split('_')[0])
                for i in x_switches]
 
-    # Внесение информации по коммутаторам в СУБД. В таблицу switches.
-    insert_switches(database, list2db)
-
-    # Получение по NetMiko вывод команды show mac-address table. С обработкой TextFSM.
-    raw_mac_info = get_mac_info(x_switches)
-    # Обработка полученного вывода для передачи в СУБД
-    x_mac_info = parse_mac_info(raw_mac_info)
-    # Внесение информации по мак-адресам в СУБД
-    insert_mac_info(database, x_mac_info)
+    # Порты с соседом-коммутатором по LLDP не считаются access-портами
+    uplinks = get_uplinks(x_switches)
+    if dbWriters:
+        # Записи каждого коммутатора уходят в СУБД сразу после опроса
+        try:
+            write_pipelined(database, list2db, x_switches, uplinks)
+        except (Exception, psycopg2.Error) as error:
+            logging.error(f"Error while writing to PostgreSQL: {error}")
+    elif macStream:
+        # Внесение информации по коммутаторам в СУБД. В таблицу switches.
+        with TIMINGS.phase(None, 'db_switches'):
+            insert_switches(database, list2db)
+        # Записи передаются в СУБД по мере опроса коммутаторов
+        with TIMINGS.phase(None, 'collect_db_mac_addresses'):
+            insert_mac_info(database, get_mac_stream(x_switches, uplinks))
+    else:
+        with TIMINGS.phase(None, 'db_switches'):
+            insert_switches(database, list2db)
+        # Получение по NetMiko вывод команды show mac-address table. С обработкой TextFSM.
+        # Генератор: обработка каждого коммутатора идёт по мере получения вывода
+        raw_mac_info = get_mac_info(x_switches)
+        # Обработка полученного вывода для передачи в СУБД
+        with TIMINGS.phase(None, 'collect_parse'):
+            x_mac_info = parse_mac_info(raw_mac_info, uplinks)
+        # Внесение информации по мак-адресам в СУБД
+        with TIMINGS.phase(None, 'db_mac_addresses'):
+            insert_mac_info(database, x_mac_info)
+    # Сервис поиска MAC перечитывает СУБД после выгрузки
+    notify_reload()
+    TIMINGS.export('dump_mac_addresses')
     logging.info("*"*60)
     logging.info("Script Complete")
     logging.info("*"*60)
@@ -0,0 +1,59 @@
+import re
+
+
+class FieldExtractor:
+    """Извлечение полей из вывода команды за один проход.
+
+    Шаблоны полей компилируются один раз при создании. Вывод
+    просматривается построчно один раз: к строке применяются шаблоны
+    только ещё не найденных полей, просмотр заканчивается, когда найдены
+    все. Поля ищутся независимо, одна строка может дать несколько полей.
+    Для каждого поля берётся первое совпадение. Шаблон применяется к
+    одной строке без перевода строки, начало строки - ^. Отсутствующее
+    поле - None, преобразование к нему не применяется.
+
+    Args:
+        fields (dict): имя поля: шаблон с одной группой или кортеж
+        (шаблон, функция преобразования найденной строки)
+    """
+
+    def __init__(self, fields):
+        self.fields = list(fields)
+        self.patterns = {}
+        self.convert = {}
+        for name, spec in fields.items():
+            pattern, convert = spec if isinstance(spec, tuple) else (spec, None)
+            pattern = re.compile(pattern)
+            if pattern.groups != 1:
+                raise ValueError(f"{name}: в шаблоне должна быть одна группа")
+            self.patterns[name] = pattern
+            self.convert[name] = convert
+
+    def extract(self, text):
+        """Поля из текста.
+
+        Args:
+            text (str): вывод команды
+
+        Returns:
+            dict: имя поля: значение или None
+        """
+        result = dict.fromkeys(self.fields)
+        if not isinstance(text, str):
+            return result
+        pending = list(self.patterns.items())
+        for line in text.splitlines():
+            found = False
+            for name, pattern in pending:
+                match = pattern.search(line)
+                if match is None:
+                    continue
+                convert = self.convert[name]
+                value = match.group(1)
+                result[name] = convert(value) if convert else value
+                found = True
+            if found:
+                pending = [i for i in pending if result[i[0]] is None]
+                if not pending:
+                    break
+        return result
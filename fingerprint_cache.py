@@ -0,0 +1,148 @@
+import base64
+import hashlib
+import json
+import logging
+import os
+import socket
+import threading
+import time
+
+import paramiko
+
+logging.getLogger("paramiko").setLevel(logging.WARNING)
+
+CACHE_FILE = os.environ.get(
+    "NET_FINGERPRINT_CACHE", "devices_fingerprints.json")
+# Через сколько секунд устройство снова проверяется логином (7 суток)
+CACHE_TTL = int(os.environ.get("NET_FINGERPRINT_TTL", 7 * 24 * 3600))
+KEY_TIMEOUT = 5
+
+
+def cache_path(filedump=None):
+    """Файл кэша для списка устройств filedump: рядом с ним,
+    <имя>_fingerprints.json. У скриптов со своими учётными данными
+    (коммутаторы, точки доступа) кэши и счётчики missed не смешиваются.
+    Без filedump - общий CACHE_FILE."""
+    if not filedump:
+        return CACHE_FILE
+    return f"{os.path.splitext(filedump)[0]}_fingerprints.json"
+
+
+def get_host_key(ip, port=22, timeout=KEY_TIMEOUT):
+    """Получение отпечатка SSH-ключа и баннера сервера без аутентификации.
+
+    Args:
+        ip (str): IP-адрес устройства
+        port (int, optional): SSH-порт. Defaults to 22.
+        timeout (int, optional): Таймаут подключения. Defaults to 5.
+
+    Returns:
+        tuple: (отпечаток 'тип:SHA256', баннер сервера) или (None, None)
+    """
+    transport = None
+    try:
+        sock = socket.create_connection((ip, port), timeout=timeout)
+        transport = paramiko.Transport(sock)
+        transport.banner_timeout = timeout
+        transport.start_client(timeout=timeout)
+        key = transport.get_remote_server_key()
+        digest = hashlib.sha256(key.asbytes()).digest()
+        fingerprint = "{}:{}".format(
+            key.get_name(), base64.b64encode(digest).decode().rstrip('='))
+        return fingerprint, transport.remote_version
+    except (OSError, paramiko.SSHException, EOFError):
+        logging.debug(f"Не получен SSH-ключ {ip}")
+        return None, None
+    finally:
+        if transport is not None:
+            transport.close()
+
+
+class FingerprintCache:
+    """Кэш отпечатков устройств на диске, ключ - IP-адрес.
+
+    Запись: hostname, device_type (платформа для сбора), driver (драйвер
+    NetMiko, которым удалось подключиться), отпечаток SSH-ключа, баннер
+    сервера, время последней проверки логином (verified), время последней
+    встречи (last_seen) и TTL. Пока ключ не изменился и TTL не истёк, повторный
+    логин для определения платформы не нужен.
+
+    Args:
+        path (str, optional): путь к JSON-файлу кэша
+        ttl (int, optional): срок доверия записи, сек
+    """
+
+    def __init__(self, path=CACHE_FILE, ttl=CACHE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.entries = {}
+        self._lock = threading.Lock()
+        if os.path.isfile(path):
+            with open(path) as f:
+                self.entries = json.load(f)
+
+    def lookup(self, ip, host_key):
+        """Запись по IP, если ключ совпал и TTL не истёк, иначе None."""
+        with self._lock:
+            entry = self.entries.get(ip)
+            if not entry or host_key is None:
+                return None
+            if entry.get('host_key') != host_key:
+                logging.info(f"У {ip} изменился SSH-ключ")
+                return None
+            now = time.time()
+            if now - entry.get('verified', 0) > entry.get('ttl', self.ttl):
+                return None
+            entry['last_seen'] = now
+            return entry
+
+    def get(self, ip):
+        """Запись по IP без проверок."""
+        with self._lock:
+            return self.entries.get(ip)
+
+    def record(self, ip, host=None, device_type=None, host_key=None,
+               banner=None, driver=None):
+        """Сохранение результата проверки устройства логином.
+        Непереданные поля остаются прежними."""
+        now = time.time()
+        with self._lock:
+            entry = self.entries.setdefault(ip, {})
+            for field, value in (('host', host),
+                                 ('device_type', device_type),
+                                 ('host_key', host_key),
+                                 ('banner', banner),
+                                 ('driver', driver)):
+                if value is not None:
+                    entry[field] = value
+            entry['verified'] = now
+            entry['last_seen'] = now
+            entry['missed'] = 0
+            entry['ttl'] = self.ttl
+
+    def seen(self, ip):
+        """Отметка, что устройство найдено при сканировании."""
+        with self._lock:
+            entry = self.entries.get(ip)
+            if entry is not None:
+                entry['last_seen'] = time.time()
+                entry['missed'] = 0
+
+    def missed(self, ip):
+        """Учёт сканирования, в котором устройство не найдено.
+
+        Returns:
+            int: сколько сканирований подряд устройство не найдено
+        """
+        with self._lock:
+            entry = self.entries.setdefault(ip, {})
+            entry['missed'] = entry.get('missed', 0) + 1
+            return entry['missed']
+
+    def save(self):
+        """Атомарная запись кэша на диск."""
+        with self._lock:
+            tmp = f"{self.path}.tmp"
+            with open(tmp, 'w') as f:
+                json.dump(self.entries, f, indent=2, ensure_ascii=False)
+            os.replace(tmp, self.path)
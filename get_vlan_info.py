@@ -4,7 +4,8 @@ import os
 from configparser import ConfigParser
 
 from xfunctions import normalize_name, write_result_to_json
-from send_commands import send_commands_parallel
+from send_commands import iter_commands_parallel
+from timings import TIMINGS
 
 logging.basicConfig(
     format='%(levelname)s: %(message)s',
@@ -56,15 +57,15 @@ def get_info(devices):
         logging.info(f"Начало работы с {type}")
         if type == "brocade_fastiron":
             ruckus_commands = COMMANDS["ruckus_fastiron"]
-            brocade_inventory = send_commands_parallel(
-                list_type, ruckus_commands, limit=len(list_type))
+            brocade_inventory = iter_commands_parallel(
+                list_type, ruckus_commands)
             for record in brocade_inventory:
                 for host, output in record.items():
                     result[host] = output
         else:
             commands = COMMANDS[type]
-            inventory = send_commands_parallel(
-                list_type, commands, limit=len(list_type))
+            inventory = iter_commands_parallel(
+                list_type, commands)
             for record in inventory:
                 for host, output in record.items():
                     result[host] = output
@@ -81,6 +82,8 @@ if __name__ == "__main__":
         with open(filedump) as f:
             switches = json.load(f)
 
-    sw_info = get_info(switches)
+    with TIMINGS.phase(None, 'inventory'):
+        sw_info = get_info(switches)
     write_result_to_json(sw_info, 'sw_info.json')
+    TIMINGS.export('get_vlan_info')
     print('Done')
@@ -0,0 +1,235 @@
+import json
+import os
+import re
+from collections import namedtuple
+
+from xfunctions import normalize_name
+
+# Ребра LLDP последнего опроса коммутаторов (update_cmdb_switches)
+LLDP_EDGES = os.environ.get(
+    "NET_LLDP_EDGES", "/usr/local/scripts/output/lldp_edges.json")
+
+LldpEdge = namedtuple(
+    'LldpEdge',
+    ['local_host', 'local_port', 'remote_host', 'remote_port', 'chassis_id'])
+
+# Команда LLDP по платформам
+LLDP_COMMANDS = {
+    'cisco_ios': 'show lldp neighbors detail',
+    'cisco_s300': 'show lldp neighbors',
+    'ruckus_fastiron': 'show lldp neighbors detail',
+    'brocade_fastiron': 'show lldp neighbors detail',
+    'aruba_ap': 'show ap debug lldp neighbor interface bond0',
+}
+
+IOS_BLOCK = re.compile(r'^Local Intf:\s*(\S+)', re.M)
+IOS_FIELDS = {
+    'chassis_id': re.compile(r'^Chassis id:\s*(\S+)', re.M),
+    'remote_port': re.compile(r'^Port id:\s*(\S+)', re.M),
+    'remote_host': re.compile(r'^System Name:\s*(\S+)', re.M),
+}
+FASTIRON_BLOCK = re.compile(r'^Local port:\s*(\S+)', re.M)
+FASTIRON_FIELDS = {
+    'chassis_id': re.compile(r'Chassis ID \([^)]*\):\s*(\S+)'),
+    'remote_port': re.compile(r'Port ID \([^)]*\):\s*(\S+)'),
+    'remote_host': re.compile(r'System name\s*:\s*"?([^"\s]+)'),
+}
+AP_FIELDS = {
+    'local_port': re.compile(r'Interface:\s*([^,\s]+)'),
+    'chassis_id': re.compile(
+        r'(?:Chassis ID|ChassisID):\s*(?:mac\s+)?(\S+)', re.I),
+    'remote_port': re.compile(
+        r'(?:Port ID|PortID):\s*(?:ifname\s+|local\s+)?(\S+)', re.I),
+    'remote_host': re.compile(r'(?:System name|SysName):\s*(\S+)', re.I),
+}
+
+
+def _field(pattern, text):
+    match = pattern.search(text)
+    return match.group(1) if match else None
+
+
+def _blocks(pattern, text):
+    """Блоки вывода detail: (локальный порт, текст блока)."""
+    starts = list(pattern.finditer(text))
+    for index, match in enumerate(starts):
+        end = starts[index + 1].start() if index + 1 < len(starts) else None
+        yield match.group(1), text[match.end():end]
+
+
+def _detail_edges(host, text, block, fields):
+    for local_port, body in _blocks(block, text):
+        values = {name: _field(pattern, body)
+                  for name, pattern in fields.items()}
+        yield LldpEdge(host, local_port, values['remote_host'],
+                       values['remote_port'], values['chassis_id'])
+
+
+def _table_edges(host, text):
+    """Таблица show lldp neighbors SG300. Ширина колонок берётся из строки
+    с чёрточками под заголовком: System Name может быть пустым."""
+    columns = None
+    for line in text.splitlines():
+        if columns is None:
+            if re.match(r'^\s*-+(\s+-+)+\s*$', line):
+                columns = [match.span() for match in re.finditer(r'-+', line)]
+            continue
+        cells = [line[start:end + 1].strip() if index + 1 < len(columns)
+                 else line[start:].strip()
+                 for index, (start, end) in enumerate(columns)]
+        if len(cells) < 4 or not cells[0] or not cells[1]:
+            continue
+        yield LldpEdge(host, cells[0], cells[3] or None, cells[2] or None,
+                       cells[1])
+
+
+def _ap_edges(host, text):
+    values = {name: _field(pattern, text)
+              for name, pattern in AP_FIELDS.items()}
+    if values['remote_host'] or values['chassis_id']:
+        yield LldpEdge(host, values['local_port'] or 'bond0',
+                       values['remote_host'], values['remote_port'],
+                       values['chassis_id'])
+
+
+def parse_lldp(host, output, platform):
+    """Разбор вывода LLDP в список рёбер.
+
+    Args:
+        host (str): hostname опрошенного устройства
+        output (str): вывод команды LLDP_COMMANDS[platform]
+        platform (str): device_type или 'aruba_ap' для точек доступа
+
+    Returns:
+        list: LldpEdge. Имя соседа приводится normalize_name,
+        отсутствующие поля - None.
+    """
+    if not isinstance(output, str):
+        return []
+    if platform == 'cisco_ios':
+        edges = _detail_edges(host, output, IOS_BLOCK, IOS_FIELDS)
+    elif platform in ('ruckus_fastiron', 'brocade_fastiron'):
+        edges = _detail_edges(host, output, FASTIRON_BLOCK, FASTIRON_FIELDS)
+    elif platform == 'cisco_s300':
+        edges = _table_edges(host, output)
+    elif platform == 'aruba_ap':
+        edges = _ap_edges(host, output)
+    else:
+        raise ValueError(f"Нет разбора LLDP для {platform}")
+    return [edge._replace(remote_host=normalize_name(edge.remote_host))
+            if edge.remote_host else edge for edge in edges]
+
+
+class EdgeIndex:
+    """Рёбра LLDP с индексами по локальному и удалённому устройству.
+
+    Имена устройств хранятся один раз, рёбра - кортежами id.
+    Используется для построения топологии, поиска аплинков и исключения
+    межкоммутаторных портов из таблиц MAC.
+    """
+
+    def __init__(self, edges=()):
+        self.names = []
+        self._ids = {}
+        self.edges = []
+        self._by_local = {}
+        self._by_remote = {}
+        self.extend(edges)
+
+    def _id(self, name):
+        if name is None:
+            return None
+        index = self._ids.get(name)
+        if index is None:
+            index = self._ids[name] = len(self.names)
+            self.names.append(name)
+        return index
+
+    def add(self, edge):
+        local, remote = self._id(edge.local_host), self._id(edge.remote_host)
+        position = len(self.edges)
+        self.edges.append(
+            (local, edge.local_port, remote, edge.remote_port,
+             edge.chassis_id))
+        self._by_local.setdefault(local, []).append(position)
+        if remote is not None:
+            self._by_remote.setdefault(remote, []).append(position)
+
+    def extend(self, edges):
+        for edge in edges:
+            self.add(edge)
+
+    def _edge(self, position):
+        local, local_port, remote, remote_port, chassis = self.edges[position]
+        return LldpEdge(
+            self.names[local], local_port,
+            self.names[remote] if remote is not None else None,
+            remote_port, chassis)
+
+    def __len__(self):
+        return len(self.edges)
+
+    def __iter__(self):
+        return (self._edge(i) for i in range(len(self.edges)))
+
+    def edges_from(self, host):
+        """Рёбра, обнаруженные на устройстве host."""
+        return [self._edge(i)
+                for i in self._by_local.get(self._ids.get(host), ())]
+
+    def edges_to(self, host):
+        """Рёбра, где host - сосед."""
+        return [self._edge(i)
+                for i in self._by_remote.get(self._ids.get(host), ())]
+
+    def neighbors(self, host, known=None):
+        """Имена соседей host по его LLDP.
+
+        Args:
+            host (str): устройство
+            known (container, optional): учитывать только этих соседей
+
+        Returns:
+            list: имена без повторов в порядке вывода
+        """
+        result = []
+        for edge in self.edges_from(host):
+            name = edge.remote_host
+            if name and name not in result and (
+                    known is None or name in known):
+                result.append(name)
+        return result
+
+    def neighbor_ports(self, known=None):
+        """Локальные порты, за которыми LLDP видит устройство.
+
+        Args:
+            known (container, optional): учитывать только этих соседей,
+            например только коммутаторы
+
+        Returns:
+            dict: host: множество портов
+        """
+        result = {}
+        for local, port, remote, _, _ in self.edges:
+            if remote is None:
+                continue
+            if known is not None and self.names[remote] not in known:
+                continue
+            result.setdefault(self.names[local], set()).add(port)
+        return result
+
+    def save(self, path=LLDP_EDGES):
+        """Сохранение рёбер в JSON (атомарно)."""
+        tmp = f"{path}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump([list(edge) for edge in self], f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path=LLDP_EDGES):
+        """Рёбра из JSON. Если файла нет - пустой индекс."""
+        if not os.path.isfile(path):
+            return cls()
+        with open(path) as f:
+            return cls(LldpEdge(*edge) for edge in json.load(f))
@@ -0,0 +1,213 @@
+import logging
+import re
+from configparser import ConfigParser
+from datetime import date
+
+import psycopg2
+from pg_bulk import BATCH_SIZE, MAC_COLUMNS, bulk_load, copy_merge
+
+# Как часто обновлять last_seen у MAC, который не переезжал
+TOUCH_INTERVAL = '1 day'
+RETENTION_DAYS = 365
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS mac_locations (
+    mac_address text NOT NULL,
+    switch_vlan text NOT NULL,
+    switch_hostname text NOT NULL,
+    switch_port text NOT NULL,
+    first_seen timestamptz NOT NULL,
+    last_seen timestamptz NOT NULL,
+    PRIMARY KEY (mac_address, switch_vlan)
+);
+CREATE INDEX IF NOT EXISTS mac_locations_port
+    ON mac_locations (switch_hostname, switch_port);
+CREATE INDEX IF NOT EXISTS mac_locations_last_seen
+    ON mac_locations (last_seen);
+"""
+MOVES = """
+CREATE TABLE IF NOT EXISTS mac_moves (
+    mac_address text NOT NULL,
+    switch_vlan text NOT NULL,
+    old_hostname text,
+    old_port text,
+    new_hostname text NOT NULL,
+    new_port text NOT NULL,
+    moved_at timestamptz NOT NULL
+){partition};
+CREATE INDEX IF NOT EXISTS mac_moves_mac ON mac_moves (mac_address, moved_at);
+"""
+PARTITION = re.compile(r'^mac_moves_(\d{4})(\d{2})$')
+
+# Снимок без дублей MAC в VLAN. Переезды пишутся в mac_moves, для
+# mac_locations - upsert. Строка без изменений перезаписывается не чаще
+# touch_interval, поэтому объём записи зависит от числа изменений.
+MERGE = """
+WITH snapshot AS (
+    SELECT DISTINCT ON (mac_address, switch_vlan)
+        mac_address, switch_vlan, switch_hostname, switch_port
+    FROM {staging}
+    ORDER BY mac_address, switch_vlan, switch_hostname, switch_port
+), moved AS (
+    INSERT INTO mac_moves (mac_address, switch_vlan, old_hostname, old_port,
+                           new_hostname, new_port, moved_at)
+    SELECT s.mac_address, s.switch_vlan, l.switch_hostname, l.switch_port,
+           s.switch_hostname, s.switch_port, now()
+    FROM snapshot s
+    JOIN {table} l USING (mac_address, switch_vlan)
+    WHERE (l.switch_hostname, l.switch_port)
+        IS DISTINCT FROM (s.switch_hostname, s.switch_port)
+)
+INSERT INTO {table} AS l (mac_address, switch_vlan, switch_hostname,
+                          switch_port, first_seen, last_seen)
+SELECT mac_address, switch_vlan, switch_hostname, switch_port, now(), now()
+FROM snapshot
+ON CONFLICT (mac_address, switch_vlan) DO UPDATE SET
+    first_seen = CASE
+        WHEN (l.switch_hostname, l.switch_port)
+            IS DISTINCT FROM (EXCLUDED.switch_hostname, EXCLUDED.switch_port)
+        THEN EXCLUDED.first_seen ELSE l.first_seen END,
+    switch_hostname = EXCLUDED.switch_hostname,
+    switch_port = EXCLUDED.switch_port,
+    last_seen = EXCLUDED.last_seen
+WHERE (l.switch_hostname, l.switch_port)
+        IS DISTINCT FROM (EXCLUDED.switch_hostname, EXCLUDED.switch_port)
+    OR l.last_seen < EXCLUDED.last_seen - %(touch)s::interval
+"""
+
+
+def _month(day):
+    return date(day.year + day.month // 12, day.month % 12 + 1, 1)
+
+
+def ensure_schema(cursor, partitioned=False):
+    """Создание mac_locations и mac_moves, если их нет. При partitioned
+    mac_moves секционируется по месяцам. Секции текущего и следующего
+    месяца создаются по дате СУБД (moved_at - now() сервера), поэтому
+    записи на границе месяца и при расхождении часов клиента есть куда
+    вставить. Уже секционированная mac_moves получает секции и без
+    partitioned.
+
+    Raises:
+        RuntimeError: partitioned, но mac_moves уже создана без секций
+    """
+    cursor.execute(SCHEMA)
+    cursor.execute(
+        "SELECT relkind FROM pg_class "
+        "WHERE relname = 'mac_moves' AND pg_table_is_visible(oid)")
+    existing = cursor.fetchone()
+    if existing is not None and existing[0] == 'p':
+        partitioned = True
+    elif existing is not None and partitioned:
+        raise RuntimeError(
+            "mac_moves уже существует без секций, mac_partitioned = true "
+            "не применить: перенесите данные в секционированную таблицу "
+            "или отключите mac_partitioned")
+    cursor.execute(MOVES.format(
+        partition=' PARTITION BY RANGE (moved_at)' if partitioned else ''))
+    if partitioned:
+        cursor.execute("SELECT date_trunc('month', now())::date")
+        start = cursor.fetchone()[0]
+        for month in (start, _month(start)):
+            cursor.execute(
+                f"CREATE TABLE IF NOT EXISTS mac_moves_{month:%Y%m} "
+                f"PARTITION OF mac_moves FOR VALUES FROM ('{month}') "
+                f"TO ('{_month(month)}')")
+
+
+def merge(cursor, rows, batch_size=BATCH_SIZE, touch_interval=TOUCH_INTERVAL):
+    """Снимок MAC-адресов в mac_locations/mac_moves в транзакции курсора.
+    Таблицы должны существовать (ensure_schema).
+
+    Returns:
+        tuple: (загружено строк, изменено строк mac_locations)
+    """
+    return copy_merge(cursor, 'mac_locations', rows, MAC_COLUMNS, MERGE,
+                      batch_size, {'touch': touch_interval})
+
+
+def store(db, rows, batch_size=BATCH_SIZE, partitioned=False,
+          touch_interval=TOUCH_INTERVAL):
+    """Снимок MAC-адресов в модель последнего местоположения.
+
+    Args:
+        db (dict): параметры psycopg2.connect
+        rows (iterable): кортежи (hostname, MAC, порт, VLAN)
+        batch_size (int, optional): строк в порции COPY
+        partitioned (bool, optional): mac_moves секционирована по месяцам
+        touch_interval (str, optional): интервал PostgreSQL, чаще которого
+        last_seen неизменного MAC не обновляется
+
+    Returns:
+        tuple: (загружено строк, изменено строк mac_locations)
+    """
+    connection = psycopg2.connect(**db)
+    try:
+        with connection, connection.cursor() as cursor:
+            ensure_schema(cursor, partitioned)
+    finally:
+        connection.close()
+    return bulk_load(db, 'mac_locations', rows, MAC_COLUMNS, MERGE,
+                     batch_size, {'touch': touch_interval})
+
+
+def purge(db, retention_days=RETENTION_DAYS, partitioned=False):
+    """Удаление истории старше retention_days: переездов и MAC, которые
+    не появлялись в сети. Секции mac_moves удаляются целиком, когда
+    весь их месяц старше срока хранения.
+
+    Returns:
+        tuple: (удалено переездов или секций, удалено MAC)
+    """
+    connection = psycopg2.connect(**db)
+    try:
+        with connection, connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT (now() - %s * interval '1 day')::date",
+                (retention_days,))
+            cutoff = cursor.fetchone()[0]
+            if partitioned:
+                cursor.execute(
+                    "SELECT child.relname FROM pg_inherits "
+                    "JOIN pg_class parent ON parent.oid = inhparent "
+                    "JOIN pg_class child ON child.oid = inhrelid "
+                    "WHERE parent.relname = 'mac_moves'")
+                moves = 0
+                for name, in cursor.fetchall():
+                    match = PARTITION.match(name)
+                    if not match:
+                        continue
+                    start = date(int(match.group(1)), int(match.group(2)), 1)
+                    if _month(start) <= cutoff:
+                        cursor.execute(f"DROP TABLE {name}")
+                        moves += 1
+            else:
+                cursor.execute(
+                    "DELETE FROM mac_moves WHERE moved_at < %s", (cutoff,))
+                moves = cursor.rowcount
+            cursor.execute(
+                "DELETE FROM mac_locations WHERE last_seen < %s", (cutoff,))
+            locations = cursor.rowcount
+    finally:
+        connection.close()
+    logging.info(f"История MAC до {cutoff}: удалено переездов "
+                 f"{'(секций) ' if partitioned else ''}{moves}, "
+                 f"MAC {locations}")
+    return moves, locations
+
+
+if __name__ == "__main__":
+    # Задание хранения: запускается по расписанию, настройки из config.ini
+    logging.basicConfig(format='%(levelname)s: %(message)s',
+                        level=logging.INFO)
+    config = ConfigParser()
+    config.read('config.ini')
+    database = {
+        "dbname": config.get('db', 'db_name', fallback='not exists'),
+        "host": config.get('db', 'host', fallback='not exists'),
+        "user": config.get('db', 'user', fallback='not exists'),
+        "password": config.get('db', 'password', fallback='not exists'),
+    }
+    purge(database,
+          config.getint('db', 'mac_retention_days', fallback=RETENTION_DAYS),
+          config.getboolean('db', 'mac_partitioned', fallback=False))
@@ -0,0 +1,335 @@
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from configparser import ConfigParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote, unquote
+from urllib.request import Request, urlopen
+
+import psycopg2
+from mac_table import HEX_DIGITS, Interner, mac_to_int
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Адрес HTTP-сервиса поиска
+LOCATOR_HOST = os.environ.get("NET_LOCATOR_HOST", "127.0.0.1")
+LOCATOR_PORT = int(os.environ.get("NET_LOCATOR_PORT", 8765))
+# Перечитывать СУБД раз в столько секунд, 0 - только по /reload
+RELOAD_INTERVAL = int(os.environ.get("NET_LOCATOR_RELOAD", 3600))
+# Больше строк в ответе не отдаётся (поиск по короткому префиксу)
+MAX_RESULTS = int(os.environ.get("NET_LOCATOR_LIMIT", 1000))
+QUERIES = {
+    # Последний снимок каждого коммутатора, столбец collected добавляет
+    # migrations/001_mac_addresses_collected.sql
+    'snapshot': "SELECT switch_hostname, mac_address, switch_port, "
+                "switch_vlan FROM mac_addresses JOIN ("
+                "SELECT switch_hostname, max(collected) AS collected "
+                "FROM mac_addresses GROUP BY switch_hostname) latest "
+                "USING (switch_hostname, collected)",
+    'history': "SELECT switch_hostname, mac_address, switch_port, "
+               "switch_vlan FROM mac_locations",
+}
+
+
+def format_mac(value):
+    """48-битное целое в MAC вида aabb.ccdd.eeff."""
+    digits = f"{value:012x}"
+    return f"{digits[:4]}.{digits[4:8]}.{digits[8:]}"
+
+
+def mac_range(query):
+    """Диапазон 48-битных значений MAC по адресу или его началу (OUI).
+
+    Args:
+        query (str): MAC или префикс в любом написании: 0011.22, 00:11:22
+
+    Returns:
+        tuple: (от, до) - полуинтервал, None если в запросе нет цифр MAC
+        или их больше 12
+    """
+    digits = ''.join(i for i in query.lower() if i in HEX_DIGITS)
+    if not digits or len(digits) > 12:
+        return None
+    shift = 4 * (12 - len(digits))
+    start = int(digits, 16) << shift
+    return start, start + (1 << shift)
+
+
+class MacLocator:
+    """Индекс местоположения MAC-адресов в памяти.
+
+    MAC хранятся как 48-битные целые в отсортированном массиве, поиск
+    адреса или префикса (OUI) - двоичный поиск диапазона. Коммутаторы и
+    порты - id в словарях, обратный индекс (коммутатор, порт) - номера
+    строк. Индекс не меняется после построения: перезагрузка строит
+    новый и подменяет ссылку.
+
+    Args:
+        rows (iterable): кортежи (hostname, MAC, порт, VLAN), как у
+        parse_mac_info
+    """
+
+    def __init__(self, rows):
+        self.hosts = Interner()
+        self.ports = Interner()
+        macs, hosts, ports, vlans = [], [], [], []
+        for host, mac, port, vlan in rows:
+            value = mac_to_int(mac)
+            if value < 0:
+                continue
+            macs.append(value)
+            hosts.append(self.hosts(host))
+            ports.append(self.ports(port))
+            vlans.append(str(vlan))
+        if np is not None:
+            order = np.argsort(np.array(macs, dtype=np.uint64),
+                               kind='stable').tolist()
+        else:
+            order = sorted(range(len(macs)), key=macs.__getitem__)
+        self.macs = [macs[i] for i in order]
+        self.host_ids = [hosts[i] for i in order]
+        self.port_ids = [ports[i] for i in order]
+        self.vlans = [vlans[i] for i in order]
+        self.by_port = {}
+        for index, key in enumerate(zip(self.host_ids, self.port_ids)):
+            self.by_port.setdefault(key, []).append(index)
+        self.loaded = time.time()
+
+    def __len__(self):
+        return len(self.macs)
+
+    def _row(self, index):
+        return {
+            'mac': format_mac(self.macs[index]),
+            'host': self.hosts.values[self.host_ids[index]],
+            'port': self.ports.values[self.port_ids[index]],
+            'vlan': self.vlans[index],
+        }
+
+    def find(self, query, limit=MAX_RESULTS):
+        """Местоположение MAC-адреса или всех MAC с указанным началом.
+
+        Returns:
+            list: словари mac, host, port, vlan
+        """
+        bounds = mac_range(query)
+        if bounds is None:
+            return []
+        start = bisect_left(self.macs, bounds[0])
+        end = bisect_left(self.macs, bounds[1], start)
+        return [self._row(i) for i in range(start, min(end, start + limit))]
+
+    def on_port(self, host, port):
+        """MAC-адреса за портом коммутатора."""
+        key = (self.hosts.ids.get(host), self.ports.ids.get(port))
+        return [self._row(i) for i in self.by_port.get(key, ())]
+
+    @classmethod
+    def from_db(cls, db, storage='snapshot'):
+        """Индекс по таблице СУБД: mac_addresses или, при storage =
+        history, mac_locations.
+
+        Raises:
+            RuntimeError: в mac_addresses нет столбца collected
+        """
+        connection = psycopg2.connect(**db)
+        try:
+            with connection, connection.cursor() as cursor:
+                if storage == 'snapshot':
+                    cursor.execute(
+                        "SELECT 1 FROM information_schema.columns "
+                        "WHERE table_name = 'mac_addresses' "
+                        "AND column_name = 'collected'")
+                    if cursor.fetchone() is None:
+                        raise RuntimeError(
+                            "в mac_addresses нет столбца collected: "
+                            "примените migrations/"
+                            "001_mac_addresses_collected.sql")
+                cursor.execute(QUERIES[storage])
+                return cls(cursor)
+        finally:
+            connection.close()
+
+
+class LocatorService:
+    """Текущий индекс и его перезагрузка. Запросы читают self.index без
+    блокировок: новый индекс строится отдельно и подменяет старый
+    одним присваиванием.
+
+    Args:
+        load (callable): функция без аргументов, возвращающая MacLocator
+    """
+
+    def __init__(self, load):
+        self.load = load
+        self.index = MacLocator(())
+        self._lock = threading.Lock()
+        self._pending = False
+
+    def _load(self):
+        try:
+            started = time.perf_counter()
+            index = self.load()
+            self.index = index
+            logging.info(f"Индекс MAC: {len(index)} записей за "
+                         f"{time.perf_counter() - started:.2f} с")
+            return True
+        except (Exception, psycopg2.Error) as error:
+            logging.error(f"Ошибка загрузки индекса MAC: {error}")
+            return False
+
+    def reload(self):
+        """Построение нового индекса, при ошибке остаётся прежний.
+        Параллельные вызовы не дублируются: если индекс уже строится,
+        вызов отмечает, что после этого нужен ещё один проход, и сразу
+        возвращается. Так данные, записанные во время построения, не
+        теряются.
+
+        Returns:
+            bool: индекс построен этим вызовом
+        """
+        self._pending = True
+        loaded = False
+        while self._pending and self._lock.acquire(blocking=False):
+            try:
+                while self._pending:
+                    self._pending = False
+                    loaded = self._load()
+            finally:
+                self._lock.release()
+        return loaded
+
+    def reload_every(self, interval):
+        """Фоновая перезагрузка раз в interval секунд."""
+        def run():
+            while True:
+                time.sleep(interval)
+                self.reload()
+        threading.Thread(target=run, name="LocatorReload", daemon=True).start()
+
+
+def make_handler(service):
+    """Обработчик HTTP: GET /mac/<MAC или префикс>,
+    GET /port/<hostname>/<порт>, GET /status, POST /reload. Ответ - JSON."""
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def _reply(self, status, data):
+            body = json.dumps(data, ensure_ascii=False).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            parts = [unquote(i) for i in self.path.strip('/').split('/', 2)]
+            index = service.index
+            if parts[0] == 'mac' and len(parts) == 2:
+                self._reply(200, index.find(parts[1]))
+            elif parts[0] == 'port' and len(parts) == 3:
+                self._reply(200, index.on_port(parts[1], parts[2]))
+            elif parts[0] == 'status':
+                self._reply(200, {'records': len(index),
+                                  'loaded': index.loaded})
+            else:
+                self._reply(404, {'error': 'not found'})
+
+        def do_POST(self):
+            if self.path.strip('/') == 'reload':
+                self._reply(200, {'reloaded': service.reload()})
+            else:
+                self._reply(404, {'error': 'not found'})
+
+        def log_message(self, format, *args):
+            logging.debug(format % args)
+
+    return Handler
+
+
+def serve(service, host=LOCATOR_HOST, port=LOCATOR_PORT,
+          reload_interval=RELOAD_INTERVAL):
+    """Запуск HTTP-сервиса поиска. Индекс загружается до приёма запросов."""
+    service.reload()
+    if reload_interval:
+        service.reload_every(reload_interval)
+    server = ThreadingHTTPServer((host, port), make_handler(service))
+    logging.info(f"Поиск MAC: http://{host}:{port}/mac/<MAC>")
+    server.serve_forever()
+
+
+def notify_reload(host=LOCATOR_HOST, port=LOCATOR_PORT, timeout=5):
+    """Просьба запущенному сервису перечитать СУБД после выгрузки.
+    Если сервис не запущен - только запись в лог."""
+    try:
+        urlopen(Request(f"http://{host}:{port}/reload", method='POST'),
+                timeout=timeout).close()
+    except OSError as error:
+        logging.info(f"Сервис поиска MAC не обновлён: {error}")
+
+
+def query_service(path, host=LOCATOR_HOST, port=LOCATOR_PORT, timeout=10):
+    """Запрос к запущенному сервису поиска, индекс уже в его памяти.
+
+    Args:
+        path (list): части пути запроса, например ['mac', '0011.22']
+
+    Returns:
+        list: словари mac, host, port, vlan
+
+    Raises:
+        OSError: сервис не запущен или не ответил
+    """
+    url = f"http://{host}:{port}/" + '/'.join(quote(i, safe='') for i in path)
+    with urlopen(url, timeout=timeout) as response:
+        return json.load(response)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format='%(levelname)s: %(message)s',
+                        level=logging.INFO)
+    parser = argparse.ArgumentParser(
+        description="Поиск коммутатора и порта по MAC-адресу")
+    parser.add_argument('query', nargs='*',
+                        help="MAC или префикс (OUI); с --port - hostname и порт")
+    parser.add_argument('--port', action='store_true',
+                        help="MAC-адреса за портом коммутатора")
+    parser.add_argument('--serve', action='store_true',
+                        help="HTTP-сервис на NET_LOCATOR_HOST:NET_LOCATOR_PORT")
+    args = parser.parse_args()
+    if args.port and len(args.query) != 2:
+        parser.error("--port: нужны hostname и порт")
+    if args.serve:
+        config = ConfigParser()
+        config.read('config.ini')
+        database = {
+            "dbname": config.get('db', 'db_name', fallback='not exists'),
+            "host": config.get('db', 'host', fallback='not exists'),
+            "user": config.get('db', 'user', fallback='not exists'),
+            "password": config.get('db', 'password', fallback='not exists'),
+        }
+        storage = config.get('db', 'mac_storage', fallback='snapshot')
+        serve(LocatorService(lambda: MacLocator.from_db(database, storage)))
+    else:
+        # Поиск идёт в запущенном сервисе: загружать всю таблицу ради
+        # одного MAC не нужно
+        try:
+            if args.port:
+                result = query_service(['port', *args.query[:2]])
+            else:
+                result = [row for query in args.query
+                          for row in query_service(['mac', query])]
+        except OSError as error:
+            parser.exit(1, f"Сервис поиска MAC http://{LOCATOR_HOST}:"
+                           f"{LOCATOR_PORT} недоступен ({error}), "
+                           f"запустите python mac_locator.py --serve\n")
+        for row in result:
+            print(f"{row['mac']}  {row['host']}  {row['port']}  "
+                  f"VLAN {row['vlan']}")
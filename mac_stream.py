@@ -0,0 +1,152 @@
+import logging
+import os
+import re
+import time
+from datetime import datetime
+
+from concurrency import LIMITER
+from netmiko.ssh_exception import NetmikoTimeoutException
+from ssh_pool import POOL
+from timings import TIMINGS
+
+# Сколько ждать новых данных из канала, сек
+READ_TIMEOUT = float(os.environ.get("NET_STREAM_READ_TIMEOUT", 60))
+POLL_INTERVAL = 0.05
+start_msg = '===> {} Потоковый опрос: {}'
+received_msg = '<=== {} Получено записей: {} {}'
+
+# Команда вывода таблицы MAC-адресов по платформам
+MAC_COMMANDS = {
+    'cisco_ios': 'show mac address-table',
+    'cisco_s300': 'show mac address-table',
+    'ruckus_fastiron': 'show mac-address',
+    'brocade_fastiron': 'show mac-address',
+}
+MAC = r'[0-9a-fA-F]{4}\.[0-9a-fA-F]{4}\.[0-9a-fA-F]{4}|' \
+    r'[0-9a-fA-F]{2}(?:[:-][0-9a-fA-F]{2}){5}'
+FASTIRON_LINE = re.compile(
+    rf'^\s*(?P<mac>{MAC})\s+(?P<port>\S+)\s+\S+(?:\s+\d+)?\s+'
+    rf'(?P<vlan>\d+)\s*$')
+# Строки записей таблицы по платформам
+MAC_LINES = {
+    # Vlan  Mac Address  Type  Ports
+    'cisco_ios': re.compile(
+        rf'^\s*\*?\s*(?P<vlan>\S+)\s+(?P<mac>{MAC})\s+\S+(?:\s+\S+)*?\s+'
+        rf'(?P<port>\S+)\s*$'),
+    # Vlan  Mac Address  Port  Type
+    'cisco_s300': re.compile(
+        rf'^\s*(?P<vlan>\d+)\s+(?P<mac>{MAC})\s+(?P<port>\S+)\s+\S+\s*$'),
+    # MAC-Address  Port  Type  [Index]  VLAN
+    'ruckus_fastiron': FASTIRON_LINE,
+    'brocade_fastiron': FASTIRON_LINE,
+}
+
+
+def iter_channel_lines(ssh, command, timeout=READ_TIMEOUT):
+    """Генератор: строки вывода команды по мере поступления из канала.
+    В памяти держится только недочитанный хвост, а не весь вывод.
+    Постраничный вывод отключает подготовка сессии NetMiko. Строки до
+    эха команды включительно пропускаются, приглашение ищется только
+    после эха: иначе строка вида host#show ... закончила бы чтение.
+
+    Args:
+        ssh (BaseConnection): подключение NetMiko
+        command (str): команда
+        timeout (float, optional): сколько ждать новых данных, сек
+
+    Yields:
+        str: строка вывода без перевода строки
+    """
+    prompt = re.compile(rf'^{re.escape(ssh.base_prompt)}.*[#>]\s*$')
+    ssh.clear_buffer()
+    ssh.write_channel(command + ssh.RETURN)
+    tail = ''
+    echoed = False
+    deadline = time.monotonic() + timeout
+    while True:
+        chunk = ssh.read_channel()
+        if not chunk:
+            if time.monotonic() > deadline:
+                raise NetmikoTimeoutException(
+                    f"Timed out reading output of {command}")
+            time.sleep(POLL_INTERVAL)
+            continue
+        deadline = time.monotonic() + timeout
+        lines = (tail + chunk).split('\n')
+        tail = lines.pop()
+        for line in lines:
+            line = line.rstrip('\r')
+            if echoed:
+                yield line
+            elif command in line:
+                echoed = True
+        if echoed and prompt.match(tail.strip()):
+            return
+
+
+def iter_mac_records(lines, device_type):
+    """Генератор: записи (MAC, порт, VLAN) из строк вывода. Заголовки,
+    эхо команды и прочие строки пропускаются."""
+    pattern = MAC_LINES[device_type]
+    for line in lines:
+        match = pattern.match(line)
+        if match:
+            yield match.group('mac'), match.group('port'), match.group('vlan')
+
+
+def access_records(host, records, skip_ports=()):
+    """Записи access-портов: портов, где ровно одна запись. Как и в
+    mac_table, порты с несколькими записями считаются транками.
+    Для каждого порта хранится первая запись и счётчик, поэтому память
+    зависит от числа портов, а не от размера таблицы.
+
+    Args:
+        host (str): hostname коммутатора
+        records (iterable): записи (MAC, порт, VLAN)
+        skip_ports (container, optional): порты с соседом-коммутатором
+
+    Returns:
+        list: кортежи (host, MAC, порт, VLAN) для передачи в СУБД
+    """
+    ports = {}
+    for record in records:
+        if record[1] in skip_ports:
+            continue
+        entry = ports.get(record[1])
+        if entry is None:
+            ports[record[1]] = [record, 1]
+        else:
+            entry[1] += 1
+    return [(host, mac, port, vlan)
+            for (mac, port, vlan), count in ports.values() if count == 1]
+
+
+def stream_mac_table(device, skip_ports=()):
+    """Потоковый опрос таблицы MAC-адресов одного коммутатора без TextFSM.
+    Сессия берётся из ssh_pool.POOL под слотом concurrency.LIMITER.
+    Сырой вывод не накапливается и в raw_archive не пишется.
+
+    Args:
+        device (dict): Параметры устройства для подключения
+        skip_ports (container, optional): порты с соседом-коммутатором
+
+    Returns:
+        list: кортежи (host, MAC, порт, VLAN) access-портов
+    """
+    ip = device['ip']
+    host = device['host']
+    command = MAC_COMMANDS[device['device_type']]
+    labels = {'ip': ip, 'device_type': device['device_type'],
+              'command': command}
+    logging.info(start_msg.format(datetime.now().time(), ip))
+    with LIMITER.slot(ip) as slot:
+        started = time.monotonic()
+        with POOL.session(device) as ssh:
+            slot.latency = time.monotonic() - started
+            with TIMINGS.phase(host, 'command', **labels):
+                lines = iter_channel_lines(ssh, command)
+                result = access_records(
+                    host, iter_mac_records(lines, device['device_type']),
+                    skip_ports)
+    logging.info(received_msg.format(datetime.now().time(), len(result), ip))
+    return result
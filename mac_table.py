@@ -0,0 +1,231 @@
+import logging
+import random
+import time
+from collections import Counter
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+HEX_DIGITS = set('0123456789abcdef')
+
+
+def mac_to_int(mac):
+    """MAC-адрес в любом написании (aabb.ccdd.eeff, aa:bb:..., aa-bb-...)
+    в 48-битное целое. Для некорректного адреса возвращается -1."""
+    digits = ''.join(i for i in mac.lower() if i in HEX_DIGITS)
+    if len(digits) != 12:
+        return -1
+    return int(digits, 16)
+
+
+class Interner:
+    """Словарь строк столбца: строка - id в порядке появления."""
+
+    def __init__(self):
+        self.ids = {}
+        self.values = []
+
+    def __call__(self, value):
+        index = self.ids.get(value)
+        if index is None:
+            index = self.ids[value] = len(self.values)
+            self.values.append(value)
+        return index
+
+
+def _ranks(ids, values):
+    """Столбец id в ранги строк. Сортировка по рангам даёт тот же порядок,
+    что сортировка самих строк: NumPy сравнивает строки по кодам символов,
+    как Python. Ранжируются только встречающиеся в столбце строки.
+
+    Args:
+        ids (numpy.ndarray): id строк словаря
+        values (list): строки словаря
+
+    Returns:
+        tuple: (ранги, список строк в порядке рангов)
+    """
+    used, inverse = np.unique(ids, return_inverse=True)
+    strings = [values[i] for i in used.tolist()]
+    order = np.argsort(np.array(strings, dtype=str), kind='stable')
+    ranks = np.empty(len(order), dtype=np.uint32)
+    ranks[order] = np.arange(len(order), dtype=np.uint32)
+    return ranks[inverse], [strings[i] for i in order.tolist()]
+
+
+class MacTable:
+    """Столбцовое хранение таблиц MAC-адресов коммутаторов.
+
+    Строки (hostname, MAC, порт, VLAN) хранятся как id в словарях
+    столбцов. Исключение транковых портов, удаление дублей и сортировка
+    выполняются над массивами NumPy: id заменяются рангами строк, так что
+    порядок и дубли те же, что у строк. Без NumPy используется Counter и
+    sort.
+
+    Результат rows() совпадает с прежним parse_mac_info: кортежи
+    (host, destination_address, port, vlan) без портов, где больше
+    одной записи, без дублей, отсортированные.
+    """
+
+    def __init__(self):
+        self.hosts = Interner()
+        self.macs = Interner()
+        self.ports = Interner()
+        self.vlans = Interner()
+        self._host = []
+        self._mac = []
+        self._port = []
+        self._vlan = []
+
+    def add(self, host, output, skip_ports=()):
+        """Добавление вывода show mac address-table одного коммутатора.
+
+        Args:
+            host (str): hostname коммутатора
+            output (list): вывод TextFSM - список словарей с ключами
+            destination_address, port, vlan
+            skip_ports (container, optional): порты, записи которых
+            не учитываются (межкоммутаторные по LLDP)
+
+        Returns:
+            bool: False, если вывод не разобран и пропущен
+        """
+        try:
+            records = [(i['destination_address'], i['port'], i['vlan'])
+                       for i in output]
+        except (TypeError, KeyError):
+            logging.warning(f"{host}: проблема с обработкой вывода")
+            return False
+        if skip_ports:
+            records = [i for i in records if i[1] not in skip_ports]
+        host_id = self.hosts(host)
+        self._host.extend([host_id] * len(records))
+        self._mac.extend(self.macs(mac) for mac, _, _ in records)
+        self._port.extend(self.ports(port) for _, port, _ in records)
+        self._vlan.extend(self.vlans(vlan) for _, _, vlan in records)
+        return True
+
+    def __len__(self):
+        return len(self._host)
+
+    def rows(self):
+        """Записи access-портов для передачи в СУБД.
+
+        Returns:
+            list: отсортированный список кортежей
+            (host, destination_address, port, vlan)
+        """
+        if not self._host:
+            return []
+        if np is None:
+            return self._rows_python()
+        return self._rows_numpy()
+
+    def _rows_numpy(self):
+        host = np.array(self._host, dtype=np.int64)
+        port = np.array(self._port, dtype=np.int64)
+        # Порты с одной записью: счётчик по паре (коммутатор, порт)
+        pair = host * len(self.ports.values) + port
+        _, inverse, counts = np.unique(
+            pair, return_inverse=True, return_counts=True)
+        access = counts[inverse] < 2
+        host, hosts = _ranks(host[access], self.hosts.values)
+        mac, macs = _ranks(
+            np.array(self._mac, dtype=np.int64)[access], self.macs.values)
+        port, ports = _ranks(port[access], self.ports.values)
+        vlan, vlans = _ranks(
+            np.array(self._vlan, dtype=np.int64)[access], self.vlans.values)
+        order = np.lexsort((vlan, port, mac, host))
+        host, mac, port, vlan = host[order], mac[order], port[order], \
+            vlan[order]
+        # После сортировки дубли стоят подряд
+        unique = np.ones(len(order), dtype=bool)
+        unique[1:] = ((host[1:] != host[:-1]) | (mac[1:] != mac[:-1]) |
+                      (port[1:] != port[:-1]) | (vlan[1:] != vlan[:-1]))
+        return [(hosts[h], macs[m], ports[p], vlans[v]) for h, m, p, v in zip(
+            host[unique].tolist(), mac[unique].tolist(),
+            port[unique].tolist(), vlan[unique].tolist())]
+
+    def _rows_python(self):
+        counts = Counter(zip(self._host, self._port))
+        hosts, macs = self.hosts.values, self.macs.values
+        ports, vlans = self.ports.values, self.vlans.values
+        result = {(hosts[h], macs[m], ports[p], vlans[v])
+                  for h, m, p, v in zip(
+                      self._host, self._mac, self._port, self._vlan)
+                  if counts[h, p] < 2}
+        return sorted(result)
+
+
+def access_rows(raw_data, uplinks=None):
+    """Обработка вывода show mac address всех коммутаторов.
+
+    Args:
+        raw_data (iterable): словари hostname: вывод TextFSM
+        uplinks (dict, optional): hostname: порты с соседом-коммутатором
+        по LLDP (lldp.EdgeIndex.neighbor_ports). Исключаются всегда,
+        даже если за портом один MAC.
+
+    Returns:
+        list: отсортированный список кортежей для передачи в СУБД
+    """
+    table = MacTable()
+    for raw in raw_data:
+        for host, output in raw.items():
+            table.add(host, output, (uplinks or {}).get(host, ()))
+    return table.rows()
+
+
+def _reference_rows(raw_data):
+    """Прежний алгоритм parse_mac_info, для сравнения в бенчмарке."""
+    lists = []
+    for raw in raw_data:
+        for host, output in raw.items():
+            raw_ports = [i['port'] for i in output]
+            all_ports = set([i['port'] for i in output])
+            access_ports = [
+                u_port for u_port in all_ports if raw_ports.count(u_port) < 2]
+            macs = [(host, i['destination_address'], i['port'], i['vlan'])
+                    for i in output if i['port'] in access_ports]
+            lists.append(macs)
+    result = list(set().union(*lists))
+    result.sort()
+    return result
+
+
+def _synthetic(switches, entries, ports):
+    """Тестовые таблицы: на каждом коммутаторе часть портов - access
+    с одним MAC, остальные - транки с множеством MAC."""
+    data = []
+    for number in range(switches):
+        output = []
+        for index in range(entries):
+            if index < ports // 2:
+                port = f"Gi1/0/{index}"
+            else:
+                port = f"Te1/1/{random.randrange(ports // 2)}"
+            mac = random.getrandbits(48).to_bytes(6, 'big').hex()
+            output.append({
+                'destination_address': f"{mac[:4]}.{mac[4:8]}.{mac[8:]}",
+                'port': port,
+                'vlan': str(random.choice((1, 10, 100, 200, 1001))),
+            })
+        data.append({f"sw-{number:04d}": output})
+    return data
+
+
+if __name__ == "__main__":
+    random.seed(1)
+    data = _synthetic(switches=50, entries=5000, ports=2000)
+    print(f"Записей: {sum(len(o) for i in data for o in i.values())}")
+    started = time.perf_counter()
+    reference = _reference_rows(data)
+    print(f"Прежний алгоритм: {time.perf_counter() - started:.3f} с")
+    started = time.perf_counter()
+    rows = access_rows(data)
+    engine = 'NumPy' if np is not None else 'Python'
+    print(f"MacTable ({engine}): {time.perf_counter() - started:.3f} с")
+    assert rows == reference, "Результаты не совпадают"
+    print(f"Результат совпадает: {len(rows)} записей")
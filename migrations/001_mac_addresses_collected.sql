@@ -0,0 +1,16 @@
+-- Время записи снимка коммутатора в mac_addresses для mac_locator.
+-- Строки коммутатора пишутся одной транзакцией и получают одно значение
+-- now(), последний снимок - максимальное значение.
+--
+-- Применяется один раз до запуска mac_locator со снимками:
+--   psql -d <db_name> -f migrations/001_mac_addresses_collected.sql
+-- Выполнять вне транзакции (без psql -1): CREATE INDEX CONCURRENTLY.
+--
+-- now() не volatile, поэтому в PostgreSQL 11+ ADD COLUMN с DEFAULT не
+-- переписывает таблицу: существующие строки получают время миграции.
+
+ALTER TABLE mac_addresses ADD COLUMN IF NOT EXISTS collected timestamptz
+    NOT NULL DEFAULT now();
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS mac_addresses_collected
+    ON mac_addresses (switch_hostname, collected);
@@ -0,0 +1,152 @@
+import asyncio
+import ipaddress
+import logging
+import os
+import socket
+import struct
+import time
+
+# Скорость и параллельность сканирования, можно задать переменными окружения
+SWEEP_RATE = float(os.environ.get("NET_SWEEP_RATE", 2000))
+SWEEP_CONCURRENCY = int(os.environ.get("NET_SWEEP_CONCURRENCY", 512))
+SWEEP_TIMEOUT = float(os.environ.get("NET_SWEEP_TIMEOUT", 1.5))
+ICMP_ECHO_REQUEST = 8
+ICMP_ECHO_REPLY = 0
+
+
+def _checksum(data):
+    if len(data) % 2:
+        data += b'\x00'
+    total = sum(struct.unpack(f'!{len(data) // 2}H', data))
+    total = (total >> 16) + (total & 0xffff)
+    total += total >> 16
+    return ~total & 0xffff
+
+
+def icmp_permitted():
+    """Можно ли отправлять ICMP echo без root (ping-сокеты Linux,
+    sysctl net.ipv4.ping_group_range)."""
+    try:
+        sock = socket.socket(
+            socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP)
+    except OSError:
+        return False
+    sock.close()
+    return True
+
+
+async def icmp_probe(ip, timeout=SWEEP_TIMEOUT):
+    """ICMP echo через ping-сокет.
+
+    Args:
+        ip (str): IP-адрес
+        timeout (float, optional): Таймаут ответа, сек
+
+    Returns:
+        float: RTT в миллисекундах или None
+    """
+    loop = asyncio.get_running_loop()
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP)
+    sock.setblocking(False)
+    try:
+        # Идентификатор у ping-сокета подставляет ядро
+        header = struct.pack('!BBHHH', ICMP_ECHO_REQUEST, 0, 0, 0, 1)
+        payload = b'netsweep'
+        checksum = _checksum(header + payload)
+        packet = struct.pack(
+            '!BBHHH', ICMP_ECHO_REQUEST, 0, checksum, 0, 1) + payload
+        sock.connect((ip, 0))
+        started = time.monotonic()
+        await loop.sock_sendall(sock, packet)
+        deadline = started + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            reply = await asyncio.wait_for(
+                loop.sock_recv(sock, 1024), remaining)
+            if reply and reply[0] == ICMP_ECHO_REPLY:
+                return (time.monotonic() - started) * 1000
+    except (OSError, asyncio.TimeoutError):
+        return None
+    finally:
+        sock.close()
+
+
+async def tcp_probe(ip, port=22, timeout=SWEEP_TIMEOUT):
+    """Проверка открытого TCP-порта.
+
+    Args:
+        ip (str): IP-адрес
+        port (int, optional): TCP-порт. Defaults to 22.
+        timeout (float, optional): Таймаут подключения, сек
+
+    Returns:
+        float: время установки соединения в миллисекундах или None
+    """
+    started = time.monotonic()
+    try:
+        _, writer = await asyncio.wait_for(
+            asyncio.open_connection(ip, port), timeout)
+    except (OSError, asyncio.TimeoutError):
+        return None
+    rtt = (time.monotonic() - started) * 1000
+    writer.close()
+    return rtt
+
+
+async def _sweep(ip_net, port, rate, concurrency, timeout, icmp):
+    hosts = iter(ipaddress.ip_network(ip_net, strict=False).hosts())
+    result = {}
+    interval = 1 / rate if rate else 0
+    next_start = time.monotonic()
+
+    async def worker():
+        nonlocal next_start
+        for ip in hosts:
+            # Равномерный темп: не больше rate новых проб в секунду
+            now = time.monotonic()
+            wait = next_start - now
+            next_start = max(now, next_start) + interval
+            if wait > 0:
+                await asyncio.sleep(wait)
+            ip = str(ip)
+            probes = [tcp_probe(ip, port, timeout)]
+            if icmp:
+                probes.append(icmp_probe(ip, timeout))
+            rtts = await asyncio.gather(*probes)
+            if rtts[0] is not None:
+                result[ip] = {
+                    'ssh_rtt': round(rtts[0], 2),
+                    'icmp_rtt': round(rtts[1], 2) if icmp and rtts[1]
+                    else None,
+                }
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return result
+
+
+def sweep_network(ip_net, port=22, rate=SWEEP_RATE,
+                  concurrency=SWEEP_CONCURRENCY, timeout=SWEEP_TIMEOUT,
+                  icmp=True):
+    """Асинхронное сканирование диапазона: TCP/22 и ICMP одновременно.
+
+    В результат попадают только адреса с открытым SSH. ICMP только
+    измеряет задержку и используется, если ОС разрешает ping-сокеты.
+
+    Args:
+        ip_net (str): IP диапазон в формате 10.0.0.0/24
+        port (int, optional): SSH-порт. Defaults to 22.
+        rate (float, optional): новых проб в секунду, 0 - без ограничения
+        concurrency (int, optional): одновременных проб
+        timeout (float, optional): таймаут пробы, сек
+        icmp (bool, optional): измерять ICMP RTT. Defaults to True.
+
+    Returns:
+        dict: ip: {'ssh_rtt': мс, 'icmp_rtt': мс или None}
+    """
+    if icmp and not icmp_permitted():
+        logging.info("ICMP-сокеты недоступны, сканируем только TCP")
+        icmp = False
+    return asyncio.run(
+        _sweep(ip_net, port, rate, concurrency, timeout, icmp))
@@ -0,0 +1,33 @@
+import json
+import os
+
+# Режим паузы между командами:
+# prompt - следующая команда уходит сразу после получения приглашения,
+#          пауза только для платформ из PACING_PROFILES;
+# fixed  - прежнее поведение, 1 секунда после каждой команды.
+PACING = os.environ.get("NET_PACING", "prompt")
+FIXED_DELAY = 1
+PACING_FILE = os.environ.get("NET_PACING_FILE", "pacing_profiles.json")
+
+# Пауза между командами в секундах по device_type.
+# У SG300 медленный CLI, оставляем ему небольшую паузу.
+PACING_PROFILES = {
+    'cisco_s300': 0.5,
+}
+if os.path.isfile(PACING_FILE):
+    with open(PACING_FILE) as f:
+        PACING_PROFILES.update(json.load(f))
+
+
+def command_delay(device_type):
+    """Пауза перед следующей командой для платформы
+
+    Args:
+        device_type (str): device_type устройства в терминах NetMiko
+
+    Returns:
+        float: пауза в секундах, 0 - без паузы
+    """
+    if PACING == "fixed":
+        return FIXED_DELAY
+    return PACING_PROFILES.get(device_type, 0)
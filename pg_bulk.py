@@ -0,0 +1,181 @@
+import io
+import logging
+import os
+import random
+import time
+from configparser import ConfigParser
+from itertools import islice
+
+import psycopg2
+
+# Строк в одной порции COPY
+BATCH_SIZE = int(os.environ.get("NET_PG_BATCH", 50000))
+STAGING = 'staging'
+MAC_COLUMNS = ['switch_hostname', 'mac_address', 'switch_port', 'switch_vlan']
+SWITCHES_MERGE = (
+    "INSERT INTO {table} ({columns}) SELECT {columns} FROM {staging} "
+    "ON CONFLICT ON CONSTRAINT pk_switch_switch_hostname DO NOTHING")
+MAC_MERGE = "INSERT INTO {table} ({columns}) SELECT {columns} FROM {staging}"
+COPY_ESCAPE = str.maketrans(
+    {'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
+
+def _copy_line(row):
+    """Строка в текстовом формате COPY. None - NULL."""
+    return '\t'.join(
+        '\\N' if value is None else str(value).translate(COPY_ESCAPE)
+        for value in row) + '\n'
+
+
+def copy_rows(cursor, table, columns, rows, batch_size=BATCH_SIZE):
+    """Загрузка строк в таблицу через COPY порциями по batch_size.
+    rows может быть генератором: в памяти держится одна порция.
+
+    Args:
+        cursor: курсор psycopg2
+        table (str): таблица
+        columns (list): столбцы в порядке значений строки
+        rows (iterable): кортежи значений
+        batch_size (int, optional): строк в порции
+
+    Returns:
+        int: сколько строк загружено
+    """
+    sql = f"COPY {table} ({', '.join(columns)}) FROM STDIN"
+    rows = iter(rows)
+    total = 0
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            return total
+        buffer = io.StringIO(''.join(_copy_line(row) for row in batch))
+        cursor.copy_expert(sql, buffer)
+        total += len(batch)
+
+
+def table_columns(cursor, table, count):
+    """Первые count столбцов таблицы. Как у INSERT ... VALUES без списка
+    столбцов, значения строки сопоставляются столбцам по порядку."""
+    cursor.execute(f"SELECT * FROM {table} LIMIT 0")
+    return [column[0] for column in cursor.description][:count]
+
+
+def copy_merge(cursor, table, rows, columns, merge, batch_size=BATCH_SIZE,
+               params=None):
+    """COPY во временную таблицу и слияние в table одним запросом в
+    текущей транзакции курсора.
+
+    Args:
+        cursor: курсор psycopg2
+        table (str): целевая таблица
+        rows (iterable): кортежи значений
+        columns (list или int): столбцы table в порядке значений строки
+        или число значений - тогда первые столбцы таблицы по порядку
+        merge (str): запрос слияния. {table}, {staging} и {columns}
+        подставляются.
+        batch_size (int, optional): строк в порции COPY
+        params (dict, optional): параметры запроса слияния
+
+    Returns:
+        tuple: (загружено строк, затронуто строк слиянием)
+    """
+    if isinstance(columns, int):
+        columns = table_columns(cursor, table, columns)
+    cursor.execute(
+        f"CREATE TEMP TABLE {STAGING} ON COMMIT DROP AS "
+        f"SELECT {', '.join(columns)} FROM {table} WITH NO DATA")
+    copied = copy_rows(cursor, STAGING, columns, rows, batch_size)
+    cursor.execute(merge.format(
+        table=table, staging=STAGING, columns=', '.join(columns)), params)
+    return copied, cursor.rowcount
+
+
+def bulk_load(db, table, rows, columns, merge, batch_size=BATCH_SIZE,
+              params=None):
+    """Загрузка строк одной транзакцией через copy_merge на отдельном
+    подключении. Аргументы как у copy_merge, db - параметры
+    psycopg2.connect.
+
+    Returns:
+        tuple: (загружено строк, затронуто строк слиянием)
+    """
+    started = time.perf_counter()
+    connection = psycopg2.connect(**db)
+    try:
+        with connection, connection.cursor() as cursor:
+            copied, merged = copy_merge(
+                cursor, table, rows, columns, merge, batch_size, params)
+    finally:
+        connection.close()
+    logging.info(
+        f"{table}: загружено {copied}, слиянием затронуто {merged} строк "
+        f"за {time.perf_counter() - started:.2f} с")
+    return copied, merged
+
+
+def merge_switches(cursor, rows, batch_size=BATCH_SIZE):
+    """Коммутаторы (hostname, ip, vendor) в switches в транзакции курсора.
+    Существующие не меняются, как у INSERT ... ON CONFLICT DO NOTHING."""
+    return copy_merge(cursor, 'switches', rows, 3, SWITCHES_MERGE, batch_size)
+
+
+def merge_mac_addresses(cursor, rows, batch_size=BATCH_SIZE):
+    """Записи (hostname, MAC, порт, VLAN) в mac_addresses в транзакции
+    курсора."""
+    return copy_merge(
+        cursor, 'mac_addresses', rows, MAC_COLUMNS, MAC_MERGE, batch_size)
+
+
+def load_switches(db, rows, batch_size=BATCH_SIZE):
+    """merge_switches отдельной транзакцией."""
+    return bulk_load(db, 'switches', rows, 3, SWITCHES_MERGE, batch_size)
+
+
+def load_mac_addresses(db, rows, batch_size=BATCH_SIZE):
+    """merge_mac_addresses отдельной транзакцией."""
+    return bulk_load(
+        db, 'mac_addresses', rows, MAC_COLUMNS, MAC_MERGE, batch_size)
+
+
+def _synthetic_macs(count):
+    for index in range(count):
+        mac = random.getrandbits(48).to_bytes(6, 'big').hex()
+        yield (f"sw-{index % 2000:04d}", f"{mac[:4]}.{mac[4:8]}.{mac[8:]}",
+               f"Gi1/0/{index % 48 + 1}", str(index % 100 + 1))
+
+
+if __name__ == "__main__":
+    # Сравнение executemany и COPY на временной таблице в СУБД из
+    # config.ini. Таблицы скрипта не затрагиваются.
+    logging.basicConfig(format='%(levelname)s: %(message)s',
+                        level=logging.INFO)
+    config = ConfigParser()
+    config.read('config.ini')
+    database = {
+        "dbname": config.get('db', 'db_name', fallback='not exists'),
+        "host": config.get('db', 'host', fallback='not exists'),
+        "user": config.get('db', 'user', fallback='not exists'),
+        "password": config.get('db', 'password', fallback='not exists'),
+    }
+    total = int(os.environ.get("NET_PG_BENCH_ROWS", 1000000))
+    sample = min(total, 50000)
+    connection = psycopg2.connect(**database)
+    with connection, connection.cursor() as cursor:
+        cursor.execute(
+            "CREATE TEMP TABLE bench_mac_addresses (switch_hostname text, "
+            "mac_address text, switch_port text, switch_vlan text)")
+        started = time.perf_counter()
+        cursor.executemany(
+            "INSERT INTO bench_mac_addresses VALUES(%s, %s, %s, %s)",
+            _synthetic_macs(sample))
+        elapsed = time.perf_counter() - started
+        print(f"executemany: {sample} строк за {elapsed:.2f} с "
+              f"({sample / elapsed:.0f} строк/с)")
+        cursor.execute("TRUNCATE bench_mac_addresses")
+        started = time.perf_counter()
+        copy_rows(cursor, 'bench_mac_addresses', MAC_COLUMNS,
+                  _synthetic_macs(total))
+        elapsed = time.perf_counter() - started
+        print(f"COPY: {total} строк за {elapsed:.2f} с "
+              f"({total / elapsed:.0f} строк/с)")
+    connection.close()
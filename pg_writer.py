@@ -0,0 +1,144 @@
+import logging
+import os
+import queue
+import threading
+import time
+
+from concurrency import LIMITER
+from pg_bulk import BATCH_SIZE
+from psycopg2.pool import ThreadedConnectionPool
+
+# Подключений к СУБД и потоков записи
+WRITERS = int(os.environ.get("NET_PG_WRITERS", 2))
+# Сколько пачек коммутаторов может ждать записи
+QUEUE_SIZE = int(os.environ.get("NET_PG_QUEUE", 200))
+# Через сколько секунд без новых пачек записывать накопленное
+FLUSH_INTERVAL = float(os.environ.get("NET_PG_FLUSH_INTERVAL", 5))
+_STOP = object()
+
+
+class PipelinedWriter:
+    """Запись в PostgreSQL параллельно со сбором данных.
+
+    Пачки строк (обычно - один коммутатор) кладутся в ограниченную
+    очередь и сразу возвращают управление. Потоки записи копят строки до
+    flush_rows и пишут их одной транзакцией через load на подключении из
+    общего пула. Если очередь заполнена, put ждёт и сообщает регулятору
+    SSH-сессий, что сбор опережает запись. Ошибка записи пачки не
+    останавливает остальные, но close в конце вызывает исключение.
+
+    Потоки пишут пачки независимо и в любом порядке, поэтому load должен
+    допускать параллельную запись одних и тех же ключей. Для
+    mac_history.merge, где важен порядок записей MAC, нужен один поток.
+
+    Args:
+        db (dict): параметры psycopg2.connect
+        load (callable): load(cursor, rows) - запись пачки в транзакции
+        курсора, например pg_bulk.merge_mac_addresses
+        writers (int, optional): потоков записи и подключений
+        queue_size (int, optional): размер очереди пачек
+        flush_rows (int, optional): строк в одной транзакции
+        limiter (AdaptiveLimiter, optional): регулятор сбора
+    """
+
+    def __init__(self, db, load, writers=WRITERS, queue_size=QUEUE_SIZE,
+                 flush_rows=BATCH_SIZE, limiter=LIMITER):
+        self.load = load
+        self.flush_rows = flush_rows
+        self.limiter = limiter
+        self.written = 0
+        self.failed = 0
+        self._pool = ThreadedConnectionPool(1, writers + 1, **db)
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._threads = [
+            threading.Thread(target=self._run, name=f"PgWriter-{i}",
+                             daemon=True)
+            for i in range(writers)]
+        for thread in self._threads:
+            thread.start()
+
+    def execute(self, load, rows):
+        """Синхронная запись одной транзакцией на подключении из пула.
+
+        Returns:
+            результат load
+        """
+        connection = self._pool.getconn()
+        try:
+            with connection, connection.cursor() as cursor:
+                return load(cursor, rows)
+        finally:
+            self._pool.putconn(connection)
+
+    def put(self, rows):
+        """Постановка пачки строк в очередь записи."""
+        if not rows:
+            return
+        try:
+            self._queue.put_nowait(rows)
+        except queue.Full:
+            self.limiter.backpressure()
+            self._queue.put(rows)
+
+    def _flush(self, batch):
+        started = time.perf_counter()
+        try:
+            copied, _ = self.execute(self.load, batch)
+        except Exception as error:
+            logging.error(f"Ошибка записи {len(batch)} строк: {error}")
+            with self._lock:
+                self.failed += len(batch)
+            return
+        with self._lock:
+            self.written += copied
+        logging.info(f"Записано {copied} строк за "
+                     f"{time.perf_counter() - started:.2f} с")
+
+    def _run(self):
+        batch = []
+        while True:
+            try:
+                item = self._queue.get(timeout=FLUSH_INTERVAL)
+            except queue.Empty:
+                if batch:
+                    self._flush(batch)
+                    batch = []
+                continue
+            if item is _STOP:
+                break
+            batch.extend(item)
+            if len(batch) >= self.flush_rows:
+                self._flush(batch)
+                batch = []
+        if batch:
+            self._flush(batch)
+
+    def close(self, raise_errors=True):
+        """Запись оставшегося, остановка потоков и закрытие пула.
+
+        Args:
+            raise_errors (bool, optional): исключение, если часть строк не
+            записана; иначе только запись в лог
+
+        Raises:
+            RuntimeError: часть строк не записана
+        """
+        for _ in self._threads:
+            self._queue.put(_STOP)
+        for thread in self._threads:
+            thread.join()
+        self._pool.closeall()
+        logging.info(
+            f"Запись завершена: {self.written} строк, ошибок {self.failed}")
+        if self.failed:
+            if raise_errors:
+                raise RuntimeError(f"Не записано строк: {self.failed}")
+            logging.error(f"Не записано строк: {self.failed}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # Исключение из тела with не подменяется ошибкой записи
+        self.close(raise_errors=exc_type is None)
@@ -0,0 +1,272 @@
+import atexit
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+import textfsm_registry
+
+# Архив сырого вывода команд. Пустое значение NET_ARCHIVE отключает архив
+ARCHIVE_PATH = os.environ.get(
+    "NET_ARCHIVE", "/usr/local/scripts/output/raw_archive.sqlite")
+# Идентификатор запуска, под которым сохраняется вывод
+RUN_ID = os.environ.get(
+    "NET_RUN_ID", datetime.now().strftime('%Y%m%dT%H%M%S'))
+# Если задан, вывод берётся из архива этого запуска, а не с устройств
+REPLAY_RUN = os.environ.get("NET_REPLAY_RUN")
+REPLAY_THREADS = int(os.environ.get("NET_REPLAY_THREADS", 32))
+# Сколько последних запусков и дней хранить, 0 - без ограничения
+KEEP_RUNS = int(os.environ.get("NET_ARCHIVE_KEEP_RUNS", 30))
+RETENTION_DAYS = int(os.environ.get("NET_ARCHIVE_RETENTION_DAYS", 90))
+# Сколько выводов записывать одной транзакцией
+WRITE_BATCH = 500
+_STOP = object()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outputs (
+    run_id TEXT NOT NULL,
+    host TEXT NOT NULL,
+    command TEXT NOT NULL,
+    ip TEXT,
+    device_type TEXT,
+    ts REAL,
+    output BLOB,
+    PRIMARY KEY (run_id, host, command)
+)
+"""
+
+
+class RawArchive:
+    """Сырой вывод команд в SQLite, сжатый zlib.
+    Ключ записи - запуск (run_id), устройство и команда.
+
+    store только ставит вывод в очередь: запись идёт в отдельном потоке
+    пачками по WRITE_BATCH в одной транзакции, потоки SSH не ждут диск.
+    Поток запускается при первом store, close дописывает очередь и
+    удаляет старые запуски (purge).
+
+    Args:
+        path (str): путь к файлу архива
+        run_id (str, optional): запуск, под которым сохраняется вывод
+    """
+
+    def __init__(self, path, run_id=RUN_ID):
+        self.path = path
+        self.run_id = run_id
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._writer = None
+        self._db = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(SCHEMA)
+
+    def store(self, host, command, output, ip=None, device_type=None):
+        """Постановка вывода команды текущего запуска в очередь записи."""
+        blob = zlib.compress(output.encode('utf-8'))
+        if self._writer is None:
+            with self._lock:
+                if self._writer is None:
+                    self._writer = threading.Thread(
+                        target=self._write, name="RawArchive", daemon=True)
+                    self._writer.start()
+        self._queue.put((self.run_id, host, command, ip, device_type,
+                         time.time(), blob))
+
+    def _write(self):
+        stop = False
+        while not stop:
+            rows = [self._queue.get()]
+            while len(rows) < WRITE_BATCH:
+                try:
+                    rows.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if rows[-1] is _STOP:
+                rows.pop()
+                stop = True
+            if not rows:
+                continue
+            try:
+                with self._lock:
+                    with self._db:
+                        self._db.executemany(
+                            "INSERT OR REPLACE INTO outputs "
+                            "VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            except sqlite3.Error as error:
+                logging.error(
+                    f"Архив: не записано {len(rows)} выводов: {error}")
+
+    def purge(self, keep_runs=KEEP_RUNS, retention_days=RETENTION_DAYS):
+        """Удаление запусков сверх keep_runs последних и старше
+        retention_days дней. Текущий запуск не удаляется.
+
+        Returns:
+            int: сколько запусков удалено
+        """
+        cutoff = time.time() - retention_days * 86400
+        with self._lock:
+            runs = self._db.execute(
+                "SELECT run_id, MAX(ts) FROM outputs GROUP BY run_id "
+                "ORDER BY MAX(ts) DESC").fetchall()
+            old = [run_id for index, (run_id, last) in enumerate(runs)
+                   if run_id != self.run_id and (
+                       (keep_runs and index >= keep_runs)
+                       or (retention_days and last < cutoff))]
+            with self._db:
+                self._db.executemany(
+                    "DELETE FROM outputs WHERE run_id = ?",
+                    [(run_id,) for run_id in old])
+        if old:
+            logging.info(f"Архив: удалено запусков {len(old)}")
+        return len(old)
+
+    def runs(self):
+        """Список запусков: (run_id, устройств, команд, время начала)."""
+        with self._lock:
+            return self._db.execute(
+                "SELECT run_id, COUNT(DISTINCT host), COUNT(*), MIN(ts) "
+                "FROM outputs GROUP BY run_id ORDER BY run_id").fetchall()
+
+    def load(self, run_id, hosts=None, commands=None):
+        """Вывод запуска по устройствам.
+
+        Args:
+            run_id (str): запуск
+            hosts (iterable, optional): только эти устройства
+            commands (iterable, optional): только эти команды
+
+        Returns:
+            dict: host: {'ip', 'device_type', 'outputs': {команда: вывод}}
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT host, command, ip, device_type, output "
+                "FROM outputs WHERE run_id = ?", (run_id,)).fetchall()
+        hosts = set(hosts) if hosts is not None else None
+        commands = set(commands) if commands is not None else None
+        result = {}
+        for host, command, ip, device_type, blob in rows:
+            if hosts is not None and host not in hosts:
+                continue
+            if commands is not None and command not in commands:
+                continue
+            entry = result.setdefault(
+                host, {'ip': ip, 'device_type': device_type, 'outputs': {}})
+            entry['outputs'][command] = zlib.decompress(blob).decode('utf-8')
+        return result
+
+    def close(self, purge=False):
+        """Запись оставшейся очереди и закрытие архива. При purge
+        старые запуски удаляются."""
+        if self._writer is not None:
+            self._queue.put(_STOP)
+            self._writer.join()
+            self._writer = None
+        if purge:
+            self.purge()
+        with self._lock:
+            self._db.close()
+
+
+_archive = None
+_archive_failed = False
+_archive_lock = threading.Lock()
+
+
+def get_archive():
+    """Архив текущего запуска. Создаётся при первом обращении, а не при
+    импорте: каталог и файл архива нужны только когда есть что сохранить.
+    Если архив выключен, идёт replay или файл не открылся - None.
+
+    Returns:
+        RawArchive: архив или None
+    """
+    global _archive, _archive_failed
+    if _archive is not None or _archive_failed:
+        return _archive
+    if not ARCHIVE_PATH or REPLAY_RUN:
+        return None
+    with _archive_lock:
+        if _archive is None and not _archive_failed:
+            try:
+                _archive = RawArchive(ARCHIVE_PATH)
+            except (OSError, sqlite3.Error) as error:
+                _archive_failed = True
+                logging.warning(
+                    f"Архив {ARCHIVE_PATH} недоступен, вывод не "
+                    f"сохраняется: {error}")
+                return None
+            atexit.register(_archive.close, purge=True)
+    return _archive
+
+
+def store(device, command, output):
+    """Сохранение сырого вывода в архив, если он включён."""
+    archive = get_archive()
+    if archive is not None:
+        archive.store(device['host'], command, output,
+                      device.get('ip'), device.get('device_type'))
+
+
+def _parse_host(host, entry, commands):
+    outputs = {}
+    for command, textfsm in commands:
+        output = entry['outputs'][command]
+        if textfsm:
+            output = textfsm_registry.parse(
+                output, entry['device_type'], command)
+        outputs[command] = output
+    return {host: outputs}
+
+
+def replay_commands(run_id, devices, commands):
+    """Генератор: вывод команд из архива в формате send_commands.
+    Разбор TextFSM идёт параллельно в пуле процессов textfsm_registry.
+    Устройства, для которых в архиве нет всех команд, пропускаются.
+
+    Args:
+        run_id (str): запуск в архиве
+        devices (list): Список словарей устройств
+        commands (list): список кортежей (команда, использовать TextFSM)
+
+    Yields:
+        dict: hostname: словарь команда - вывод
+    """
+    archive = RawArchive(ARCHIVE_PATH, run_id)
+    names = [command for command, _ in commands]
+    data = archive.load(
+        run_id, [device['host'] for device in devices], names)
+    archive.close()
+    complete = {host: entry for host, entry in data.items()
+                if all(name in entry['outputs'] for name in names)}
+    logging.info(
+        f"Архив {run_id}: найдено {len(complete)} из {len(devices)} устройств")
+    with ThreadPoolExecutor(max_workers=REPLAY_THREADS) as executor:
+        futures = [executor.submit(_parse_host, host, entry, commands)
+                   for host, entry in complete.items()]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def replay_command(run_id, devices, command, textfsm=True):
+    """Генератор: вывод одной команды из архива в формате
+    send_show_command (hostname: вывод)."""
+    for record in replay_commands(run_id, devices, [(command, textfsm)]):
+        for host, outputs in record.items():
+            yield {host: outputs[command]}
+
+
+if __name__ == "__main__":
+    for run_id, hosts, outputs, started in RawArchive(ARCHIVE_PATH).runs():
+        started = datetime.fromtimestamp(started).strftime('%d.%m.%y %H:%M')
+        print(f"{run_id}  {started}  устройств: {hosts}  выводов: {outputs}")
@@ -4,16 +4,57 @@ import time
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 
-from netmiko import ConnectHandler
+import async_engine
+import raw_archive
+import textfsm_registry
+from concurrency import LIMITER
+from pacing import command_delay
+from ssh_pool import POOL
+from timings import TIMINGS
 
 logging.getLogger("paramiko").setLevel(logging.WARNING)
 logging.basicConfig(
     format='%(threadName)s %(name)s %(levelname)s: %(message)s',
     level=logging.INFO)
+# Движок параллельного опроса: thread - ThreadPoolExecutor,
+# asyncio - async_engine (один event loop на все сессии)
+BACKEND = os.environ.get("NET_BACKEND", "thread")
 start_msg = '===> {} Отправка: {}'
 received_msg = '<=== {} Получение: {}'
 
 
+def parse_output(output, device_type, command):
+    """Разбор вывода TextFSM заранее скомпилированными шаблонами в пуле
+    процессов textfsm_registry. Как и в NetMiko, при отсутствии шаблона
+    или пустом результате возвращается исходный вывод."""
+    return textfsm_registry.parse(output, device_type, command)
+
+
+def run_command(ssh, device, command, textfsm):
+    """Выполнение команды с замером времени команды и разбора TextFSM
+
+    Args:
+        ssh (BaseConnection): подключение NetMiko
+        device (dict): Парметры устройства для подключения
+        command (str): команда отправляемая на устройство
+        textfsm (bool): Использовать TextFSM
+
+    Returns:
+        str или list: вывод команды
+    """
+    labels = {'ip': device['ip'], 'device_type': device['device_type'],
+              'command': command}
+    with TIMINGS.phase(device['host'], 'command', **labels):
+        output = ssh.send_command(command)
+    # Сырой вывод сохраняется до разбора: его можно разобрать заново
+    # исправленным шаблоном без повторного опроса устройств
+    raw_archive.store(device, command, output)
+    if textfsm:
+        with TIMINGS.phase(device['host'], 'parse', **labels):
+            output = parse_output(output, device['device_type'], command)
+    return output
+
+
 def send_show_command(device, command, textfsm=True):
     """Отправка команды show на устройство
 
@@ -32,54 +73,120 @@ def send_show_command(device, command, textfsm=True):
     ip = device['ip']
     host = device['host']
     logging.info(start_msg.format(datetime.now().time(), ip))
-    with ConnectHandler(**device) as ssh:
-        output = ssh.send_command(command, use_textfsm=textfsm)
-        logging.info(received_msg.format(datetime.now().time(), ip))
+    with LIMITER.slot(ip) as slot:
+        started = time.monotonic()
+        with POOL.session(device) as ssh:
+            slot.latency = time.monotonic() - started
+            output = run_command(ssh, device, command, textfsm)
+            logging.info(received_msg.format(datetime.now().time(), ip))
     return {host: output}
 
 
-def send_command_parallel(devices, command, limit=50, textfsm=True):
-    """Отправка одной команды show на устройства в несколько потоков
+def iter_parallel(func, devices, args=(), limit=None):
+    """Запуск func(device, *args) для устройств в несколько потоков.
+    Результат отдаётся по мере готовности, не дожидаясь самого медленного
+    устройства.
+
+    Args:
+        func (callable): функция опроса одного устройства
+        devices (list): Список словарей содержащие информацию для подключения
+        args (tuple, optional): дополнительные аргументы func.
+        limit (int, optional): Количество потоков. По умолчанию верхняя
+        граница адаптивного лимита. Число одновременных SSH-сессий
+        регулирует concurrency.LIMITER.
+
+    Yields:
+        результат func для очередного устройства
+    """
+    if limit is None:
+        limit = LIMITER.maximum
+    with ThreadPoolExecutor(max_workers=max(limit, 1)) as executor:
+        futures = {executor.submit(func, device, *args) for device in devices}
+        # as_completed отпускает отданные futures, после del других ссылок
+        # на них нет и вывод устройства не копится в памяти
+        completed = as_completed(futures)
+        del futures
+        for future in completed:
+            yield future.result()
+
+
+def iter_command_parallel(devices, command, limit=None, textfsm=True):
+    """Генератор: одна команда show на устройства в несколько потоков.
+    Вывод каждого устройства отдаётся сразу после получения.
 
     Args:
         devices (list): Список словарей содержащие информацию для подключения
         command (str): команда отправляемая на устройства
-        limit (int, optional): Количество потоков. Defaults to 50.
+        limit (int, optional): Количество потоков. По умолчанию
+        определяется адаптивным лимитом concurrency.LIMITER.
         textfsm (bool, optional): Использовать TextFSM. Defaults to True.
 
-    Returns:
-        [list]: список словарей ключ - ip. Значение вывод с устройства
+    Yields:
+        dict: hostname: вывод команды show
     """
-    with ThreadPoolExecutor(max_workers=limit) as executor:
-        result_all = [
-            executor.submit(send_show_command, device, command, textfsm)
-            for device in devices
-        ]
-        output = [f.result() for f in as_completed(result_all)]
+    if raw_archive.REPLAY_RUN:
+        return raw_archive.replay_command(
+            raw_archive.REPLAY_RUN, devices, command, textfsm)
+    if BACKEND == "asyncio":
+        return async_engine.iter_command_parallel(
+            devices, command, limit, textfsm)
+    return iter_parallel(send_show_command, devices, (command, textfsm), limit)
 
-    return output
+
+def iter_commands_parallel(devices, commands, limit=None):
+    """Генератор: несколько команд show на устройства в несколько потоков.
+    Вывод каждого устройства отдаётся сразу после получения.
+
+    Args:
+        devices (list): Список словарей содержащие информацию для подключения
+        commands (list): список кортежей (команда, использовать TextFSM)
+        limit (int, optional): Количество потоков. По умолчанию
+        определяется адаптивным лимитом concurrency.LIMITER.
+
+    Yields:
+        dict: hostname: словарь команда - вывод
+    """
+    if raw_archive.REPLAY_RUN:
+        return raw_archive.replay_commands(
+            raw_archive.REPLAY_RUN, devices, commands)
+    if BACKEND == "asyncio":
+        return async_engine.iter_commands_parallel(devices, commands, limit)
+    return iter_parallel(send_commands, devices, (commands,), limit)
 
 
-def send_commands_parallel(devices, commands, limit=50):
-    """Отправка нескольких команд show на устройства в несколько потоков
+def send_command_parallel(devices, command, limit=None, textfsm=True):
+    """Отправка одной команды show на устройства в несколько потоков.
+    SSH-сессии берутся из общего пула ssh_pool.POOL и возвращаются в него,
+    поэтому повторный опрос того же устройства обходится без логина.
 
     Args:
         devices (list): Список словарей содержащие информацию для подключения
         command (str): команда отправляемая на устройства
-        limit (int, optional): Количество потоков. Defaults to 50.
+        limit (int, optional): Количество потоков. По умолчанию
+        определяется адаптивным лимитом concurrency.LIMITER.
         textfsm (bool, optional): Использовать TextFSM. Defaults to True.
 
     Returns:
         [list]: список словарей ключ - ip. Значение вывод с устройства
     """
-    with ThreadPoolExecutor(max_workers=limit) as executor:
-        result_all = [
-            executor.submit(send_commands, device, commands)
-            for device in devices
-        ]
-        output = [f.result() for f in as_completed(result_all)]
+    return list(iter_command_parallel(devices, command, limit, textfsm))
 
-    return output
+
+def send_commands_parallel(devices, commands, limit=None):
+    """Отправка нескольких команд show на устройства в несколько потоков.
+    SSH-сессии берутся из общего пула ssh_pool.POOL.
+
+    Args:
+        devices (list): Список словарей содержащие информацию для подключения
+        command (str): команда отправляемая на устройства
+        limit (int, optional): Количество потоков. По умолчанию
+        определяется адаптивным лимитом concurrency.LIMITER.
+        textfsm (bool, optional): Использовать TextFSM. Defaults to True.
+
+    Returns:
+        [list]: список словарей ключ - ip. Значение вывод с устройства
+    """
+    return list(iter_commands_parallel(devices, commands, limit))
 
 
 def send_commands(device, commands):
@@ -99,11 +206,18 @@ def send_commands(device, commands):
     result = {}
     result[host] = {}
     logging.info(start_msg.format(datetime.now().time(), ip))
-    with ConnectHandler(**device) as ssh:
-        for command, textfsm in commands:
-            output = ssh.send_command(command, use_textfsm=textfsm)
-            result[host][command] = output
-            time.sleep(1)
+    delay = command_delay(device['device_type'])
+    with LIMITER.slot(ip) as slot:
+        started = time.monotonic()
+        with POOL.session(device) as ssh:
+            slot.latency = time.monotonic() - started
+            # send_command ждёт приглашение, поэтому пауза нужна только
+            # платформам из профиля pacing.PACING_PROFILES
+            for index, (command, textfsm) in enumerate(commands):
+                if index and delay:
+                    time.sleep(delay)
+                output = run_command(ssh, device, command, textfsm)
+                result[host][command] = output
     logging.info(received_msg.format(datetime.now().time(), ip))
     return result
 
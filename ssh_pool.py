@@ -0,0 +1,246 @@
+import atexit
+import logging
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from netmiko import ConnectHandler
+from netmiko.ssh_exception import NetmikoTimeoutException
+from timings import TIMINGS
+
+logging.getLogger("paramiko").setLevel(logging.WARNING)
+
+# Ограничения пула. Можно переопределить переменными окружения.
+MAX_SESSIONS = int(os.environ.get("NET_POOL_MAX_SESSIONS", 500))
+IDLE_TIMEOUT = float(os.environ.get("NET_POOL_IDLE_TIMEOUT", 300))
+connect_msg = '===> {} Новая SSH-сессия: {}'
+evict_msg = '<=== {} Закрыта SSH-сессия: {} ({})'
+
+
+def session_key(device):
+    """Ключ сессии в пуле: адрес устройства, порт, учётные данные и драйвер.
+
+    NetMiko подключается по 'ip', если он задан, иначе по 'host'.
+
+    Args:
+        device (dict): Параметры устройства для подключения
+
+    Returns:
+        tuple: ключ для поиска сессии в пуле
+    """
+    address = device.get('ip') or device.get('host')
+    return (
+        address, device.get('port', 22), device.get('username'),
+        device.get('password'), device.get('device_type'))
+
+
+def connect(device):
+    """Подключение NetMiko с замером фаз: TCP, SSH-логин, приглашение.
+
+    Args:
+        device (dict): Параметры устройства для подключения
+
+    Returns:
+        BaseConnection: подключение NetMiko
+    """
+    address = device.get('ip') or device.get('host')
+    labels = {'ip': address, 'device_type': device.get('device_type')}
+    host = device.get('host', address)
+    try:
+        with TIMINGS.phase(host, 'tcp_connect', **labels):
+            sock = socket.create_connection(
+                (address, device.get('port', 22)),
+                timeout=device.get('conn_timeout', 5))
+    except OSError as error:
+        raise NetmikoTimeoutException(
+            f"TCP connection to device failed: {address}") from error
+    # Подключение по шагам публичными методами NetMiko: установка SSH и
+    # подготовка сессии (приглашение, paging) замеряются отдельно.
+    # Драйверы, которым нужна подготовка параметров до подключения
+    # (fortinet, mikrotik), в сети не используются.
+    ssh = ConnectHandler(**device, sock=sock, auto_connect=False)
+    try:
+        with TIMINGS.phase(host, 'ssh_login', **labels):
+            ssh.establish_connection()
+        with TIMINGS.phase(host, 'prompt', **labels):
+            ssh.session_preparation()
+    except BaseException:
+        try:
+            ssh.disconnect()
+        except Exception:
+            pass
+        sock.close()
+        raise
+    return ssh
+
+
+class SessionPool:
+    """Пул SSH-сессий NetMiko, общий для всего процесса.
+
+    Сессия берётся из пула на время работы с устройством и возвращается
+    после. Перед выдачей сессия проверяется (is_alive), простаивающие
+    дольше idle_timeout закрываются. Общее число сессий не превышает
+    max_sessions: при нехватке закрывается самая старая свободная сессия
+    или поток ждёт освобождения.
+    """
+
+    def __init__(self, max_sessions=MAX_SESSIONS, idle_timeout=IDLE_TIMEOUT):
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self._idle = {}
+        self._total = 0
+        self._last_sweep = time.monotonic()
+        self._closing = []
+        self._lock = threading.Condition()
+
+    def _close(self, ssh, reason):
+        """Ставит сессию в очередь на закрытие. Вызывается под
+        блокировкой, сама сессия закрывается в _disconnect_closing."""
+        self._closing.append((ssh, reason))
+
+    def _disconnect(self, ssh, reason):
+        try:
+            ssh.disconnect()
+        except Exception:
+            pass
+        logging.debug(evict_msg.format(
+            datetime.now().time(), ssh.host, reason))
+
+    def _disconnect_closing(self):
+        """Закрывает сессии из очереди вне блокировки пула: медленный
+        disconnect не задерживает потоки, ждущие acquire."""
+        with self._lock:
+            closing, self._closing = self._closing, []
+        for ssh, reason in closing:
+            self._disconnect(ssh, reason)
+
+    def _pop_idle(self, key):
+        """Свободная сессия по ключу или None. Вызывается под блокировкой."""
+        sessions = self._idle.get(key)
+        while sessions:
+            ssh, last_used = sessions.pop()
+            if time.monotonic() - last_used < self.idle_timeout:
+                return ssh
+            self._total -= 1
+            self._close(ssh, 'idle')
+        return None
+
+    def _evict_oldest(self):
+        """Закрывает самую давнюю свободную сессию. Под блокировкой."""
+        oldest = None
+        for key, sessions in self._idle.items():
+            for index, (_, last_used) in enumerate(sessions):
+                if oldest is None or last_used < oldest[2]:
+                    oldest = (key, index, last_used)
+        if oldest is None:
+            return False
+        key, index, _ = oldest
+        ssh, _ = self._idle[key].pop(index)
+        self._total -= 1
+        self._close(ssh, 'max_sessions')
+        return True
+
+    def evict_idle(self):
+        """Закрывает все сессии, простаивающие дольше idle_timeout."""
+        now = time.monotonic()
+        with self._lock:
+            self._last_sweep = now
+            for key, sessions in self._idle.items():
+                alive = []
+                for ssh, last_used in sessions:
+                    if now - last_used < self.idle_timeout:
+                        alive.append((ssh, last_used))
+                    else:
+                        self._total -= 1
+                        self._close(ssh, 'idle')
+                self._idle[key] = alive
+            self._lock.notify_all()
+        self._disconnect_closing()
+
+    def acquire(self, device):
+        """Выдаёт живую сессию к устройству: из пула или новую.
+
+        Args:
+            device (dict): Параметры устройства для подключения
+
+        Returns:
+            BaseConnection: подключение NetMiko
+        """
+        key = session_key(device)
+        if time.monotonic() - self._last_sweep > self.idle_timeout:
+            self.evict_idle()
+        while True:
+            with self._lock:
+                ssh = self._pop_idle(key)
+                if ssh is None:
+                    while (self._total >= self.max_sessions
+                           and not self._evict_oldest()):
+                        self._lock.wait()
+                    self._total += 1
+            self._disconnect_closing()
+            if ssh is None:
+                break
+            # Проверка здоровья вне блокировки: is_alive ходит в канал
+            if ssh.is_alive():
+                return ssh
+            self.discard(ssh, 'dead')
+
+        logging.info(connect_msg.format(datetime.now().time(), key[0]))
+        try:
+            return connect(device)
+        except Exception:
+            with self._lock:
+                self._total -= 1
+                self._lock.notify()
+            raise
+
+    def release(self, device, ssh):
+        """Возвращает исправную сессию в пул."""
+        with self._lock:
+            self._idle.setdefault(session_key(device), []).append(
+                (ssh, time.monotonic()))
+            self._lock.notify()
+
+    def discard(self, ssh, reason='error'):
+        """Закрывает сессию, не возвращая её в пул."""
+        self._disconnect(ssh, reason)
+        with self._lock:
+            self._total -= 1
+            self._lock.notify()
+
+    @contextmanager
+    def session(self, device):
+        """Контекстный менеджер: взять сессию и вернуть после работы.
+
+        При исключении сессия закрывается, т.к. её состояние неизвестно.
+
+        Args:
+            device (dict): Параметры устройства для подключения
+        """
+        ssh = self.acquire(device)
+        try:
+            yield ssh
+        except BaseException:
+            self.discard(ssh)
+            raise
+        else:
+            self.release(device, ssh)
+
+    def close_all(self):
+        """Закрывает все свободные сессии пула."""
+        with self._lock:
+            for sessions in self._idle.values():
+                for ssh, _ in sessions:
+                    self._total -= 1
+                    self._close(ssh, 'shutdown')
+            self._idle.clear()
+            self._lock.notify_all()
+        self._disconnect_closing()
+
+
+# Пул на весь процесс
+POOL = SessionPool()
+atexit.register(POOL.close_all)
@@ -0,0 +1,81 @@
+from types import SimpleNamespace
+
+import cmdb_sync
+
+PARENT_UNIT = 7
+
+
+def make_object(object_id, key, name, parent=None):
+    """Объект CMDB с атрибутами Name и ссылочным Parent unit."""
+    values_json = [{'referencedObject': {'objectKey': parent[0],
+                                         'label': parent[1]}}] \
+        if parent else []
+    return SimpleNamespace(
+        id=object_id, name=name,
+        object_json={'id': object_id, 'objectKey': key, 'label': name},
+        attributes={'Parent unit': SimpleNamespace(
+            id=PARENT_UNIT, value=parent[1] if parent else None,
+            values_json=values_json)})
+
+
+def make_type():
+    objects = [
+        make_object(1, 'NET-1', 'x-SW-ZU-COR-01'),
+        make_object(2, 'NET-2', 'x-SW-ZU-DIS-01',
+                    parent=('NET-1', 'x-SW-ZU-COR-01')),
+        make_object(3, 'NET-3', 'x-SW-ZU-ACS-01',
+                    parent=('NET-2', 'x-SW-ZU-DIS-01')),
+    ]
+    return SimpleNamespace(objects={i.id: i for i in objects})
+
+
+def test_parent_unit_change_sends_parent_key():
+    object_type = make_type()
+    updates, missing = cmdb_sync.plan(
+        object_type, {'x-SW-ZU-ACS-01': {
+            'Name': 'x-SW-ZU-ACS-01', 'Parent unit': 'x-SW-ZU-COR-01'}},
+        keys=('Name',), references={'Parent unit': object_type})
+    assert missing == []
+    assert len(updates) == 1
+    assert updates[0].key == 3
+    assert updates[0].attributes == {PARENT_UNIT: 'NET-1'}
+    assert updates[0].diff == {
+        'Parent unit': ('x-SW-ZU-DIS-01', 'x-SW-ZU-COR-01')}
+
+
+def test_unchanged_parent_unit_compared_by_key():
+    object_type = make_type()
+    updates, _ = cmdb_sync.plan(
+        object_type, {'x-SW-ZU-ACS-01': {
+            'Name': 'x-SW-ZU-ACS-01', 'Parent unit': 'x-SW-ZU-DIS-01'}},
+        keys=('Name',), references={'Parent unit': object_type})
+    assert updates == []
+
+
+def test_unknown_parent_unit_is_not_written():
+    object_type = make_type()
+    updates, _ = cmdb_sync.plan(
+        object_type, {'x-SW-ZU-ACS-01': {
+            'Name': 'x-SW-ZU-ACS-01', 'Parent unit': 'x-SW-NEW-01'}},
+        keys=('Name',), references={'Parent unit': object_type})
+    assert updates == []
+
+
+def test_empty_parent_unit_clears_reference():
+    object_type = make_type()
+    updates, _ = cmdb_sync.plan(
+        object_type, {'x-SW-ZU-ACS-01': {
+            'Name': 'x-SW-ZU-ACS-01', 'Parent unit': None}},
+        keys=('Name',), references={'Parent unit': object_type})
+    assert len(updates) == 1
+    assert updates[0].attributes == {PARENT_UNIT: []}
+    assert updates[0].diff == {'Parent unit': ('x-SW-ZU-DIS-01', None)}
+
+
+def test_empty_parent_unit_without_reference_unchanged():
+    object_type = make_type()
+    updates, _ = cmdb_sync.plan(
+        object_type, {'x-SW-ZU-COR-01': {
+            'Name': 'x-SW-ZU-COR-01', 'Parent unit': None}},
+        keys=('Name',), references={'Parent unit': object_type})
+    assert updates == []
@@ -0,0 +1,40 @@
+from field_extractor import FieldExtractor
+
+SUMMARY = """Name                    :x-AP-ZU-01
+System Location         :ZU bld2
+Gateway IP Address      :10.10.0.1
+IP Address              :10.10.0.15
+Serial Number           :CNF7J0T123
+"""
+
+
+def test_fields_found_in_one_pass():
+    extractor = FieldExtractor({
+        'Location': r'System Location\s+:(\S+ \S+)',
+        'IP-Address': r'^IP Address\s+:(\S+)',
+        'Serial Number': r'Serial Number\s+:(\S+)',
+    })
+    assert extractor.extract(SUMMARY) == {
+        'Location': 'ZU bld2',
+        'IP-Address': '10.10.0.15',
+        'Serial Number': 'CNF7J0T123',
+    }
+
+
+def test_overlapping_fields():
+    extractor = FieldExtractor({
+        'Serial Number': r'Serial Number\s+:(\S+)',
+        'Serial Suffix': (r'Number\s+:\S+(\d{3})$', int),
+    })
+    assert extractor.extract(SUMMARY) == {
+        'Serial Number': 'CNF7J0T123', 'Serial Suffix': 123}
+
+
+def test_missing_field_is_none():
+    extractor = FieldExtractor({
+        'Model': (r'MODEL:\s+(\S+)\)', str.upper),
+        'Serial Number': r'Serial Number\s+:(\S+)',
+    })
+    assert extractor.extract(SUMMARY) == {
+        'Model': None, 'Serial Number': 'CNF7J0T123'}
+    assert extractor.extract(None) == {'Model': None, 'Serial Number': None}
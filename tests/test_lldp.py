@@ -0,0 +1,67 @@
+import os
+
+from lldp import LldpEdge, parse_lldp
+from xfunctions import normalize_name
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+def read(name):
+    with open(os.path.join(FIXTURES, name)) as f:
+        return f.read()
+
+
+def test_cisco_ios_detail():
+    edges = parse_lldp(
+        'x-SW-ZU-ACS-01', read('cisco_ios_lldp_neighbors_detail.txt'),
+        'cisco_ios')
+    assert edges == [
+        LldpEdge('x-SW-ZU-ACS-01', 'Gi1/0/49',
+                 normalize_name('x-SW-ZU-DIS-01.corp.local'), 'Gi1/0/1',
+                 '0011.2233.4400'),
+        LldpEdge('x-SW-ZU-ACS-01', 'Gi1/0/50',
+                 normalize_name('x-SW-ZU-ACS-02'), '1/1/1',
+                 '001b.54aa.bb00'),
+    ]
+
+
+def test_fastiron_detail():
+    output = read('ruckus_fastiron_lldp_neighbors_detail.txt')
+    for platform in ('ruckus_fastiron', 'brocade_fastiron'):
+        edges = parse_lldp('x-SW-ZU-ACS-02', output, platform)
+        assert edges == [
+            LldpEdge('x-SW-ZU-ACS-02', '1/2/1',
+                     normalize_name('x-SW-ZU-DIS-01.corp.local'), 'Gi1/0/50',
+                     '0011.2233.4400'),
+            # Сосед без System name (не коммутатор) - имя None
+            LldpEdge('x-SW-ZU-ACS-02', '1/1/7', None, '00e0.4c68.0a11',
+                     '00e0.4c68.0a00'),
+        ]
+
+
+def test_cisco_s300_table():
+    edges = parse_lldp(
+        'x-SW-ZU-ACS-03', read('cisco_s300_lldp_neighbors.txt'), 'cisco_s300')
+    assert edges == [
+        LldpEdge('x-SW-ZU-ACS-03', 'gi1/0/24',
+                 normalize_name('x-SW-ZU-DIS-01'), 'Gi1/0/3',
+                 '00:11:22:33:44:00'),
+        # Пустая колонка System Name
+        LldpEdge('x-SW-ZU-ACS-03', 'gi1/0/1', None, '00:e0:4c:68:0a:11',
+                 '00:e0:4c:68:0a:00'),
+    ]
+
+
+def test_aruba_ap():
+    edges = parse_lldp(
+        'x-AP-ZU-01', read('aruba_ap_lldp_neighbor.txt'), 'aruba_ap')
+    assert edges == [
+        LldpEdge('x-AP-ZU-01', 'bond0',
+                 normalize_name('x-SW-ZU-ACS-01.corp.local'), 'Gi1/0/5',
+                 '00:11:22:33:44:05'),
+    ]
+
+
+def test_no_output():
+    assert parse_lldp('x-SW-ZU-ACS-01', None, 'cisco_ios') == []
+    assert parse_lldp('x-SW-ZU-ACS-01', '', 'cisco_s300') == []
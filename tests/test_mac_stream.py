@@ -0,0 +1,91 @@
+import os
+
+import mac_stream
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+def read(name):
+    with open(os.path.join(FIXTURES, name)) as f:
+        return f.read()
+
+
+def records(name, device_type):
+    return list(mac_stream.iter_mac_records(
+        read(name).splitlines(), device_type))
+
+
+def test_cisco_ios_records():
+    result = records('cisco_ios_mac_address_table.txt', 'cisco_ios')
+    assert ('0011.2233.4455', 'Gi1/0/1', '10') in result
+    assert ('00e0.4c68.0a11', 'Gi1/0/3', '100') in result
+    assert len(result) == 8
+
+
+def test_cisco_ios_access_ports():
+    result = mac_stream.access_records(
+        'sw1', records('cisco_ios_mac_address_table.txt', 'cisco_ios'))
+    assert sorted(result) == [
+        ('sw1', '0011.2233.4455', 'Gi1/0/1', '10'),
+        ('sw1', '0011.2233.4466', 'Gi1/0/2', '10'),
+        ('sw1', '00e0.4c68.0a11', 'Gi1/0/3', '100'),
+    ]
+
+
+def test_cisco_s300_records():
+    result = records('cisco_s300_mac_address_table.txt', 'cisco_s300')
+    assert result == [
+        ('00:11:22:33:44:55', 'gi1/0/1', '1'),
+        ('00:1b:54:aa:bb:01', 'gi1/0/24', '1'),
+        ('00:1b:54:aa:bb:02', 'gi1/0/24', '10'),
+        ('00:e0:4c:68:0a:11', 'gi1/0/5', '10'),
+    ]
+
+
+def test_fastiron_records():
+    for device_type in ('ruckus_fastiron', 'brocade_fastiron'):
+        result = records('ruckus_fastiron_mac_address.txt', device_type)
+        assert result == [
+            ('0011.2233.4455', '1/1/1', '10'),
+            ('001b.54aa.bb01', '1/2/1', '20'),
+            ('001b.54aa.bb02', '1/2/1', '20'),
+            ('00e0.4c68.0a11', '1/1/7', '100'),
+        ]
+
+
+def test_skip_ports():
+    result = mac_stream.access_records(
+        'sw1', records('ruckus_fastiron_mac_address.txt', 'ruckus_fastiron'),
+        skip_ports={'1/1/7'})
+    assert sorted(result) == [('sw1', '0011.2233.4455', '1/1/1', '10')]
+
+
+class FakeChannel:
+    """Канал NetMiko, отдающий вывод заданными кусками."""
+
+    base_prompt = 'x-SW-01'
+    RETURN = '\n'
+
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+
+    def clear_buffer(self):
+        pass
+
+    def write_channel(self, data):
+        pass
+
+    def read_channel(self):
+        return self.chunks.pop(0) if self.chunks else ''
+
+
+def test_channel_skips_echo_with_prompt():
+    command = 'show mac address-table'
+    output = read('cisco_ios_mac_address_table.txt').replace('\n', '\r\n')
+    # Приглашение до эха и эхо с приглашением не завершают чтение
+    channel = FakeChannel(
+        ['x-SW-01#', f'{command}\r\n', output[:100], output[100:],
+         'x-SW-01#'])
+    lines = mac_stream.iter_channel_lines(channel, command, timeout=1)
+    result = list(mac_stream.iter_mac_records(lines, 'cisco_ios'))
+    assert len(result) == 8
@@ -0,0 +1,155 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import textfsm
+from netmiko.utilities import get_template_dir
+from textfsm import clitable
+
+# Платформы, с которыми работают скрипты (get_vlan_info.COMMANDS и
+# brocade_fastiron). Их шаблоны компилируются заранее.
+PLATFORMS = ('cisco_ios', 'cisco_s300', 'ruckus_fastiron', 'brocade_fastiron')
+# Процессов для разбора TextFSM, 0 - разбор в потоке сбора
+PARSE_WORKERS = int(os.environ.get("NET_PARSE_WORKERS", os.cpu_count() or 1))
+
+
+class TemplateRegistry:
+    """Индекс и скомпилированные шаблоны TextFSM.
+
+    NetMiko на каждый вызов send_command(use_textfsm=True) заново читает
+    и компилирует файлы шаблонов. Здесь каждый шаблон компилируется один
+    раз на процесс. Объект TextFSM хранит состояние разбора, поэтому
+    разбор одним шаблоном идёт под его блокировкой.
+
+    Args:
+        template_dir (str, optional): каталог с index и шаблонами.
+        По умолчанию как в NetMiko (NET_TEXTFSM).
+    """
+
+    def __init__(self, template_dir=None):
+        self.template_dir = template_dir or get_template_dir()
+        self.index = clitable.CliTable('index', self.template_dir).index
+        self._templates = {}
+        self._lock = threading.Lock()
+
+    def _compiled(self, name):
+        template = self._templates.get(name)
+        if template is None:
+            with self._lock:
+                template = self._templates.get(name)
+                if template is None:
+                    path = os.path.join(self.template_dir, name)
+                    with open(path) as f:
+                        template = (textfsm.TextFSM(f), threading.Lock())
+                    self._templates[name] = template
+        return template
+
+    def preload(self, platforms=PLATFORMS):
+        """Компиляция всех шаблонов index для указанных платформ.
+
+        Returns:
+            int: сколько шаблонов скомпилировано
+        """
+        for row in self.index.compiled:
+            platform = row['Platform']
+            if not any(platform.match(i) for i in platforms):
+                continue
+            for name in self.index.index[row.row]['Template'].split(':'):
+                self._compiled(name)
+        return len(self._templates)
+
+    def parse(self, output, platform, command):
+        """Разбор вывода команды. Результат как у NetMiko: список словарей
+        с ключами в нижнем регистре, либо исходный вывод, если шаблона нет
+        или ничего не разобрано."""
+        row = self.index.GetRowMatch(
+            {'Platform': platform, 'Command': command})
+        if not row:
+            return output
+        names = self.index.index[row]['Template'].split(':')
+        if len(names) > 1:
+            # Слияние нескольких шаблонов по ключам делает CliTable
+            table = clitable.CliTable('index', self.template_dir)
+            table.ParseCmd(output, {'Platform': platform, 'Command': command})
+            header = [i.lower() for i in table.header]
+            records = [list(i) for i in table]
+        else:
+            fsm, lock = self._compiled(names[0])
+            with lock:
+                fsm.Reset()
+                records = fsm.ParseText(output)
+                header = [i.lower() for i in fsm.header]
+        result = [dict(zip(header, record)) for record in records]
+        return result or output
+
+
+_registry = None
+_registry_lock = threading.Lock()
+_pool = None
+
+
+def get_registry():
+    """Реестр шаблонов текущего процесса."""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = TemplateRegistry()
+                count = _registry.preload()
+                logging.info(f"Скомпилировано шаблонов TextFSM: {count}")
+    return _registry
+
+
+def _init_worker(template_dir):
+    os.environ["NET_TEXTFSM"] = template_dir
+    get_registry()
+
+
+def _parse_in_worker(output, platform, command):
+    return get_registry().parse(output, platform, command)
+
+
+def get_pool():
+    """Пул процессов для разбора. Запускается при первом обращении."""
+    global _pool
+    if _pool is None:
+        with _registry_lock:
+            if _pool is None:
+                # fork из многопоточного процесса небезопасен
+                methods = multiprocessing.get_all_start_methods()
+                context = multiprocessing.get_context(
+                    'forkserver' if 'forkserver' in methods else 'spawn')
+                _pool = ProcessPoolExecutor(
+                    max_workers=PARSE_WORKERS, mp_context=context,
+                    initializer=_init_worker,
+                    initargs=(get_template_dir(),))
+    return _pool
+
+
+def parse(output, platform, command):
+    """Разбор вывода TextFSM в пуле процессов (или в текущем потоке при
+    NET_PARSE_WORKERS=0). Поток сбора ждёт результат, не занимая GIL.
+
+    Args:
+        output (str): вывод команды
+        platform (str): device_type NetMiko
+        command (str): команда
+
+    Returns:
+        list или str: список словарей или исходный вывод
+    """
+    if PARSE_WORKERS == 0:
+        return get_registry().parse(output, platform, command)
+    return get_pool().submit(
+        _parse_in_worker, output, platform, command).result()
+
+
+async def parse_async(output, platform, command):
+    """Вариант parse для async_engine: event loop не блокируется."""
+    if PARSE_WORKERS == 0:
+        return get_registry().parse(output, platform, command)
+    return await asyncio.wrap_future(get_pool().submit(
+        _parse_in_worker, output, platform, command))
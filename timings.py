@@ -0,0 +1,152 @@
+import json
+import logging
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Каталог для выгрузки замеров (JSONL и textfile для node_exporter)
+TIMINGS_DIR = os.environ.get(
+    "NET_TIMINGS_DIR", "/usr/local/scripts/output/timings")
+SLOWEST = 20
+METRIC = 'netauto_phase_seconds'
+
+
+def percentile(values, share):
+    """Перцентиль методом ближайшего ранга по отсортированному списку."""
+    if not values:
+        return 0
+    rank = max(math.ceil(share * len(values)) - 1, 0)
+    return values[rank]
+
+
+class Timings:
+    """Замеры длительности по устройствам и фазам.
+
+    Фазы SSH: tcp_connect, ssh_login (обмен ключами и аутентификация -
+    paramiko выполняет их одним вызовом), prompt (подготовка сессии и
+    поиск приглашения), command, parse (TextFSM). Этапы скриптов
+    (СУБД, CMDB) пишутся с host=None.
+    """
+
+    def __init__(self):
+        self.records = []
+        self._lock = threading.Lock()
+
+    def add(self, host, phase, seconds, **labels):
+        """Добавление замера.
+
+        Args:
+            host (str): устройство или None для этапов скрипта
+            phase (str): фаза
+            seconds (float): длительность, сек
+            labels: дополнительные поля (command, device_type, ...)
+        """
+        record = {'ts': time.time(), 'host': host, 'phase': phase,
+                  'seconds': round(seconds, 6)}
+        record.update(labels)
+        with self._lock:
+            self.records.append(record)
+
+    @contextmanager
+    def phase(self, host, phase, **labels):
+        """Замер блока кода. Длительность пишется и при исключении."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(host, phase, time.perf_counter() - started, **labels)
+
+    def summary(self, slowest=SLOWEST):
+        """Сводка: p50/p95/p99 по фазам и самые медленные устройства.
+
+        Returns:
+            dict: {'phases': {фаза: {count, sum, p50, p95, p99}},
+            'slowest': [(host, секунды), ...]}
+        """
+        with self._lock:
+            records = list(self.records)
+        by_phase = {}
+        by_host = {}
+        for record in records:
+            by_phase.setdefault(record['phase'], []).append(record['seconds'])
+            if record['host'] is not None:
+                by_host[record['host']] = (
+                    by_host.get(record['host'], 0) + record['seconds'])
+        phases = {}
+        for phase, values in by_phase.items():
+            values.sort()
+            phases[phase] = {
+                'count': len(values),
+                'sum': round(sum(values), 3),
+                'p50': percentile(values, 0.5),
+                'p95': percentile(values, 0.95),
+                'p99': percentile(values, 0.99),
+            }
+        top = sorted(by_host.items(), key=lambda item: item[1], reverse=True)
+        return {'phases': phases,
+                'slowest': [(host, round(sec, 3)) for host, sec in top[
+                    :slowest]]}
+
+    def export_jsonl(self, path):
+        """Выгрузка всех замеров, по одному JSON на строку."""
+        with self._lock:
+            records = list(self.records)
+        with open(path, 'w') as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+    def export_prometheus(self, path, job):
+        """Выгрузка сводки в формате textfile collector node_exporter.
+        Файл пишется атомарно, как требует node_exporter."""
+        summary = self.summary()
+        lines = [
+            f'# HELP {METRIC} Длительность фаз опроса сетевых устройств',
+            f'# TYPE {METRIC} summary',
+        ]
+        for phase, stats in sorted(summary['phases'].items()):
+            labels = f'job="{job}",phase="{phase}"'
+            for name in ('p50', 'p95', 'p99'):
+                quantile = int(name[1:]) / 100
+                lines.append(
+                    f'{METRIC}{{{labels},quantile="{quantile}"}} '
+                    f'{stats[name]}')
+            lines.append(f'{METRIC}_sum{{{labels}}} {stats["sum"]}')
+            lines.append(f'{METRIC}_count{{{labels}}} {stats["count"]}')
+        lines.append(
+            '# HELP netauto_device_seconds Суммарное время по самым '
+            'медленным устройствам')
+        lines.append('# TYPE netauto_device_seconds gauge')
+        for host, seconds in summary['slowest']:
+            lines.append(
+                f'netauto_device_seconds{{job="{job}",host="{host}"}} '
+                f'{seconds}')
+        tmp = f"{path}.tmp"
+        with open(tmp, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmp, path)
+
+    def export(self, job, directory=TIMINGS_DIR):
+        """Выгрузка JSONL и .prom в directory и сводка в лог.
+
+        Args:
+            job (str): имя скрипта, используется в именах файлов
+            directory (str, optional): каталог выгрузки
+        """
+        summary = self.summary()
+        logging.info("*"*60)
+        logging.info("Длительность фаз: p50 / p95 / p99, сек (кол-во)")
+        for phase, stats in sorted(summary['phases'].items()):
+            logging.info(
+                f"{phase}: {stats['p50']:.3f} / {stats['p95']:.3f} / "
+                f"{stats['p99']:.3f} ({stats['count']})")
+        logging.info(f"Самые медленные устройства: {summary['slowest']}")
+        logging.info("*"*60)
+        os.makedirs(directory, exist_ok=True)
+        self.export_jsonl(os.path.join(directory, f"{job}.jsonl"))
+        self.export_prometheus(os.path.join(directory, f"{job}.prom"), job)
+
+
+# Замеры на весь процесс
+TIMINGS = Timings()
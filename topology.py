@@ -0,0 +1,267 @@
+import heapq
+import json
+import os
+from collections import deque
+
+# Состояние топологии между запусками update_cmdb_switches
+TOPOLOGY_STATE = os.environ.get(
+    "NET_TOPOLOGY_STATE", "/usr/local/scripts/output/topology.json")
+
+
+def adjacency_from_edges(edges, hosts):
+    """Соседство по рёбрам LLDP (lldp.EdgeIndex или список LldpEdge).
+    Соседство считается двусторонним, даже если LLDP видит только
+    одна сторона.
+
+    Args:
+        edges (iterable): рёбра LldpEdge
+        hosts (iterable): коммутаторы, между которыми строится дерево
+
+    Returns:
+        dict: hostname: список соседей
+    """
+    adjacency = {host: [] for host in hosts}
+    seen = set()
+    for edge in edges:
+        pair = (edge.local_host, edge.remote_host)
+        if pair in seen or pair[0] == pair[1]:
+            continue
+        if pair[0] not in adjacency or pair[1] not in adjacency:
+            continue
+        seen.update((pair, pair[::-1]))
+        adjacency[pair[0]].append(pair[1])
+        adjacency[pair[1]].append(pair[0])
+    return adjacency
+
+
+def _pairs(adjacency):
+    return {frozenset((host, neighbor))
+            for host, neighbors in adjacency.items() for neighbor in neighbors}
+
+
+class Topology:
+    """Дерево подключений коммутаторов (Parent unit) по соседству LLDP.
+
+    Родители назначаются обходом в ширину сразу от всех корней (ядер),
+    O(V+E). Каждый коммутатор подключается к ближайшему по числу
+    переходов соседу, при равенстве - к найденному первым. По дереву
+    строится обход Эйлера: проверка "X под Y" - O(1), поддерево -
+    срез списка.
+
+    Args:
+        adjacency (dict): hostname: список соседей. Соседи, которых нет
+        среди ключей, не учитываются.
+        roots (list): корни дерева (ядро)
+    """
+
+    def __init__(self, adjacency, roots):
+        self.adjacency = self._clean(adjacency)
+        self.roots = [root for root in roots if root in self.adjacency]
+        self.parent = {}
+        self.depth = {}
+        self._assign()
+        self._index()
+
+    @staticmethod
+    def _clean(adjacency):
+        return {host: [i for i in neighbors if i in adjacency and i != host]
+                for host, neighbors in adjacency.items()}
+
+    @classmethod
+    def from_edges(cls, edges, hosts, roots):
+        """Топология по рёбрам LLDP, см. adjacency_from_edges.
+
+        Args:
+            edges (iterable): рёбра LldpEdge
+            hosts (iterable): коммутаторы, между которыми строится дерево
+            roots (list): корни дерева
+        """
+        return cls(adjacency_from_edges(edges, hosts), roots)
+
+    def save(self, path=TOPOLOGY_STATE):
+        """Сохранение соседства и дерева в JSON (атомарно)."""
+        state = {'roots': self.roots, 'adjacency': self.adjacency,
+                 'parent': self.parent, 'depth': self.depth}
+        tmp = f"{path}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump(state, f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path=TOPOLOGY_STATE):
+        """Топология прошлого запуска без пересчёта. Если файла нет - None."""
+        if not os.path.isfile(path):
+            return None
+        with open(path) as f:
+            state = json.load(f)
+        topology = cls.__new__(cls)
+        topology.adjacency = state['adjacency']
+        topology.roots = state['roots']
+        topology.parent = state['parent']
+        topology.depth = state['depth']
+        topology._index()
+        return topology
+
+    def update(self, adjacency, roots):
+        """Обновление дерева по новому соседству. Пересчитываются только
+        поддеревья под пропавшими линками и коммутаторами, а также
+        коммутаторы, которым новые линки дают путь короче. Остальные
+        сохраняют Parent unit, даже если есть равноценная альтернатива.
+
+        Args:
+            adjacency (dict): новое соседство, hostname: список соседей
+            roots (list): корни дерева
+
+        Returns:
+            dict: hostname: (прежний Parent unit, новый) для изменившихся
+        """
+        adjacency = self._clean(adjacency)
+        roots = [root for root in roots if root in adjacency]
+        before = self.parents()
+        if roots != self.roots:
+            self.__init__(adjacency, roots)
+            return self._changes(before)
+        old_pairs, new_pairs = _pairs(self.adjacency), _pairs(adjacency)
+        # Поддеревья, потерявшие путь к корню
+        invalid = set()
+        for host in self.adjacency:
+            if host not in adjacency:
+                invalid.update(self.subtree(host))
+        for pair in old_pairs - new_pairs:
+            first, second = tuple(pair)
+            if self.parent.get(second) == first:
+                invalid.update(self.subtree(second))
+            elif self.parent.get(first) == second:
+                invalid.update(self.subtree(first))
+        for host in invalid:
+            self.parent.pop(host, None)
+            self.depth.pop(host, None)
+        self.adjacency = adjacency
+        # Обход от границы пересчитываемой области и от новых линков.
+        # Коммутатор получает нового родителя, только если путь короче.
+        seeds = set()
+        for host in invalid:
+            seeds.update(i for i in adjacency.get(host, ()) if i in self.depth)
+        for pair in new_pairs - old_pairs:
+            seeds.update(i for i in pair if i in self.depth)
+        for host in adjacency:
+            if host not in self.depth:
+                seeds.update(i for i in adjacency[host] if i in self.depth)
+        heap = [(self.depth[host], host) for host in seeds]
+        heapq.heapify(heap)
+        while heap:
+            depth, host = heapq.heappop(heap)
+            if self.depth.get(host) != depth:
+                continue
+            for neighbor in adjacency[host]:
+                if neighbor not in self.depth or \
+                        depth + 1 < self.depth[neighbor]:
+                    self.parent[neighbor] = host
+                    self.depth[neighbor] = depth + 1
+                    heapq.heappush(heap, (depth + 1, neighbor))
+        self._index()
+        return self._changes(before)
+
+    def _changes(self, before):
+        after = self.parents()
+        return {host: (before.get(host), after.get(host))
+                for host in set(before) | set(after)
+                if host in self.adjacency
+                and before.get(host) != after.get(host)}
+
+    def _assign(self):
+        """Обход в ширину от всех корней."""
+        queue = deque()
+        for root in self.roots:
+            self.parent[root] = None
+            self.depth[root] = 0
+            queue.append(root)
+        while queue:
+            host = queue.popleft()
+            for neighbor in self.adjacency[host]:
+                if neighbor not in self.depth:
+                    self.parent[neighbor] = host
+                    self.depth[neighbor] = self.depth[host] + 1
+                    queue.append(neighbor)
+
+    def _index(self):
+        """Дети и обход Эйлера по дереву."""
+        self.children = {host: [] for host in self.depth}
+        for host, parent in self.parent.items():
+            if parent is not None:
+                self.children[parent].append(host)
+        self.order = []
+        self._enter = {}
+        self._exit = {}
+        for root in self.roots:
+            stack = [(root, False)]
+            while stack:
+                host, done = stack.pop()
+                if done:
+                    self._exit[host] = len(self.order)
+                    continue
+                self._enter[host] = len(self.order)
+                self.order.append(host)
+                stack.append((host, True))
+                stack.extend(
+                    (child, False) for child in reversed(self.children[host]))
+
+    def parents(self):
+        """Parent unit по коммутаторам. У корней и недостижимых - нет."""
+        return {host: parent for host, parent in self.parent.items()
+                if parent is not None}
+
+    def path_to_root(self, host):
+        """Путь от host до ядра: [host, родитель, ..., корень].
+        Для недостижимого коммутатора - пустой список."""
+        if host not in self.depth:
+            return []
+        path = [host]
+        while self.parent[path[-1]] is not None:
+            path.append(self.parent[path[-1]])
+        return path
+
+    def is_under(self, host, ancestor):
+        """host находится в поддереве ancestor (или совпадает с ним)."""
+        if host not in self._enter or ancestor not in self._enter:
+            return False
+        return (self._enter[ancestor] <= self._enter[host]
+                < self._exit[ancestor])
+
+    def subtree(self, host):
+        """Коммутаторы в поддереве host, начиная с него самого."""
+        if host not in self._enter:
+            return []
+        return self.order[self._enter[host]:self._exit[host]]
+
+    def unreachable(self):
+        """Коммутаторы, до которых нет пути от корней."""
+        return [host for host in self.adjacency if host not in self.depth]
+
+    def loops(self):
+        """Рёбра вне дерева между достижимыми коммутаторами. Каждое такое
+        ребро замыкает кольцо (резервный линк или петля)."""
+        result = []
+        for host, neighbors in self.adjacency.items():
+            if host not in self.depth:
+                continue
+            for neighbor in neighbors:
+                if host < neighbor and neighbor in self.depth and \
+                        self.parent[host] != neighbor and \
+                        self.parent[neighbor] != host:
+                    result.append((host, neighbor))
+        return result
+
+    def dual_homed(self):
+        """Коммутаторы с несколькими аплинками на уровень ближе к ядру.
+
+        Returns:
+            dict: hostname: список возможных Parent unit
+        """
+        result = {}
+        for host, depth in self.depth.items():
+            uplinks = [i for i in self.adjacency[host]
+                       if self.depth.get(i) == depth - 1]
+            if len(uplinks) > 1:
+                result[host] = uplinks
+        return result
@@ -2,12 +2,15 @@
 import json
 import logging
 import os
-import re
 from configparser import ConfigParser
 
-import jirainsight
-from discovernetmiko import build_device_list
-from send_commands import send_commands_parallel
+import cmdb_sync
+from cmdb_executor import write_report
+from cmdb_mirror import CmdbMirror
+from discover_netmiko import build_device_list, update_device_list
+from field_extractor import FieldExtractor
+from send_commands import iter_commands_parallel
+from timings import TIMINGS
 from xfunctions import normalize_name, write_result_to_json
 
 # Настройки логирования
@@ -23,6 +26,9 @@ config.read(CONFIGFILE)
 netLogin = config.get('net', 'wifi_login', fallback='not exists')
 netPassword = config.get('net', 'wifi_password', fallback='not exists')
 network = config.get('net', 'network', fallback='not exists')
+# Инкрементальное обновление списка устройств вместо доверия старому дампу
+incremental = config.getboolean('net', 'incremental', fallback=False)
+maxMissed = config.getint('net', 'max_missed', fallback=3)
 # threads = int(config.get('net', 'threads', fallback='not exists'))
 cmdbURL = config.get('cmdb', 'cmdbURL', fallback='not exists')
 cmdbLogin = config.get('cmdb', 'cmdbLogin', fallback='not exists')
@@ -33,10 +39,26 @@ cmdbObjectTypeName = config.get(
     'cmdb', 'cmdbObjectTypeName', fallback='not exists')
 
 
-def parse_data(search, data):
-    match = re.search(search, data)
-    if match:
-        return match.groups()[0]
+LLDP_COMMAND = 'show ap debug lldp neighbor interface bond0'
+# Поля CMDB по командам. Шаблоны компилируются один раз, вывод
+# просматривается построчно за один проход. Не найденное поле - None.
+INVENTORY_FIELDS = {
+    'show version': FieldExtractor({
+        'Model': r'MODEL:\s+(\S+)\)',
+    }),
+    'show summary': FieldExtractor({
+        'Location': r'System Location\s+:(\S+ \S+)',
+        'IP-Address': r'^IP Address\s+:(\S+)',
+        'Serial Number': r'Serial Number\s+:(\S+)',
+    }),
+    'show interface': FieldExtractor({
+        'MAC-address Ethernet': (
+            r'address is\s+(\S+)', lambda mac: mac.replace(':', '-')),
+    }),
+    LLDP_COMMAND: FieldExtractor({
+        'Parent unit': (r'System name:\s+(\S+)', normalize_name),
+    }),
+}
 
 
 def get_inventory(devices):
@@ -60,37 +82,21 @@ def get_inventory(devices):
         result[hostname].update({'DNS-Name': f"{hostname}.npo.izhmash"})
         result[hostname].update({'Vendor': "HP"})
 
-    inventory = [
-        ('show version', False), ('show summary', False),
-        ('show ap debug lldp neighbor interface bond0', False),
-        ('show interface', False)
-    ]
+    inventory = [(command, False) for command in INVENTORY_FIELDS]
 
-    get_info = send_commands_parallel(
-        devices, inventory, limit=len(devices))
+    get_info = iter_commands_parallel(
+        devices, inventory)
 
     for record in get_info:
         for host, output in record.items():
             host = host.split('_')[0]
-            model = parse_data('MODEL:\s+(\S+)\)', output['show version'])
-            result[host]['Model'] = model
-            # name = parse_data('Name\s+:(\S+)', output['show summary'])
-            location = parse_data(
-                'System Location\s+:(\S+ \S+)', output['show summary'])
-            result[host]['Location'] = location
-            ip = parse_data("\nIP Address\s+:(\S+)", output['show summary'])
-            result[host]['IP-Address'] = ip
-            mac = parse_data('address is\s+(\S+)', output['show interface'])
-            mac = mac.replace(':', '-')
-            result[host]['MAC-address Ethernet'] = mac
-            sn = parse_data('Serial Number\s+:(\S+)', output['show summary'])
-            result[host]['Serial Number'] = sn
-            parent = parse_data(
-                'System name:\s+(\S+)',
-                output['show ap debug lldp neighbor interface bond0']
-            )
-            parent = normalize_name(parent)
-            result[host]['Parent unit'] = parent
+            for command, extractor in INVENTORY_FIELDS.items():
+                fields = extractor.extract(output[command])
+                missing = [name for name, value in fields.items()
+                           if value is None]
+                if missing:
+                    logging.warning(f"{host}: не найдены {missing}")
+                result[host].update(fields)
     return result
 
 
@@ -112,13 +118,17 @@ if __name__ == "__main__":
     logging.info("Часть 1. Работа с AP")
     filedump = "x_AP.json"
 
-    if os.path.isfile(filedump):
+    if incremental:
+        network_devices = update_device_list(
+            network, netLogin, netPassword, filedump, maxMissed)
+    elif os.path.isfile(filedump):
         with open(filedump) as f:
             network_devices = json.load(f)
     else:
         network_devices = build_device_list(
             network, netLogin, netPassword, filedump)
-    inventory_data = get_inventory(network_devices)
+    with TIMINGS.phase(None, 'inventory'):
+        inventory_data = get_inventory(network_devices)
 
     # write_result_to_json(inventory_data, filedump)
 
@@ -134,25 +144,22 @@ if __name__ == "__main__":
     logging.info("Часть 3. Начинаем работу с CMDB")
     logging.info("*"*60)
 
-    raw_list = [device for device in ap_json.values()]
-
-    jira = jirainsight.Insight(cmdbURL, cmdbLogin, cmdbPassword)
-    schema = jirainsight.InsightSchema(jira, cmdbObjectSchemaName)
-    schema_obj_type = schema.get_object_type(cmdbObjectTypeName)
-
-    source = jirainsight.DataSource(raw_list, schema_obj_type)
-    mixer = jirainsight.Mixer(source, schema)
-    update_objects = mixer.make_dicts_for_update_schema_objects()
-    failed = []
-    for key, value in update_objects.items():
-        mixer.object_type.objects
-        schema_object = mixer.object_type.objects[key]
-        try:
-            schema_object.update_object(value)
-        except Exception as e:
-            print(e)
-            print(e.response.content)
-            failed.append(key)
+    # Объекты типа точек доступа - из локальной копии CMDB, как у
+    # update_cmdb_switches: ищутся по имени и серийному номеру, в CMDB уходят
+    # только изменившиеся атрибуты. Ссылочные атрибуты (Parent unit,
+    # Location ...) пишутся objectKey объекта из копии типа, на который
+    # ссылаются
+    with TIMINGS.phase(None, 'cmdb_load'):
+        mirror = CmdbMirror(
+            cmdbURL, cmdbLogin, cmdbPassword, cmdbObjectSchemaName)
+        schema_obj_type = mirror.get_object_type(cmdbObjectTypeName)
+        updates, missing = cmdb_sync.plan(
+            schema_obj_type, ap_json, references=schema_obj_type.references)
+    # Запись параллельно, с ограничением частоты и повторами при 429/5xx
+    with TIMINGS.phase(None, 'cmdb_update'):
+        failed = cmdb_sync.apply(schema_obj_type, updates)
+    write_report(failed, 'update_cmdb_AP')
+    TIMINGS.export('update_cmdb_AP')
 
     logging.info("*"*60)
     logging.info("Завершение работы скрипта")
@@ -5,10 +5,15 @@ import os
 import re
 from configparser import ConfigParser
 
-import jirainsight
-from discovernetmiko import build_device_list
-from send_commands import send_commands_parallel
-from xfunctions import normalize_name, write_result_to_json
+import cmdb_sync
+from cmdb_executor import read_report, write_report
+from cmdb_mirror import CmdbMirror
+from discover_netmiko import build_device_list, update_device_list
+from lldp import LLDP_COMMANDS, EdgeIndex, parse_lldp
+from send_commands import iter_commands_parallel
+from timings import TIMINGS
+from topology import Topology, adjacency_from_edges
+from xfunctions import write_result_to_json
 
 # Настройки логирования
 logging.basicConfig(
@@ -23,7 +28,13 @@ config.read(CONFIGFILE)
 netLogin = config.get('net', 'netLogin', fallback='not exists')
 netPassword = config.get('net', 'netPassword', fallback='not exists')
 network = config.get('net', 'network', fallback='not exists')
+# Инкрементальное обновление списка устройств вместо доверия старому дампу
+incremental = config.getboolean('net', 'incremental', fallback=False)
+maxMissed = config.getint('net', 'max_missed', fallback=3)
 # threads = int(config.get('net', 'threads', fallback='not exists'))
+# Ядра сети - корни топологии, через запятую
+coreSwitches = [i.strip() for i in config.get(
+    'net', 'core_switches', fallback='x-SW-ZU-COR-01').split(',') if i.strip()]
 cmdbURL = config.get('cmdb', 'cmdbURL', fallback='not exists')
 cmdbLogin = config.get('cmdb', 'cmdbLogin', fallback='not exists')
 cmdbPassword = config.get('cmdb', 'cmdbPassword', fallback='not exists')
@@ -31,6 +42,9 @@ cmdbObjectSchemaName = config.get(
     'cmdb', 'object_schema_name', fallback='not exists')
 cmdbObjectTypeName = config.get(
     'cmdb', 'cmdbObjectTypeName', fallback='not exists')
+# Модели коммутаторов в CMDB, по ним заполняется Vendor
+cmdbModelTypeName = config.get(
+    'cmdb', 'cmdbModelTypeName', fallback='Model Switches[x]')
 
 
 def get_inventory(devices):
@@ -65,7 +79,8 @@ def get_inventory(devices):
         result[hostname].update({'IsStack': False})
     device_types = set([i['device_type'] for i in devices])
     """ Подключение к устройствам по их платформе. Т.к. с разным оборудованием
-    необходимы разные команды и обработки """
+    необходимы разные команды и обработки. Вывод каждого устройства
+    обрабатывается сразу по получении """
 
     for type in device_types:
         list_type = [i for i in devices if i["device_type"] == type]
@@ -73,23 +88,24 @@ def get_inventory(devices):
         if type == "cisco_s300":
             s300_commands = [
                 ('show inventory', False), ('show system', True),
-                ('show lldp neighbors', False)]
+                (LLDP_COMMANDS[type], False)]
 
-            s300_inventory = send_commands_parallel(
-                list_type, s300_commands, limit=len(list_type))
+            s300_inventory = iter_commands_parallel(
+                list_type, s300_commands)
             for record in s300_inventory:
                 for host, output in record.items():
                     result[host]['Model'] = output['show system'][0]['model']
                     result[host]['Vendor'] = 'Cisco'
                     match = re.search(r'SN:\s+(\S+)', output['show inventory'])
                     result[host]['Serial Number'] = match.groups()[0]
-                    result[host]['lldp'] = output['show lldp neighbors']
+                    result[host]['lldp'] = parse_lldp(
+                        host, output[LLDP_COMMANDS[type]], type)
 
         else:
             others_commands = [
-                ('show version', True), ('show lldp neighbors detail', False)]
-            others_inventory = send_commands_parallel(
-                list_type, others_commands, limit=len(list_type))
+                ('show version', True), (LLDP_COMMANDS[type], False)]
+            others_inventory = iter_commands_parallel(
+                list_type, others_commands)
 
             for record in others_inventory:
                 for host, output in record.items():
@@ -129,89 +145,86 @@ def get_inventory(devices):
                                 result[hostname]['Vendor'] = 'Ruckus'
                                 stack_members.append(hostname)
                             result[host]['Stack Members'] = stack_members
-                    result[host]['lldp'] = output['show lldp neighbors detail']
+                    result[host]['lldp'] = parse_lldp(
+                        host, output[LLDP_COMMANDS[type]], type)
         logging.info(f"Опрос {type} завершён")
     return result
 
 
-def build_topology(switches):
-    """Определение Parent коммутатора
+def build_topology(switches, roots=None):
+    """Определение Parent коммутатора по соседству LLDP
+
+    При incremental топология прошлого запуска обновляется по разнице
+    соседства: пересчитываются только затронутые поддеревья. Иначе дерево
+    строится заново и сравнивается с сохранённым в прошлый раз.
 
     Args:
         switches (dict): Возвращение устройств с Parent unit
-    """
-    # TODO: Hardcode убрать.
-    core = 'x-SW-ZU-COR-01'
-    switches[core]['Parent unit'] = {}
-    logging.info(f"Для {core} задано пустое значение.")
-
-# В этот список будут добавляться устройства для обработки
-    check_devices = []
-    logging.info("-"*50)
-    logging.info(f"Парсинг LLDP информации устройств")
-    logging.info("-"*50)
+        roots (list, optional): ядра сети. По умолчанию coreSwitches.
 
-    for switch in switches:
-        if switches[switch].get('lldp'):
-            # Ищем все записи начинающиеся с 'x-S'
-            # TODO: Hardcode убрать.
-            connected_devices = re.finditer(
-                r'(x-S\S+)', switches[switch]['lldp'])
-            list_connected_dev = []
-            for system_name in connected_devices:
-                name = system_name.group(1)
-                name = normalize_name(name)
-                list_connected_dev.append(name)
-            switches[switch]['lldp'] = list_connected_dev
-
-    logging.info("-"*50)
-    logging.info(f"Парсинг LLDP завершен")
-    logging.info("-"*50)
-    logging.info(f"Обработка подключенных к {core} устройств.")
+    Returns:
+        tuple: switches с Parent unit, без lldp; словарь изменившихся
+        с прошлого запуска Parent unit hostname: (прежний, новый). Без
+        сохранённой топологии изменившимися считаются все.
+    """
+    roots = roots or coreSwitches
     logging.info("-"*50)
-
-    # Перебираем устройства 1-ого уровня. Подключенных к ядру.
-    for switch in switches[core]['lldp']:
-        logging.info(f"Обработка {switch} подключенного к {core}")
-        switches[switch]['Parent unit'] = core
-        check_devices.append(switch)
-
-    logging.info(f"Обработка устройств подключенных к {core} завершена")
+    logging.info(f"Построение топологии от {roots}")
     logging.info("-"*50)
+    edges = EdgeIndex(
+        edge for switch in switches.values()
+        for edge in switch.get('lldp') or ())
+    # Участники стека (hostname_N) LLDP не опрашивались
+    adjacency = adjacency_from_edges(
+        edges, [host for host in switches if 'lldp' in switches[host]])
+    topology = Topology.load()
+    if topology is None:
+        topology = Topology(adjacency, roots)
+        changed = {host: (None, parent)
+                   for host, parent in topology.parents().items()}
+    else:
+        if incremental:
+            changed = topology.update(adjacency, roots)
+        else:
+            before = topology.parents()
+            topology = Topology(adjacency, roots)
+            after = topology.parents()
+            changed = {host: (before.get(host), after.get(host))
+                       for host in set(before) | set(after)
+                       if host in adjacency
+                       and before.get(host) != after.get(host)}
+        logging.info(f"Изменился Parent unit у {len(changed)} устройств")
+        for host, (old, new) in changed.items():
+            logging.info(f"{host}: {old} -> {new}")
+    topology.save()
+    for host, parent in topology.parents().items():
+        switches[host]['Parent unit'] = parent
+    # Потерявшие путь к ядру: Parent unit в CMDB очищается, а не остаётся
+    # прежним аплинком
+    for host, (old, new) in changed.items():
+        if new is None and host in switches:
+            switches[host]['Parent unit'] = None
+
+    unreachable = topology.unreachable()
+    loops = topology.loops()
+    dual_homed = topology.dual_homed()
     logging.info(
-        f"Перебор списка из {len(check_devices)} устройств на проверку")
-    # Перебор устройств перевого уровня с добавлением следующих уровней
-    for check_device in check_devices:
-        logging.info(f"Обработка {check_device}")
-        for linked_device in switches[check_device]['lldp']:
-            if switches.get(linked_device):
-                if switches[linked_device].get('Parent unit') is None:
-                    logging.info(
-                        f"{linked_device} указываем Parent Unit и на проверку")
-                    switches[linked_device]['Parent unit'] = check_device
-
-                    # Проверка, что есть LLDP с данного устройства.
-
-                    if switches[check_device]['lldp'] is not None:
-                        check_devices.append(linked_device)
-                    else:
-                        logging.info(f"По {check_device} отсутствует LLDP.")
-                else:
-                    logging.info(
-                        f"""{linked_device} уже имеет UpLink на
-                        {switches[linked_device]['Parent unit']}""")
-
-        logging.info(f"{check_device} обработан")
-        logging.info("-"*50)
-    logging.info("Завершено. Построен словарь UpLink устройств.")
-    logging.info(f"В словаре {len(switches)} устройств.")
+        f"Parent unit определён для {len(topology.parents())} "
+        f"из {len(switches)} устройств")
+    if unreachable:
+        logging.warning(
+            f"Нет пути до ядра у {len(unreachable)}: {unreachable[:20]}")
+    if loops:
+        logging.warning(f"Кольца по LLDP ({len(loops)}): {loops[:20]}")
+    if dual_homed:
+        logging.warning(
+            f"Несколько аплинков у {len(dual_homed)}: "
+            f"{list(dual_homed.items())[:20]}")
     logging.info("-"*50)
-    logging.info(f"Cleaning")
-    del switches[core]['Parent unit']
     for device in switches:
-        if switches[device].get('lldp'):
+        if 'lldp' in switches[device]:
             del switches[device]['lldp']
-    return switches
+    return switches, changed
 
 
 def build_json(devices):
@@ -236,67 +249,86 @@ def build_json(devices):
     return devices
 
 
+def fill_vendors(devices, models):
+    """Vendor устройств по модели из CMDB: если у объекта модели с именем
+    Model указан Vendor, он заменяет определённый по выводу команд.
+
+    Args:
+        devices (dict): hostname: атрибуты устройства
+        models: тип объектов моделей CMDB
+    """
+    vendors = {}
+    for model in models.objects.values():
+        attribute = model.attributes.get('Vendor')
+        if attribute is not None and attribute.value:
+            vendors[model.name] = attribute.value
+    for fields in devices.values():
+        vendor = vendors.get(fields.get('Model'))
+        if vendor:
+            fields['Vendor'] = vendor
+    return devices
+
+
 if __name__ == "__main__":
     logging.info("*"*60)
     logging.info("Начало работы скрипта")
     logging.info("*"*60)
     logging.info("Часть 1. Работа с коммутаторами")
     filedump = "/usr/local/scripts/output/x_switches.json"
-    if os.path.isfile(filedump):
+    if incremental:
+        x_switches = update_device_list(
+            network, netLogin, netPassword, filedump, maxMissed)
+    elif os.path.isfile(filedump):
         with open(filedump) as f:
             x_switches = json.load(f)
     else:
         x_switches = build_device_list(
             network, netLogin, netPassword, filedump)
-    inventory_data = get_inventory(x_switches)
+    with TIMINGS.phase(None, 'inventory'):
+        inventory_data = get_inventory(x_switches)
+    # Рёбра LLDP для dump_mac_addresses: исключение межкоммутаторных портов
+    EdgeIndex(edge for data in inventory_data.values()
+              for edge in data.get('lldp') or ()).save()
     # write_result_to_json(inventory_data, filedump)
 
     logging.info("Работа с коммутаторами завершена")
     logging.info("*"*60)
     logging.info("Часть 2. Обработка полученной информации")
     logging.info("*"*60)
-    topology = build_topology(inventory_data)
+    with TIMINGS.phase(None, 'topology'):
+        topology, parent_changes = build_topology(inventory_data)
+    cmdb_json = build_json(topology)
     write_result_to_json(cmdb_json, 'cmdb.json')
     logging.info("Обработка завершена")
     logging.info("*"*60)
     logging.info("Часть 3. Начинаем работу с CMDB")
     logging.info("*"*60)
 
-# Список всех объектов по типу объекта - "Ethernet Switches[x]"
-    objectList = get_objectinsight(
-        cmdbURL, cmdbObjectSchemaName, cmdbLogin,
-        cmdbPassword, cmdbObjectTypeName)
-
-# Загрузка информации по производителям для заполнения Vendor у устройств.
-    models_cmdb = get_objectinsight(
-        cmdbURL, cmdbObjectSchemaName, cmdbLogin,
-        cmdbPassword, "Model Switches[x]")
-
-# Список атрибутов по типу объекта - "Ethernet Switches[x]"
-    objtypeattrlist = objectList['objectTypeAttributes']
-
-# Определяем ID у типа объекта - "Ethernet Switches[x]"
-    ObjectTypeID = get_objecttypes(
-        cmdbURL, cmdbObjectSchemaName, cmdbLogin, cmdbPassword,
-        cmdbObjectTypeName)[0]['id']
-
-    logging.info("Обработка завершена")
-    logging.info("*"*60)
-    logging.info(
-        "Часть 4. Заставляем CMDB и сетевые устройства ебаться вместе")
-    logging.info("*"*60)
-
-    for device, params in cmdb_json.items():
-        logging.info(f"Начинаю работу с {device}")
-
-        ObjectFromCMDB = None
-        ObjectFromCMDB = [
-            object for object in objectList['objectEntries']
-            if object['name'] == device]
-
-        update_objectinsight(
-            cmdbURL, cmdbObjectSchemaName, ObjectFromCMDB, objtypeattrlist,
-            cmdbObjectTypeName, cmdbLogin, cmdbPassword, params, ObjectTypeID)
+    # Объекты типа "Ethernet Switches[x]" - из локальной копии CMDB, ищутся
+    # по имени и серийному номеру, в CMDB уходят только изменившиеся атрибуты
+    with TIMINGS.phase(None, 'cmdb_load'):
+        mirror = CmdbMirror(
+            cmdbURL, cmdbLogin, cmdbPassword, cmdbObjectSchemaName)
+        schema_obj_type = mirror.get_object_type(cmdbObjectTypeName)
+        fill_vendors(cmdb_json, mirror.get_object_type(
+            cmdbModelTypeName, references=False))
+        # Parent unit сверяется только у устройств, где он изменился с
+        # прошлого запуска или не записался в прошлый раз, остальные
+        # атрибуты - у всех
+        check_parent = set(parent_changes) | {
+            i['name'] for i in read_report('update_cmdb_switches').values()}
+        devices = {host: {name: value for name, value in fields.items()
+                          if name != 'Parent unit' or host in check_parent}
+                   for host, fields in cmdb_json.items()}
+        # Ссылочные атрибуты (Parent unit, Model, Vendor, Location ...)
+        # пишутся objectKey объекта из копии типа, на который ссылаются
+        updates, missing = cmdb_sync.plan(
+            schema_obj_type, devices, references={
+                'Parent unit': schema_obj_type, **schema_obj_type.references})
+    with TIMINGS.phase(None, 'cmdb_update'):
+        failed = cmdb_sync.apply(schema_obj_type, updates)
+    write_report(failed, 'update_cmdb_switches')
+    TIMINGS.export('update_cmdb_switches')
     logging.info("*"*60)
     logging.info("Завершение работы скрипта")
     logging.info("*"*60)
@@ -1,7 +1,7 @@
 import configparser
 import logging
 
-import jirainsight
+from cmdb_mirror import CmdbMirror
 from jira import JIRA
 
 CONFIGFILE = '/usr/local/scripts/configs/config_cmdb.ini'
@@ -86,8 +86,7 @@ def main():
                     logging.info(
                         f"Задача для {object.name} существует. Пропуск")
                     continue
-            obj_url = (
-                schema_obj_type._objects[id].object_json['_links']['self'])
+            obj_url = object.object_json['_links']['self']
             issue_dict = {
                 'project': {'id': project.id},
                 'summary': SUBJECT_ISSUE.format(name=object.name),
@@ -123,8 +122,8 @@ if __name__ == '__main__':
     jira_options = {'server': url}
     jira = JIRA(options=jira_options, basic_auth=(login, password))
     project = jira.project(PROJECT_NAME)
-    insight = jirainsight.Insight(url, login, password)
-    schema = jirainsight.InsightSchema(insight, schema_name)
-    schema_obj_type = schema.get_object_type(CMDB_OBJECT_TYPE_NAME)
+    # Объекты из локальной копии CMDB, загружаются только изменённые
+    mirror = CmdbMirror(url, login, password, schema_name)
+    schema_obj_type = mirror.get_object_type(CMDB_OBJECT_TYPE_NAME)
     main()
     logging.info(f"Работа скрипта завершена")